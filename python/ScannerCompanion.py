@@ -1,17 +1,19 @@
 from guizero import App, Text, TextBox, PushButton, Slider, Box
-import RPi.GPIO as GPIO
-import time
-from picamera import PiCamera
 import os #for file management, creating directories, etc.
-import dslrCapture as dslr #gphoto2 module capture script
+from hardware import clock, loadGPIO, loadCamera, loadDSLR
 from fractions import Fraction
 from mapRange import MapRange
+from stepper import Stepper, StepTimer, pulseSteps
+from motion import planMove
 
+#Set SCANNER_BACKEND=sim to run against simulated pins, PiCamera and DSLR (see hardware.py)
+GPIO = loadGPIO()
+dslr = loadDSLR() #gphoto2 module capture script
 camera = 0
 
 def buildCamera():
 
-    camera = PiCamera() #Make sure camera is enabled in preferences
+    camera = loadCamera() #Make sure camera is enabled in preferences
     camera.resolution = (4056, 3040)
     #camera.iso = 200 #Higher value is brighter
     #camera.awb_mode = 'auto'
@@ -74,7 +76,12 @@ sliderPosition = 0
 turnTablePosition = 0
 
 #Sleep and pauses
-sleepTime = 0.002 #time in between motor steps PiCam stepper
+sleepTime = 0.002 #time in between motor steps PiCam stepper (cruise rate of forward/reverse)
+homeSleepTime = 0.001 #cruise step delay for the goHome() return trip
+startSleepTime = 0.002 #step delay at the start and end of a ramped move, safe from rest
+railAcceleration = 1500 #PiCam stepper acceleration in steps/sec^2
+motionProfile = 'trapezoid' #'constant', 'trapezoid' or 's-curve'
+stepSpinTime = 0.0002 #last part of every step delay is busy-waited instead of slept, for tighter step timing
 nemaSleepTime = 0.001 #time between steps (Nema 17) turntable stepper (half-step microstepping)
 nema2SleepTime = 0.0001 #DSLR stepper (40:1) reduction on the motor, half-step microstepping on the driver
 shotPause = 2 #time between motor moves and shots - to settle camera
@@ -97,10 +104,8 @@ GPIO.setmode(GPIO.BCM)
 GPIO.setwarnings(False)
 
 #PiCam stepper pin init
-GPIO.setup(in1_2, GPIO.OUT)
-GPIO.setup(in2_2, GPIO.OUT)
-GPIO.setup(in3_2, GPIO.OUT)
-GPIO.setup(in4_2, GPIO.OUT)
+railMotor = Stepper(GPIO, (in1_2, in2_2, in3_2, in4_2), stepSpinTime)
+nemaTimer = StepTimer(stepSpinTime) #deadline pacing for the Nema 17 step pulses
 
 #Turntable pin init
 #GPIO.setup(enablePin, GPIO.OUT)
@@ -130,28 +135,18 @@ def clockwise():
     global cyclesRotation
     segment = cyclesRotation
     print("Clockwise: " + str(segment/9.4) + " degrees")
-    while (segment > 0):
-        GPIO.output(enablePin, GPIO.LOW)
-        GPIO.output(dirPin, GPIO.LOW)
-        GPIO.output(stepPin, GPIO.HIGH)
-        time.sleep(nemaSleepTime)
-        GPIO.output(stepPin, GPIO.LOW)
-        time.sleep(nemaSleepTime)
-        segment -= 1
+    GPIO.output(enablePin, GPIO.LOW)
+    GPIO.output(dirPin, GPIO.LOW)
+    pulseSteps(GPIO, stepPin, segment, nemaSleepTime, nemaTimer)
     disableMotors()
         
 def counterClockwise():
     global cyclesRotation
     segment = cyclesRotation
     print("Counter-Clockwise: " + str(segment/9.4) + " degrees")
-    while (segment > 0):
-        GPIO.output(enablePin, GPIO.LOW)
-        GPIO.output(dirPin, GPIO.HIGH)
-        GPIO.output(stepPin, GPIO.HIGH)
-        time.sleep(nemaSleepTime)
-        GPIO.output(stepPin, GPIO.LOW)
-        time.sleep(nemaSleepTime)
-        segment -= 1
+    GPIO.output(enablePin, GPIO.LOW)
+    GPIO.output(dirPin, GPIO.HIGH)
+    pulseSteps(GPIO, stepPin, segment, nemaSleepTime, nemaTimer)
     disableMotors()
 
 #DSLR Slider
@@ -162,7 +157,7 @@ def dslrForwardPWM():
     segment = dslrCyclesLinear/10
     p = GPIO.PWM(dslrStepPin, 3000)
     p.start(50)
-    time.sleep(segment)
+    clock.sleep(segment)
     p.stop()
     disableMotors()
 
@@ -177,7 +172,7 @@ def dslrForward():
     print("Moving Forward by: " + str(segment))
     while (segment > 0):
         GPIO.output(forwardPin, GPIO.HIGH)
-        time.sleep(0.1)
+        clock.sleep(0.1)
         GPIO.output(forwardPin, GPIO.LOW)
         segment -= 1
         
@@ -190,7 +185,7 @@ def dslrReverse():
     print("Moving in Reverse by: " + str(segment))
     while (segment > 0):
         GPIO.output(reversePin, GPIO.HIGH)
-        time.sleep(0.1)
+        clock.sleep(0.1)
         GPIO.output(reversePin, GPIO.LOW)
         segment -= 1
     
@@ -205,9 +200,9 @@ def dslrReverse():
 #         GPIO.output(dslrEnablePin, GPIO.LOW)
 #         GPIO.output(dslrDirPin, GPIO.HIGH)
 #         GPIO.output(dslrStepPin, GPIO.HIGH)
-#         time.sleep(nema2SleepTime)
+#         clock.sleep(nema2SleepTime)
 #         GPIO.output(dslrStepPin, GPIO.LOW)
-#         time.sleep(nema2SleepTime)
+#         clock.sleep(nema2SleepTime)
 #         segment -= 1
 #     disableMotors()
 #         
@@ -222,13 +217,16 @@ def dslrReverse():
 #         GPIO.output(dslrEnablePin, GPIO.LOW)
 #         GPIO.output(dslrDirPin, GPIO.LOW)
 #         GPIO.output(dslrStepPin, GPIO.HIGH)
-#         time.sleep(nema2SleepTime)
+#         clock.sleep(nema2SleepTime)
 #         GPIO.output(dslrStepPin, GPIO.LOW)
-#         time.sleep(nema2SleepTime)
+#         clock.sleep(nema2SleepTime)
 #         segment -= 1
 #     disableMotors()
 
 #Raspberry Pi HQ Camera Slider
+def railPlan(cycles, cruise): #Per-step timing for a rail move of the given cycles (4 steps per cycle)
+    return planMove(cycles * 4, startSleepTime, cruise, railAcceleration, motionProfile)
+
 def forward():
     global cyclesLinear
     print("Your camera is moving forward in " + str(cyclesLinear) + " step increments")
@@ -236,59 +234,19 @@ def forward():
     sliderPosition += cyclesLinear
     segment = cyclesLinear
     print("Slider Position: " + str(sliderPosition))
-    while (segment > 0):
-        GPIO.output(in1_2, GPIO.HIGH)
-        GPIO.output(in2_2, GPIO.LOW)
-        GPIO.output(in3_2, GPIO.LOW)
-        GPIO.output(in4_2, GPIO.LOW)
-        time.sleep(sleepTime)
-        GPIO.output(in1_2, GPIO.LOW)
-        GPIO.output(in2_2, GPIO.HIGH)
-        GPIO.output(in3_2, GPIO.LOW)
-        GPIO.output(in4_2, GPIO.LOW)
-        time.sleep(sleepTime)
-        GPIO.output(in1_2, GPIO.LOW)
-        GPIO.output(in2_2, GPIO.LOW)
-        GPIO.output(in3_2, GPIO.HIGH)
-        GPIO.output(in4_2, GPIO.LOW)
-        time.sleep(sleepTime)
-        GPIO.output(in1_2, GPIO.LOW)
-        GPIO.output(in2_2, GPIO.LOW)
-        GPIO.output(in3_2, GPIO.LOW)
-        GPIO.output(in4_2, GPIO.HIGH)
-        time.sleep(sleepTime)
-        segment -= 1
+    railMotor.forward(segment, railPlan(segment, sleepTime))
     disableMotors()
     
-def reverse():
+def reverse(cruise=None):
     global cyclesLinear
     print("Your camera is moving in reverse in " + str(cyclesLinear) + " step increments")
     global sliderPosition
     sliderPosition -= cyclesLinear
     print("Slider Position: " + str(sliderPosition))
     segment = cyclesLinear
-    while (segment > 0):
-        GPIO.output(in1_2, GPIO.LOW)
-        GPIO.output(in2_2, GPIO.LOW)
-        GPIO.output(in3_2, GPIO.LOW)
-        GPIO.output(in4_2, GPIO.HIGH)
-        time.sleep(sleepTime)
-        GPIO.output(in1_2, GPIO.LOW)
-        GPIO.output(in2_2, GPIO.LOW)
-        GPIO.output(in3_2, GPIO.HIGH)
-        GPIO.output(in4_2, GPIO.LOW)
-        time.sleep(sleepTime)
-        GPIO.output(in1_2, GPIO.LOW)
-        GPIO.output(in2_2, GPIO.HIGH)
-        GPIO.output(in3_2, GPIO.LOW)
-        GPIO.output(in4_2, GPIO.LOW)
-        time.sleep(sleepTime)
-        GPIO.output(in1_2, GPIO.HIGH)
-        GPIO.output(in2_2, GPIO.LOW)
-        GPIO.output(in3_2, GPIO.LOW)
-        GPIO.output(in4_2, GPIO.LOW)
-        time.sleep(sleepTime)
-        segment -= 1
+    if cruise is None:
+        cruise = sleepTime
+    railMotor.reverse(segment, railPlan(segment, cruise))
     disableMotors()
 
 
@@ -297,14 +255,14 @@ def driveCW():
     global cyclesRotation
     seconds = cyclesRotation
     GPIO.output(cw_pin, GPIO.HIGH)
-    time.sleep(seconds)
+    clock.sleep(seconds)
     GPIO.output(cw_pin, GPIO.LOW)
     
 def driveCCW():
     global cyclesRotation
     seconds = cyclesRotation
     GPIO.output(ccw_pin, GPIO.HIGH)
-    time.sleep(seconds)
+    clock.sleep(seconds)
     GPIO.output(ccw_pin, GPIO.LOW)
 #Interface Functions
 def zeroSlider(): #Sets the current PiCam slider position as 'home'
@@ -323,10 +281,7 @@ def resetShotNumber(): #Not used in UI -- used inside routine
     print("Shot count is reset to 1")
     
 def disableMotors(): #Turns off the current to motors while they are not moving, decreases holding power, but keeps everything cool. *you should actually run this at boot, with the accompanying script
-    GPIO.output(in1_2, GPIO.LOW)
-    GPIO.output(in2_2, GPIO.LOW)
-    GPIO.output(in3_2, GPIO.LOW)
-    GPIO.output(in4_2, GPIO.LOW)
+    railMotor.release()
     #GPIO.output(enablePin, GPIO.HIGH)
     #GPIO.output(dslrEnablePin, GPIO.HIGH)
     print("Motors are disabled")
@@ -389,7 +344,7 @@ def goHome(): #PiCam slider moves back to 0
     global cyclesLinear
     temp = cyclesLinear
     cyclesLinear = sliderPosition
-    reverse()
+    reverse(homeSleepTime)
     cyclesLinear = temp
     print("PiCam is moved back to HOME")
     
@@ -416,9 +371,9 @@ def runStackRoutine(): #With current settings,
     global numberShots
     for x in range(0,numberShots):
         shoot()
-        time.sleep(shotPause)
+        clock.sleep(shotPause)
         forward()
-        time.sleep(shotPause)
+        clock.sleep(shotPause)
     print("PiCam done with stack #" + str(stackNumber))
     stackNumber += 1
     resetShotNumber()
@@ -437,9 +392,9 @@ def dslrStack():
     global numberShots
     for x in range(0,numberShots):
         dslrTrigger()
-        time.sleep(dslrShotPause)
+        clock.sleep(dslrShotPause)
         dslrForward()
-        time.sleep(dslrShotPause)
+        clock.sleep(dslrShotPause)
     print("DSLR done with stack #" + str(stackNumber))
     stackNumber += 1
     resetShotNumber()
@@ -0,0 +1,239 @@
+import json
+import os
+import numpy as np
+
+# Stack alignment
+# Moving the camera along the rail changes the magnification a little from
+# frame to frame (focus breathing) and the rail wanders slightly sideways, so
+# frames fused as they are leave halos around edges. Each frame is matched to
+# the frame shot before it by phase correlation on downsampled copies: the
+# scale is found by trying a handful of magnifications on a coarse level and
+# refining on a finer one, then the shift is measured at the best scale.
+# Transforms are chained back to the first frame of the stack and cached in
+# <stack folder>_align.json, where any later fuse picks them up, along with
+# which shot that reference frame was (poses.py gives a fused stack its pose).
+#
+# A transform maps frame coordinates to reference coordinates about the image centre:
+#   reference = scale * (frame - centre) + centre + (dx, dy)
+
+IDENTITY = {"scale": 1.0, "dx": 0.0, "dy": 0.0}
+
+def downsample(image, factor): # Block mean over factor x factor pixels as float32, ragged edges dropped
+    height = image.shape[0] // factor * factor
+    width = image.shape[1] // factor * factor
+    total = np.uint16 if image.dtype == np.uint8 and factor <= 16 else np.float32 # uint16 sums are exact and faster
+    rows = image[0:height:factor].astype(total)
+    for i in range(1, factor):
+        rows += image[i:height:factor]
+    blocks = rows[:, 0:width:factor].astype(np.float32)
+    for i in range(1, factor):
+        blocks += rows[:, i:width:factor]
+    blocks /= factor * factor
+    return blocks
+
+def cropCentre(image, multiple): # Trim to a multiple of `multiple` in both directions (fast FFT sizes), keeping the centre
+    height = image.shape[0] // multiple * multiple
+    width = image.shape[1] // multiple * multiple
+    top = (image.shape[0] - height) // 2
+    left = (image.shape[1] - width) // 2
+    return image[top:top + height, left:left + width]
+
+def hann(shape):
+    return np.outer(np.hanning(shape[0]), np.hanning(shape[1])).astype(np.float32)
+
+def resample(image, scale, dx=0.0, dy=0.0):
+    # image warped into reference coordinates with bilinear interpolation. Scale and
+    # shift act on rows and columns separately, so this is two 1D gathers, not a 2D remap.
+    out = image.astype(np.float32)
+    for axis, shift in ((0, dy), (1, dx)):
+        size = image.shape[axis]
+        centre = (size - 1) / 2.0
+        source = (np.arange(size, dtype=np.float32) - centre - shift) / scale + centre
+        np.clip(source, 0, size - 1, out=source)
+        low = np.floor(source).astype(np.intp)
+        high = np.minimum(low + 1, size - 1)
+        weight = source - low
+        shape = [1] * out.ndim
+        shape[axis] = size
+        weight = weight.reshape(shape)
+        lowValues = np.take(out, low, axis=axis)
+        out = np.take(out, high, axis=axis)
+        out -= lowValues
+        out *= weight
+        out += lowValues
+    return out
+
+def subpixelPeak(surface):
+    # (dy, dx, height) of the highest point of a correlation surface, refined with
+    # a parabola through its neighbours and wrapped to signed shifts
+    y, x = np.unravel_index(np.argmax(surface), surface.shape)
+    height = float(surface[y, x])
+    offsets = []
+    for axis, index in ((0, y), (1, x)):
+        size = surface.shape[axis]
+        before = float(surface[(y - 1) % size, x] if axis == 0 else surface[y, (x - 1) % size])
+        after = float(surface[(y + 1) % size, x] if axis == 0 else surface[y, (x + 1) % size])
+        curve = before - 2 * height + after
+        offset = index + (0.5 * (before - after) / curve if curve < 0 else 0.0)
+        if offset > size / 2.0:
+            offset -= size
+        offsets.append(offset)
+    return offsets[0], offsets[1], height
+
+def phaseCorrelate(referenceSpectrum, image, window):
+    # Shift (dy, dx) such that reference(p) ~ image(p - shift), and the peak height (0-1)
+    spectrum = np.fft.rfft2(image * window)
+    cross = referenceSpectrum * np.conj(spectrum)
+    cross /= np.abs(cross) + 1e-9
+    return subpixelPeak(np.fft.irfft2(cross, s=image.shape))
+
+
+class Level(object):
+    # One pyramid level of a frame, with its windowed spectrum ready for correlation
+    def __init__(self, image):
+        self.image = image - image.mean()
+        self.window = hann(image.shape)
+        self.spectrum = np.fft.rfft2(self.image * self.window)
+
+    def match(self, current, scale): # (dy, dx, peak) of current scaled by scale against this level
+        return phaseCorrelate(self.spectrum, resample(current.image, scale), self.window)
+
+
+def bestScale(reference, current, scales):
+    peaks = [reference.match(current, scale)[2] for scale in scales]
+    best = int(np.argmax(peaks))
+    if 0 < best < len(scales) - 1: # parabola through the best score and its neighbours
+        before, height, after = peaks[best - 1], peaks[best], peaks[best + 1]
+        curve = before - 2 * height + after
+        if curve < 0:
+            step = scales[best + 1] - scales[best]
+            return scales[best] + 0.5 * (before - after) / curve * step
+    return scales[best]
+
+
+class Aligner(object):
+    # Aligns the frames of one stack as they arrive. add() each frame in the order it was
+    # shot; it returns that frame's transform to the first frame of the stack.
+    # fineWidth is the width matching runs at, scaleRange the largest magnification change
+    # expected between neighbouring frames.
+    def __init__(self, fineWidth=1024, scaleRange=0.03, scaleSteps=7):
+        self.fineWidth = fineWidth
+        self.coarseScales = list(np.linspace(1 - scaleRange, 1 + scaleRange, scaleSteps))
+        self.fineStep = 2 * scaleRange / (scaleSteps - 1) / 4
+        self.reset()
+
+    def reset(self):
+        self.previous = None # (coarse, fine) levels of the last frame
+        self.reference = None # the shot everything is aligned to, the first one added
+        self.transform = dict(IDENTITY)
+        self.transforms = {}
+
+    def levels(self, image):
+        gray = image[..., 1] if image.ndim == 3 else image # green carries most of the detail and needs no conversion
+        self.factor = max(1, int(2 ** np.ceil(np.log2(gray.shape[1] / float(self.fineWidth)))))
+        fine = cropCentre(downsample(gray, self.factor), 64)
+        return Level(downsample(fine, 2)), Level(fine)
+
+    def estimate(self, previous, current):
+        # Transform of current relative to previous, in full resolution pixels
+        scale = bestScale(previous[0], current[0], self.coarseScales)
+        scale = bestScale(previous[1], current[1], [scale - self.fineStep, scale, scale + self.fineStep])
+        dy, dx, peak = previous[1].match(current[1], scale)
+        return {"scale": float(scale), "dx": dx * self.factor, "dy": dy * self.factor, "peak": peak}
+
+    def add(self, shot, image):
+        current = self.levels(image)
+        if self.previous is not None:
+            step = self.estimate(self.previous, current)
+            self.transform = chain(self.transform, step)
+        else:
+            self.reference = shot
+        self.previous = current
+        self.transforms[shot] = dict(self.transform)
+        return self.transforms[shot]
+
+    def save(self, filename):
+        with open(filename, 'w') as f:
+            f.write(json.dumps({"reference": self.reference,
+                                "transforms": {str(shot): transform for shot, transform in sorted(self.transforms.items())}},
+                               indent=4))
+
+def chain(outer, inner):
+    # The transform that applies inner, then outer (frame -> previous frame -> reference)
+    return {
+        "scale": outer["scale"] * inner["scale"],
+        "dx": outer["scale"] * inner["dx"] + outer["dx"],
+        "dy": outer["scale"] * inner["dy"] + outer["dy"],
+        "peak": inner.get("peak", 1.0),
+    }
+
+def sourcePositions(size, scale, shift):
+    # For each output pixel along one axis, the two source pixels either side of where it
+    # samples and the 8 bit fixed point weight (0-256) of the second one
+    centre = (size - 1) / 2.0
+    source = (np.arange(size, dtype=np.float64) - centre - shift) / scale + centre
+    np.clip(source, 0, size - 1, out=source)
+    low = np.floor(source).astype(np.intp)
+    high = np.minimum(low + 1, size - 1)
+    weight = np.rint((source - low) * 256).astype(np.uint16)
+    return low, high, weight
+
+def warpBands(image, scale, dx, dy, band=128):
+    # resample() for 8 bit frames in fixed point, band rows at a time: rows are blended in
+    # uint16 (255 * 256 still fits), then columns, so a 12 MP frame never has a full size
+    # float copy. Channels are folded into the columns so each gather is a flat np.take,
+    # several times faster than fancy indexing a 3D array. Within two levels of resample().
+    height, width = image.shape[:2]
+    channels = image.size // (height * width)
+    flat = image.reshape(height, width * channels)
+    lowRows, highRows, rowWeights = sourcePositions(height, scale, dy)
+    lowColumns, highColumns, columnWeights = sourcePositions(width, scale, dx)
+    spread = lambda columns: (columns[:, None] * channels + np.arange(channels)).ravel()
+    lowColumns, highColumns = spread(lowColumns), spread(highColumns)
+    columnWeights = np.repeat(columnWeights, channels)
+    columnRest = 256 - columnWeights
+    out = np.empty_like(flat)
+    for top in range(0, height, band):
+        rows = slice(top, min(top + band, height))
+        weights = rowWeights[rows, None]
+        blended = np.take(flat, lowRows[rows], axis=0).astype(np.uint16)
+        blended *= 256 - weights
+        blended += np.take(flat, highRows[rows], axis=0) * weights
+        blended += 128
+        blended >>= 8
+        columns = np.take(blended, lowColumns, axis=1)
+        columns *= columnRest
+        high = np.take(blended, highColumns, axis=1)
+        high *= columnWeights
+        columns += high
+        columns += 128
+        columns >>= 8
+        out[rows] = columns
+    return out.reshape(image.shape)
+
+def warpFrame(image, transform): # The frame resampled into reference coordinates, same dtype
+    if transform["scale"] == 1.0 and transform["dx"] == 0.0 and transform["dy"] == 0.0:
+        return image
+    if image.dtype == np.uint8:
+        return warpBands(image, transform["scale"], transform["dx"], transform["dy"])
+    return resample(image, transform["scale"], transform["dx"], transform["dy"]).astype(image.dtype)
+
+def transformsFile(folder): # Where the transforms of a stack folder are cached
+    return folder.rstrip("/") + "_align.json"
+
+def loadAlignment(folder): # What Aligner.save() cached for a stack folder, or None
+    filename = transformsFile(folder)
+    if not os.path.exists(filename):
+        return None
+    with open(filename) as f:
+        return json.load(f)
+
+def loadTransforms(folder): # {shot: transform} cached for a stack folder, or None
+    saved = loadAlignment(folder)
+    if saved is None:
+        return None
+    return {int(shot): transform for shot, transform in saved["transforms"].items()}
+
+def loadReference(folder): # The shot a stack folder was aligned to, or None if it is not known
+    saved = loadAlignment(folder)
+    return saved["reference"] if saved is not None else None
@@ -1,18 +1,42 @@
 from PyQt5 import QtCore, QtGui, QtWidgets
-import RPi.GPIO as GPIO
-import time
-from picamera import PiCamera
 import os
+import io
+import math
 import datetime
+import threading
 import json
 from fractions import Fraction
+from hardware import clock, loadGPIO, loadCamera
+from stepper import Stepper
+from motion import planMove
+from axes import runConcurrently
+from settle import CameraFrameSource, waitForSettle
+from writer import WriterPool
+from burst import BurstCapture
+from fusion import FusionStage
+from postprocess import PostProcessor
+from manifest import Manifest
+from xmp import xmpPacket, injectXMP, retagField, shotFields
+from bracket import bracketShutters, bracketsFolder, bracketName
+from exposure import ExposureLock, drift
+from preview import PreviewStream
+from focus import sharpness, focusRange, focusMap, focusOverlap, nextStep
+from routine import RoutineControl, RoutineCancelled
+from journal import Journal, resumePoint
+import spans
+from spans import span, ChromeTrace
 
 # Variables and Initialization
-camera = PiCamera()
+# Set SCANNER_BACKEND=sim to run against simulated pins and camera (see hardware.py)
+GPIO = loadGPIO()
+camera = loadCamera()
 camera.resolution = (4056, 3040)
+settleSource = CameraFrameSource(camera) # low resolution video port frames for adaptive settling
+focusSource = CameraFrameSource(camera, (320, 240)) # a little more detail for scoring focus in an auto range sweep
 
 imageExtension = ".jpg"
 imageOutputType = "jpeg"
+imageWriter = WriterPool() # captures are written to disk in the background while the rig moves on
 path = os.getcwd()
 print ("The current working directory is %s" % path)
 projectName = "shot"
@@ -26,6 +50,7 @@ in1_2 = 17
 in2_2 = 27
 in3_2 = 22
 in4_2 = 23
+stepSpinTime = 0.0002 # last part of every step delay is busy-waited instead of slept, for tighter step timing
 
 # Light Control Pin (High to turn on)
 lightPin = 21
@@ -36,10 +61,7 @@ GPIO.setmode(GPIO.BCM)
 GPIO.setwarnings(False)
 
 # PiCam stepper pin init
-GPIO.setup(in1_2, GPIO.OUT)
-GPIO.setup(in2_2, GPIO.OUT)
-GPIO.setup(in3_2, GPIO.OUT)
-GPIO.setup(in4_2, GPIO.OUT)
+railMotor = Stepper(GPIO, (in1_2, in2_2, in3_2, in4_2), stepSpinTime)
 
 # Drive Wheel Motor pin init
 GPIO.setup(cw_pin, GPIO.OUT)
@@ -59,14 +81,34 @@ iso = 200
 framerate = '30fps'
 shutter_speed = 'auto'
 direction = 'Clockwise'
+routineMode = 'Return Home' # 'Return Home' rewinds the rail after every stack, 'Serpentine' shoots alternate stacks back-to-front
 
 # Global variables to keep track of positions
 sliderPosition = 0
+stackBackwards = False # the stack being shot runs from the far end of the rail back toward home (serpentine)
 turnTablePosition = 0
 
 # Sleep and pauses
-sleepTime = 0.002 #time in between motor steps PiCam stepper
+sleepTime = 0.002 #time in between motor steps PiCam stepper (cruise rate of forward/reverse)
+homeSleepTime = 0.001 # cruise step delay for the goHome() return trip
+startSleepTime = 0.002 # step delay at the start and end of a ramped move, safe from rest
+railAcceleration = 1500 # PiCam stepper acceleration in steps/sec^2
+motionProfile = 'trapezoid' # 'constant', 'trapezoid' or 's-curve'
 shotPause = 2 # time (sec) between motor moves and shots - to settle camera
+settleMode = 'Fixed' # 'Fixed' always waits shotPause, 'Adaptive' waits until frames stop changing (shotPause is the timeout)
+stepMode = 'Fixed' # 'Fixed' moves cameraMovement between shots, 'Adaptive' sizes each step from the focus overlap of the last two frames
+focusOverlapTarget = 0.5 # in Adaptive step mode, how much neighbouring frames should share focus (0-1)
+settleThreshold = 2.0 # mean frame difference (0-255) below which the rig counts as settled
+burstMode = False # keep the video port streaming through a stack instead of a still capture per shot
+fusionMode = False # focus stack each stack on the Pi as it is shot, saved as <stack folder>_fused.jpg
+stackFusion = None # the FusionStage thread, started the first time a stack is fused
+postProcessMode = False # fuse, thumbnail and check every finished stack in worker processes while the next one is shot
+postProcessor = None # the PostProcessor pool, started with the first finished stack
+bracketCount = 1 # exposures shot at every rail position, merged by post-processing (see bracket.py); 1 is off
+bracketSpacing = 2.0 # stops between brackets
+lockExposureMode = False # meter once when a full routine starts and hold exposure and white balance for all of it
+exposureLock = None # the ExposureLock of the running routine (see exposure.py)
+previewStream = None # the PreviewStream feeding the window's preview while it runs (see preview.py)
 
 # Global counters -- apply to both PiCam and DSLR routines
 shotNumber = 1 #counter for naming shots in stack sequentially
@@ -82,7 +124,22 @@ cameraMovement = 10 # default number of PWM cycles for the focus rack in one mot
 numberShots = 20 # default number of shots in each stack
 numberStacks = 72 # default number of stacks in the routine
 
+ui = None # the main window, only built when app.py runs as the GUI
+routineControl = RoutineControl() # pause/cancel and progress for the routine running in the background
+journal = None # crash-safe record of the full routine in progress (see journal.py)
+recordManifest = True # add every shot to <projectName>_manifest.sqlite (see manifest.py)
+manifest = None # the open Manifest, reopened when projectName changes
+tagShots = True # write stack, shot, angle, rail position and settings into every JPEG as XMP (see xmp.py)
+
 # Raspberry Pi HQ Camera Slider
+def showLocation(): # Update the location readout. Off the GUI thread the window picks it up on its next poll
+    routineControl.position = sliderPosition
+    if ui is not None and threading.current_thread() is threading.main_thread():
+        ui.location_value_lbl.setText(str(sliderPosition))
+
+def railPlan(cycles, cruise): # Per-step timing for a rail move of the given cycles (4 steps per cycle)
+    return planMove(cycles * 4, startSleepTime, cruise, railAcceleration, motionProfile)
+
 def forward():
     global cameraMovement
     print("Your camera is moving forward in " + str(cameraMovement) + " step increments")
@@ -90,77 +147,50 @@ def forward():
     sliderPosition += cameraMovement
     segment = cameraMovement
     print("Slider Position: " + str(sliderPosition))
-    while (segment > 0):
-        GPIO.output(in1_2, GPIO.HIGH)
-        GPIO.output(in2_2, GPIO.LOW)
-        GPIO.output(in3_2, GPIO.LOW)
-        GPIO.output(in4_2, GPIO.LOW)
-        time.sleep(sleepTime)
-        GPIO.output(in1_2, GPIO.LOW)
-        GPIO.output(in2_2, GPIO.HIGH)
-        GPIO.output(in3_2, GPIO.LOW)
-        GPIO.output(in4_2, GPIO.LOW)
-        time.sleep(sleepTime)
-        GPIO.output(in1_2, GPIO.LOW)
-        GPIO.output(in2_2, GPIO.LOW)
-        GPIO.output(in3_2, GPIO.HIGH)
-        GPIO.output(in4_2, GPIO.LOW)
-        time.sleep(sleepTime)
-        GPIO.output(in1_2, GPIO.LOW)
-        GPIO.output(in2_2, GPIO.LOW)
-        GPIO.output(in3_2, GPIO.LOW)
-        GPIO.output(in4_2, GPIO.HIGH)
-        time.sleep(sleepTime)
-        segment -= 1
+    with span("move", cycles=segment):
+        railMotor.forward(segment, railPlan(segment, sleepTime))
     disableMotors()
-    ui.location_value_lbl.setText(str(sliderPosition))
+    showLocation()
     
-def reverse():
+def reverse(cruise=None):
     global cameraMovement
     print("Your camera is moving in reverse in " + str(cameraMovement) + " step increments")
     global sliderPosition
     sliderPosition -= cameraMovement
     print("Slider Position: " + str(sliderPosition))
     segment = cameraMovement
-    while (segment > 0):
-        GPIO.output(in1_2, GPIO.LOW)
-        GPIO.output(in2_2, GPIO.LOW)
-        GPIO.output(in3_2, GPIO.LOW)
-        GPIO.output(in4_2, GPIO.HIGH)
-        time.sleep(sleepTime)
-        GPIO.output(in1_2, GPIO.LOW)
-        GPIO.output(in2_2, GPIO.LOW)
-        GPIO.output(in3_2, GPIO.HIGH)
-        GPIO.output(in4_2, GPIO.LOW)
-        time.sleep(sleepTime)
-        GPIO.output(in1_2, GPIO.LOW)
-        GPIO.output(in2_2, GPIO.HIGH)
-        GPIO.output(in3_2, GPIO.LOW)
-        GPIO.output(in4_2, GPIO.LOW)
-        time.sleep(sleepTime)
-        GPIO.output(in1_2, GPIO.HIGH)
-        GPIO.output(in2_2, GPIO.LOW)
-        GPIO.output(in3_2, GPIO.LOW)
-        GPIO.output(in4_2, GPIO.LOW)
-        time.sleep(sleepTime)
-        segment -= 1
+    if cruise is None:
+        cruise = sleepTime
+    with span("move", cycles=-segment):
+        railMotor.reverse(segment, railPlan(segment, cruise))
     disableMotors()
-    ui.location_value_lbl.setText(str(sliderPosition))
+    showLocation()
 
 def goHome(): # PiCam slider moves back to 0
     global sliderPosition
     global cameraMovement
     temp = cameraMovement
     cameraMovement = sliderPosition
-    reverse()
+    reverse(homeSleepTime)
     cameraMovement = temp
-    ui.location_value_lbl.setText(str(sliderPosition))
+    showLocation()
     print("PiCam is moved back to HOME")
     
+def moveRailTo(target): # PiCam slider moves to an absolute position
+    global cameraMovement
+    temp = cameraMovement
+    cameraMovement = abs(target - sliderPosition)
+    if target > sliderPosition:
+        forward()
+    elif target < sliderPosition:
+        reverse(homeSleepTime)
+    cameraMovement = temp
+    showLocation()
+
 def setHome(): # Sets the current PiCam slider position as 'home'
     global sliderPosition
     sliderPosition = 0
-    ui.location_value_lbl.setText(str(sliderPosition))
+    showLocation()
     print("The current position of the PiCam is now the home position")
 
 # Drive Wheel Functionality
@@ -168,31 +198,41 @@ def driveCW():
     global dollyMovement
     seconds = dollyMovement /2
     GPIO.output(cw_pin, GPIO.HIGH)
-    time.sleep(seconds)
+    clock.sleep(seconds)
     GPIO.output(cw_pin, GPIO.LOW)
     
 def driveCCW():
     global dollyMovement
     seconds = dollyMovement / 2
     GPIO.output(ccw_pin, GPIO.HIGH)
-    time.sleep(seconds)
+    clock.sleep(seconds)
     GPIO.output(ccw_pin, GPIO.LOW)
 
+def rotateDolly(): # One turntable segment in the selected direction
+    with span("rotate"):
+        if direction == "Clockwise":
+            driveCW()
+        elif direction == "Counter-Clockwise":
+            driveCCW()
+
 def disableMotors(): # Turns off the current to motors while they are not moving, decreases holding power, but keeps everything cool. *you should actually run this at boot, with the accompanying script
-    GPIO.output(in1_2, GPIO.LOW)
-    GPIO.output(in2_2, GPIO.LOW)
-    GPIO.output(in3_2, GPIO.LOW)
-    GPIO.output(in4_2, GPIO.LOW)
+    railMotor.release()
     print("Motors are disabled")
 
 
 # Camera Stuff
-# If the preview causes display issues, you can increase GPU memory or use a smaller PiCam Resolution
-def camPreviewWindowed(): 
-    camera.start_preview(fullscreen=False, window=(600,150,1024,576))
-    
+# The preview streams small frames from the video port into the window, with focus peaking and a sharpness score
+def camPreviewWindowed():
+    global previewStream
+    if previewStream is None:
+        previewStream = PreviewStream(camera)
+    return previewStream
+
 def camStopPreview():
-    camera.stop_preview()
+    global previewStream
+    if previewStream is not None:
+        previewStream.stop()
+        previewStream = None
 
 def testShot(): # Doesn't screw up the shot count for full routine
     global path
@@ -204,52 +244,437 @@ def testShot(): # Doesn't screw up the shot count for full routine
     camera.capture(path + "/testShots/testShot_" + str(testShotNumber) + str(imageExtension), str(imageOutputType))
     testShotNumber += 1
 
-def shoot(): # PiCam - capture single photo
+def turntableAngle(): # Degrees turned since the routine started, from the stack count (the turntable has no encoder)
+    if not routineControl.stacks:
+        return None
+    angle = (routineControl.stack - 1) * arcLength / float(numberStacks)
+    return -angle if direction == "Counter-Clockwise" else angle
+
+def openManifest(): # The project's manifest, opened again if the project has changed
+    global manifest
+    if manifest is None or manifest.filename != os.path.abspath(projectName + "_manifest.sqlite"):
+        if manifest is not None:
+            manifest.close()
+        manifest = Manifest(projectName + "_manifest.sqlite")
+    return manifest
+
+def recordShot(filename, data, capturedAt): # Add the shot to the project's manifest
+    with span("manifest"):
+        openManifest().add(filename, data, camera, project=projectName, stack=stackNumber, shot=shotNumber,
+                     angle=turntableAngle(), slider_position=sliderPosition, backwards=stackBackwards,
+                     captured_at=capturedAt)
+
+def tagShot(data, capturedAt): # The frame with its XMP packet, spliced in without re-encoding
+    fields = shotFields({"project": projectName, "stack": stackNumber, "shot": shotNumber, "angle": turntableAngle(),
+                         "slider_position": sliderPosition, "backwards": int(stackBackwards),
+                         "captured_at": capturedAt}, currentSettings())
+    with span("tag"):
+        return injectXMP(data, xmpPacket(fields))
+
+def storeShot(filename, data, capturedAt, fuser=None): # Tag, write, fuse and record one captured frame
+    if tagShots:
+        data = tagShot(data, capturedAt)
+    with span("write"): # only the wait for a free writer slot, the write itself overlaps the next move
+        imageWriter.submit(filename, data)
+    if fuser is not None:
+        fuser.submit(shotNumber, data)
+    if recordManifest:
+        recordShot(filename, data, capturedAt)
+
+def lockExposure(values=None): # Meter (or re-apply values) and hold the exposure until releaseExposure()
+    global exposureLock
+    exposureLock = ExposureLock(camera)
+    with span("meter"):
+        values = exposureLock.lock(values)
+    print("Exposure locked: " + str(values))
+    return values
+
+def releaseExposure():
+    global exposureLock
+    if exposureLock is not None:
+        exposureLock.release()
+        exposureLock = None
+
+def checkExposure(shutter=None): # Report drift from the locked exposure; shutter is what a bracket was shot at
+    if exposureLock is not None:
+        for warning in exposureLock.check(shutter):
+            print(warning)
+
+def shootBrackets(filename):
+    # bracketCount still captures at this rail position, bracketSpacing stops apart around the
+    # current exposure, into the stack's _brackets folder. Exposure is switched off meanwhile so
+    # the gains hold and only the shutter changes. The sensor cannot expose longer than a frame,
+    # so the framerate is lowered for the set if the longest bracket needs it, and a bracket the
+    # camera still did not reach is reported. Returns the bracket files.
+    folder = bracketsFolder(path)
+    if not os.path.exists(folder):
+        os.mkdir(folder)
+    savedShutter = camera.shutter_speed
+    savedMode = camera.exposure_mode
+    savedFramerate = camera.framerate
+    base = savedShutter or camera.exposure_speed
+    shutters = bracketShutters(base, bracketCount, bracketSpacing)
+    camera.exposure_mode = 'off'
+    files = []
+    try:
+        if max(shutters) > 1000000 / float(savedFramerate):
+            camera.framerate = Fraction(1000000, max(shutters))
+        for i, shutter in enumerate(shutters):
+            camera.shutter_speed = shutter
+            capturedAt = clock.time()
+            with span("capture", shot=shotNumber, bracket=i + 1):
+                stream = io.BytesIO()
+                camera.capture(stream, str(imageOutputType))
+            if exposureLock is not None:
+                checkExposure(shutter)
+            elif drift(camera.exposure_speed, shutter) > 0.05:
+                print("Bracket " + str(i + 1) + " was exposed for " + str(camera.exposure_speed)
+                      + " µs instead of " + str(shutter) + " µs")
+            files.append(bracketName(folder, filename, i))
+            storeShot(files[-1], stream.getvalue(), capturedAt)
+    finally:
+        camera.framerate = savedFramerate
+        camera.shutter_speed = savedShutter
+        camera.exposure_mode = savedMode
+    return files
+
+def frameName(folder, shot): # The file shoot() writes a shot of a stack to
+    if (shot < 10):
+        return folder + "/" + projectName + "0" + str(shot) + str(imageExtension)
+    return folder + "/" + projectName + str(shot) + str(imageExtension)
+
+def shoot(burst=None, fuser=None):
+    # PiCam - capture single photo, from the running burst stream if one is given.
+    # Returns the files written: the frame, or its brackets when bracketing.
     global path
     global shotNumber
     global imageExtension
     global imageOutputType
     global projectName
     print("PiCam shot #" + str(shotNumber))
-    if (shotNumber < 10):
-        camera.capture(path + "/" + projectName + "0" + str(shotNumber) + str(imageExtension), str(imageOutputType))
+    filename = frameName(path, shotNumber)
+    if bracketCount > 1:
+        files = shootBrackets(filename)
     else:
-        camera.capture(path + "/" + projectName + str(shotNumber) + str(imageExtension), str(imageOutputType))
+        files = [filename]
+        capturedAt = clock.time()
+        with span("capture", shot=shotNumber):
+            if burst is not None:
+                data = burst.grab()
+            else:
+                stream = io.BytesIO()
+                camera.capture(stream, str(imageOutputType))
+                data = stream.getvalue()
+        checkExposure()
+        storeShot(filename, data, capturedAt, fuser)
+    routineControl.shot = shotNumber
     shotNumber += 1
+    return files
+
+def settle(): # Wait for the rig to stop moving before the next shot or move
+    with span("settle"):
+        if settleMode == "Adaptive":
+            if not waitForSettle(settleSource, settleThreshold, shotPause):
+                print("Rig did not settle within " + str(shotPause) + " seconds")
+        else:
+            clock.sleep(shotPause)
+
+def journalMove(): # The rail has no encoder, so every finished move is journaled to know where it is after a crash
+    if journal is not None:
+        journal.write("move", sliderPosition=sliderPosition)
+
+def shootStack(backwards, burst, firstShot=0, fuser=None): # Shoot numberShots frames, moving the rail between them
+    global shotNumber
+    routineControl.shots = numberShots
+    for x in range(firstShot,numberShots):
+        routineControl.checkpoint()
+        if backwards: # Start at the far end of the stack and step back to home
+            reverse()
+            journalMove()
+            settle()
+            shotNumber = numberShots - x # Keep shots numbered in focus order, 01 is nearest home
+            shotPosition = sliderPosition
+            files = shoot(burst, fuser)
+            settle()
+        else:
+            shotNumber = x + 1
+            shotPosition = sliderPosition
+            files = shoot(burst, fuser)
+            settle()
+            forward()
+            journalMove()
+            settle()
+        if journal is not None:
+            journal.write("shot", stack=routineControl.stack - 1, shot=x, files=files, sliderPosition=sliderPosition,
+                          shotPosition=shotPosition, backwards=backwards)
+
+def stepRail(cycles): # Move the rail at stack speed, negative cycles toward home
+    global cameraMovement
+    temp = cameraMovement
+    cameraMovement = abs(cycles)
+    if cycles > 0:
+        forward()
+    elif cycles < 0:
+        reverse()
+    cameraMovement = temp
 
-def runStackRoutine(): # With current settings 
+def shootAdaptiveStack(backwards, burst, firstShot=0, fuser=None, resumedAt=None):
+    # Cover the same stretch of rail as a fixed stack of numberShots, but size each step from how much
+    # the focus of the last frame overlaps the one before it: long steps where frames share focus
+    # (or nothing is sharp), short ones through shallow focus. Shots are numbered in the order they
+    # are taken: how many a backwards stack takes is only known at home, so runStackRoutine
+    # renumbers it into focus order afterwards. resumedAt is where the last shot before an
+    # interruption was taken: if that was the end of the stack, there is nothing left to shoot.
+    # Returns how many shots the stack has.
+    global shotNumber
+    length = (numberShots - 1) * cameraMovement
+    if backwards: # serpentine stacks run from the far end back to home
+        first, last = length, 0
+    else:
+        first = sliderPosition if firstShot == 0 else 0
+        last = first + length
+    direction = 1 if last >= first else -1
+    if firstShot == 0:
+        moveRailTo(first)
+        journalMove()
+        settle()
+    minStep = max(1, cameraMovement // 4)
+    maxStep = cameraMovement * 4
+    maxShots = length // minStep + 1
+    step = cameraMovement
+    routineControl.shots = firstShot + math.ceil(abs(last - sliderPosition) / float(step)) + 1
+    previous = None
+    x = firstShot
+    finished = x >= maxShots or (resumedAt is not None and (last - resumedAt) * direction <= 0)
+    while not finished:
+        routineControl.checkpoint()
+        shotNumber = x + 1
+        shotPosition = sliderPosition
+        files = shoot(burst, fuser)
+        current = focusMap(focusSource.read())
+        if previous is not None:
+            step = nextStep(step, focusOverlap(previous, current), focusOverlapTarget, minStep, maxStep)
+        previous = current
+        remaining = (last - sliderPosition) * direction
+        routineControl.shots = x + 1 + max(0, math.ceil(remaining / float(step))) # the estimate follows the step size
+        settle()
+        if remaining > 0:
+            stepRail(direction * min(step, remaining))
+            journalMove()
+            settle()
+        if journal is not None:
+            journal.write("shot", stack=routineControl.stack - 1, shot=x, files=files, sliderPosition=sliderPosition,
+                          shotPosition=shotPosition, backwards=backwards)
+        x += 1
+        finished = remaining <= 0 or x >= maxShots
+    routineControl.shots = x
+    print("Adaptive stack: " + str(x) + " shots")
+    return x
+
+def focusOrderPlan(folder, count):
+    # The files of a backwards stack of count shots numbered in the order they were taken, and
+    # where each goes so that shot 01 is nearest home, as [{"from", "to", "shot", "row"}]; row is
+    # the file's manifest row. Stored in the journal, so an interrupted renumbering is finished
+    # with the same plan.
+    rows = {}
+    if recordManifest:
+        rows = {row["file"]: row["id"] for row in openManifest().query("project = ? AND stack = ?", projectName, stackNumber)}
+    plan = []
+    for taken in range(1, count + 1):
+        shot = count + 1 - taken
+        if shot == taken:
+            continue
+        old, new = frameName(folder, taken), frameName(folder, shot)
+        if bracketCount > 1:
+            moves = [(bracketName(bracketsFolder(folder), old, i), bracketName(bracketsFolder(folder), new, i))
+                     for i in range(bracketCount)]
+        else:
+            moves = [(old, new)]
+        plan += [{"from": source, "to": target, "shot": shot, "row": rows.get(source)} for source, target in moves]
+    return plan
+
+def renumberStack(plan, phase="planned"):
+    # Carry out a focusOrderPlan. Files swap names, so each is first parked as <new name>.renumber;
+    # the journal records when that is done ("staged") and when the manifest and tags are updated
+    # too ("done"). Every step can be run again from the last phase journaled.
+    def journalPhase(phase):
+        if journal is not None:
+            journal.write("renumber", stack=routineControl.stack - 1, phase=phase, files=plan)
+    if phase == "planned":
+        for move in plan:
+            if os.path.exists(move["from"]) and not os.path.exists(move["to"] + ".renumber"):
+                os.replace(move["from"], move["to"] + ".renumber")
+        journalPhase("staged")
+    if phase != "done":
+        for move in plan:
+            if os.path.exists(move["to"] + ".renumber"):
+                os.replace(move["to"] + ".renumber", move["to"])
+        if recordManifest:
+            openManifest().renumber([(move["row"], move["to"], move["shot"]) for move in plan if move["row"] is not None])
+        if tagShots:
+            for move in plan:
+                data = retagField(move["to"], "Shot", move["shot"])
+                if data is not None and recordManifest:
+                    manifest.updateDigest(move["to"], data)
+        journalPhase("done")
+
+def runStackRoutine(backwards=False, firstShot=0, resumedAt=None, renumber=None):
+    # With current settings. renumber is the last "renumber" record of the stack in the journal,
+    # when resuming a stack that was already shot.
     global projectName
     global stackNumber
     global path
+    global stackBackwards
+    stackBackwards = backwards
     newPath = projectName + "_" + str(stackNumber)
-    os.mkdir(newPath)
+    os.makedirs(newPath, exist_ok=True) # a resumed stack may have its folder already, with or without frames in it
     path = newPath
     
     global numberShots
-    for x in range(0,numberShots):
-        shoot()
-        time.sleep(shotPause)
-        forward()
-        time.sleep(shotPause)
+    global stackFusion
+    bracketing = bracketCount > 1 # the frames only exist once post-processing merges the brackets
+    liveFusion = fusionMode and not bracketing
+    renumbering = stepMode == "Adaptive" and backwards
+    fuser = None
+    if liveFusion:
+        if stackFusion is None:
+            stackFusion = FusionStage()
+        stackFusion.begin(newPath)
+        if firstShot == 0 and not renumbering: # a resumed or renumbered stack is fused from its folder once it is complete
+            fuser = stackFusion
+    ownLock = lockExposureMode and exposureLock is None # a full routine holds one lock for all of its stacks
+    burst = None
+    try:
+        if ownLock:
+            lockExposure()
+        if burstMode and not bracketing: # a new shutter speed takes several frames to reach the video port
+            burst = BurstCapture(camera, str(imageOutputType))
+        with span("stack", stack=stackNumber):
+            if renumber is not None: # every shot was taken before the interruption
+                renumberStack(renumber["files"], renumber["phase"])
+            elif stepMode == "Adaptive":
+                count = shootAdaptiveStack(backwards, burst, firstShot, fuser, resumedAt)
+            else:
+                shootStack(backwards, burst, firstShot, fuser)
+            with span("write"):
+                imageWriter.flush() # The stack folder is complete once the last write lands
+            if renumbering and renumber is None:
+                plan = focusOrderPlan(newPath, count)
+                if journal is not None:
+                    journal.write("renumber", stack=routineControl.stack - 1, phase="planned", files=plan)
+                renumberStack(plan)
+    finally:
+        if burst is not None:
+            burst.close()
+        if ownLock:
+            releaseExposure()
+    if liveFusion:
+        if fuser is None:
+            stackFusion.submitFolder(newPath)
+        stackFusion.finish() # the fused image is saved in the background while the rig moves on
+    if postProcessMode:
+        global postProcessor
+        if postProcessor is None:
+            postProcessor = PostProcessor()
+        postProcessor.submit(newPath, fuse=not liveFusion, expectedShots=numberShots if stepMode == "Fixed" else None)
+        print("Post-processing: " + postProcessor.describe())
+    elif bracketing:
+        print("Brackets are not merged until the stack is post-processed: python postprocess.py " + newPath)
     print("PiCam done with stack #" + str(stackNumber))
+    stackBackwards = False
     stackNumber += 1
     resetShotNumber()
 
-def runFullRoutine():
-    setHome()
+def autoRange(): # Sweep the configured stack once from here and trim it to the positions that hold focus
+    global numberShots
+    start = sliderPosition
+    scores = []
+    routineControl.shots = numberShots
+    for x in range(numberShots):
+        routineControl.checkpoint()
+        if x > 0:
+            forward()
+        settle()
+        scores.append(sharpness(focusSource.read()))
+        routineControl.shot = x + 1
+    first, last = focusRange(scores)
+    moveRailTo(start + first * cameraMovement)
+    setHome() # the stack now starts at the first position in focus
+    numberShots = last - first + 1
+    print("Auto range: " + str(numberShots) + " shots from " + str(first * cameraMovement) + " steps past the old home")
+    return first, last
+
+def runFullRoutine(resumeFrom=None): # resumeFrom is a journal.resumePoint to pick an interrupted routine back up
     global direction
     global camera
     global numberStacks
     global numberShots
-    print("PiCam Full Routine Started!")
-    print(str(numberStacks)+" stacks of " + str(numberShots) + " shots")
-    for x in range(0,numberStacks):
-        runStackRoutine()
-        if direction == "Clockwise":
-            driveCW()
-        elif direction == "Counter-Clockwise":
-            driveCCW()
-        goHome()
+    global routineMode
+    global journal
+    global stackNumber
+    global sliderPosition
+    serpentine = routineMode == "Serpentine"
+    if resumeFrom is None:
+        setHome()
+        firstStack = 0
+        firstShot = 0
+    else:
+        firstStack = resumeFrom["stack"]
+        firstShot = resumeFrom["shot"]
+        stackNumber = resumeFrom["stackNumber"]
+        sliderPosition = resumeFrom["sliderPosition"]
+        moveRailTo(resumeFrom["startPosition"])
+    journal = Journal(projectName + "_journal.jsonl")
+    try:
+        lockedValues = None
+        if lockExposureMode:
+            lockedValues = lockExposure(resumeFrom.get("exposure") if resumeFrom is not None else None)
+        if resumeFrom is None:
+            journal.write("start", settings=currentSettings(), stackNumber=stackNumber, exposure=lockedValues)
+            print("PiCam Full Routine Started!")
+        else:
+            print("PiCam Full Routine resumed at stack " + str(firstStack + 1) + ", shot " + str(firstShot + 1))
+        print(str(numberStacks)+" stacks of " + str(numberShots) + " shots")
+        routineControl.stacks = numberStacks
+        for x in range(firstStack,numberStacks):
+            routineControl.checkpoint()
+            routineControl.stack = x + 1
+            # In serpentine mode every second stack is shot on the way back, so the rail never rewinds
+            resuming = x == firstStack and resumeFrom is not None
+            runStackRoutine(backwards=serpentine and x % 2 == 1, firstShot=firstShot if resuming else 0,
+                            resumedAt=resumeFrom.get("shotPosition") if resuming else None,
+                            renumber=resumeFrom.get("renumber") if resuming else None)
+            if serpentine:
+                rotateDolly()
+            else: # Rail and turntable are independent, so rewind the rail while the turntable turns
+                runConcurrently(goHome, rotateDolly)
+            journal.write("stack", stack=x, stackNumber=stackNumber - 1, sliderPosition=sliderPosition)
+        if serpentine and sliderPosition != 0: # Odd number of stacks leaves the rail at the far end
+            goHome()
+        journal.write("finish", sliderPosition=sliderPosition)
+    finally:
+        journal.close()
+        journal = None
+        releaseExposure()
+
+def resumeFullRoutine(journalFile): # Continue the full routine recorded in journalFile from where it stopped
+    point = resumePoint(journalFile)
+    if point is None:
+        print("Nothing to resume in " + journalFile)
+        return
+    applySettings(point["settings"])
+    runFullRoutine(resumeFrom=point)
+
+def runInBackground(routine, done=None):
+    # Runs a routine on a RoutineWorker thread, returns the started worker. done is connected
+    # before the thread starts, so a routine that ends at once still reports back.
+    routineControl.reset()
+    routineControl.running = True
+    worker = RoutineWorker(routine)
+    if done is not None:
+        worker.done.connect(done)
+    worker.start()
+    return worker
 
 # Camera Settings Adjustment Methods
 
@@ -303,6 +728,89 @@ def resetShotNumber(): #Not used in UI -- used inside routine
     shotNumber = 1
     print("Shot count is reset to 1")
 
+def currentSettings(): # Everything needed to repeat a routine, as exported to JSON
+    return {
+        "Brightness": brightness,
+        "Contrast": contrast,
+        "AWB Mode": awb_mode,
+        "AWB Gains": awb_gains,
+        "ISO": iso,
+        "Framerate": framerate,
+        "Shutter Speed": shutter_speed,
+        "Project Name": projectName,
+        "Camera Movement": cameraMovement,
+        "Dolly Movement": dollyMovement,
+        "Arc Length": arcLength,
+        "Number of Shots in Stack": numberShots,
+        "Number of Stacks": numberStacks,
+        "Direction": direction,
+        "Routine Mode": routineMode,
+        "Settle Mode": settleMode,
+        "Step Mode": stepMode,
+        "Post Process": postProcessMode,
+        "Burst Stack": burstMode,
+        "Fuse Stacks": fusionMode,
+        "Bracket Exposures": bracketCount,
+        "Bracket Spacing": bracketSpacing,
+        "Lock Exposure": lockExposureMode
+    }
+
+def applySettings(settings): # The reverse of currentSettings, without touching the UI
+    global brightness
+    global contrast
+    global awb_mode
+    global awb_gains
+    global iso
+    global framerate
+    global shutter_speed
+    global projectName
+    global dollyMovement
+    global cameraMovement
+    global arcLength
+    global numberShots
+    global numberStacks
+    global direction
+    global routineMode
+    global settleMode
+    global stepMode
+    global postProcessMode
+    global burstMode
+    global fusionMode
+    global bracketCount
+    global bracketSpacing
+    global lockExposureMode
+    brightness = settings["Brightness"]
+    camera.brightness = brightness
+    contrast = settings["Contrast"]
+    camera.contrast = contrast
+    awb_mode = settings["AWB Mode"]
+    camera.awb_mode = awb_mode
+    awb_gains = settings["AWB Gains"]
+    if awb_mode == 'off':
+        camera.awb_gains = awb_gains
+    iso = settings["ISO"]
+    camera.iso = iso
+    framerate = settings["Framerate"]
+    changeFramerate(framerate)
+    shutter_speed = settings["Shutter Speed"]
+    changeShutterSpeed(shutter_speed)
+    projectName = settings["Project Name"]
+    cameraMovement = settings["Camera Movement"]
+    dollyMovement = settings["Dolly Movement"]
+    arcLength = settings["Arc Length"]
+    numberShots = settings["Number of Shots in Stack"]
+    numberStacks = settings["Number of Stacks"]
+    direction = settings["Direction"]
+    routineMode = settings.get("Routine Mode", "Return Home")
+    settleMode = settings.get("Settle Mode", "Fixed")
+    stepMode = settings.get("Step Mode", "Fixed")
+    postProcessMode = settings.get("Post Process", False)
+    burstMode = settings.get("Burst Stack", False)
+    fusionMode = settings.get("Fuse Stacks", False)
+    bracketCount = settings.get("Bracket Exposures", 1)
+    bracketSpacing = settings.get("Bracket Spacing", 2.0)
+    lockExposureMode = settings.get("Lock Exposure", False)
+
 def exportSettings():
     global brightness
     global contrast
@@ -317,23 +825,13 @@ def exportSettings():
     global numberShots
     global numberStacks
     global direction
+    global routineMode
+    global settleMode
+    global stepMode
+    global postProcessMode
+    global burstMode
 
-    myDict = {
-        "Brightness": brightness,
-        "Contrast": contrast,
-        "AWB Mode": awb_mode,
-        "AWB Gains": awb_gains,
-        "ISO": iso,
-        "Framerate": framerate,
-        "Shutter Speed": shutter_speed,
-        "Project Name": projectName,
-        "Camera Movement": cameraMovement,
-        "Dolly Movement": dollyMovement,
-        "Arc Length": arcLength,
-        "Number of Shots in Stack": numberShots,
-        "Number of Stacks": numberStacks,
-        "Direction": direction
-    }
+    myDict = currentSettings()
     
     x = datetime.datetime.now()
     timestamp = x.strftime('%b%d_%I:%M%p')
@@ -342,6 +840,11 @@ def exportSettings():
     
         f.write(json.dumps(myDict, indent=4))
 
+def bracketLabel(count, spacing): # How the Bracketing combo shows a bracket setting
+    if count <= 1:
+        return "Off"
+    return str(count) + " x " + "%g" % spacing + " EV"
+
 def loadDefaultSettings():
     global brightness
     global contrast
@@ -356,6 +859,15 @@ def loadDefaultSettings():
     global numberShots
     global numberStacks
     global direction
+    global routineMode
+    global settleMode
+    global stepMode
+    global postProcessMode
+    global burstMode
+    global fusionMode
+    global bracketCount
+    global bracketSpacing
+    global lockExposureMode
 
     with open('defaults.json') as f:
         defaults = json.load(f)
@@ -395,6 +907,23 @@ def loadDefaultSettings():
     numberStacks = defaults["Number of Stacks"]
     direction = defaults["Direction"]
     ui.direction_combo.setCurrentText(direction)
+    routineMode = defaults.get("Routine Mode", "Return Home")
+    ui.routine_mode_combo.setCurrentText(routineMode)
+    settleMode = defaults.get("Settle Mode", "Fixed")
+    ui.settle_mode_combo.setCurrentText(settleMode)
+    stepMode = defaults.get("Step Mode", "Fixed")
+    ui.step_mode_combo.setCurrentText(stepMode)
+    postProcessMode = defaults.get("Post Process", False)
+    ui.post_process_action.setChecked(postProcessMode)
+    burstMode = defaults.get("Burst Stack", False)
+    ui.burst_mode_check.setChecked(burstMode)
+    fusionMode = defaults.get("Fuse Stacks", False)
+    ui.fusion_mode_check.setChecked(fusionMode)
+    bracketCount = defaults.get("Bracket Exposures", 1)
+    bracketSpacing = defaults.get("Bracket Spacing", 2.0)
+    ui.bracket_combo.setCurrentText(bracketLabel(bracketCount, bracketSpacing))
+    lockExposureMode = defaults.get("Lock Exposure", False)
+    ui.lock_exposure_action.setChecked(lockExposureMode)
 
 
 
@@ -408,17 +937,60 @@ def calculateNumberStacks():
 
 
 
+class RoutineWorker(QtCore.QThread):
+    # Runs a stack or full routine off the GUI thread so the window stays responsive
+    done = QtCore.pyqtSignal(str) # empty when the routine completed, otherwise why it stopped
+
+    def __init__(self, routine):
+        QtCore.QThread.__init__(self)
+        self.routine = routine
+
+    def run(self):
+        message = ""
+        try:
+            self.routine()
+        except RoutineCancelled:
+            message = "Routine cancelled"
+        except Exception as e:
+            message = "Routine stopped: " + str(e)
+        finally:
+            if message:
+                disableMotors()
+                resetShotNumber()
+            routineControl.running = False
+        print(message or "Routine finished")
+        self.done.emit(message)
+
+
 class Ui_MainWindow(object):
     def setupUi(self, MainWindow):
         MainWindow.setObjectName("MainWindow")
-        MainWindow.resize(390, 876)
+        MainWindow.resize(1050, 1068)
         self.centralwidget = QtWidgets.QWidget(MainWindow)
         self.centralwidget.setObjectName("centralwidget")
         MainWindow.setCentralWidget(self.centralwidget)
         
         self.menubar = QtWidgets.QMenuBar(MainWindow)
-        self.menubar.setGeometry(QtCore.QRect(0, 0, 390, 18))
+        self.menubar.setGeometry(QtCore.QRect(0, 0, 1050, 18))
         self.menubar.setObjectName("menubar")
+        self.routine_menu = self.menubar.addMenu("Routine")
+        self.resume_action = self.routine_menu.addAction("Resume from Journal...")
+        self.resume_action.triggered.connect(self.resume_actionTriggered)
+        self.auto_range_action = self.routine_menu.addAction("Auto Range Stack")
+        self.auto_range_action.setStatusTip("Sweep the stack once and trim Home and the shot count to the frames in focus")
+        self.auto_range_action.triggered.connect(self.autoRange_actionTriggered)
+        self.estimate_action = self.routine_menu.addAction("Estimate Routine...")
+        self.estimate_action.triggered.connect(self.estimate_actionTriggered)
+        self.trace_action = self.routine_menu.addAction("Trace Routines")
+        self.trace_action.setCheckable(True) # each routine saves a <project>_trace_<time>.json for ui.perfetto.dev
+        self.post_process_action = self.routine_menu.addAction("Process Stacks in Background")
+        self.post_process_action.setCheckable(True)
+        self.post_process_action.setStatusTip("Fuse, thumbnail and check each finished stack while the next one is shot")
+        self.post_process_action.toggled.connect(self.postProcess_actionToggled)
+        self.lock_exposure_action = self.routine_menu.addAction("Lock Exposure for Routines")
+        self.lock_exposure_action.setCheckable(True)
+        self.lock_exposure_action.setStatusTip("Meter once when a routine starts and hold shutter, gains and white balance until it ends")
+        self.lock_exposure_action.toggled.connect(self.lockExposure_actionToggled)
         
         MainWindow.setMenuBar(self.menubar)
         self.statusbar = QtWidgets.QStatusBar(MainWindow)
@@ -584,6 +1156,23 @@ class Ui_MainWindow(object):
         self.stop_preview_btn.setGeometry(QtCore.QRect(140, 300, 111, 41))
         self.stop_preview_btn.setObjectName("stop_preview_btn")
 
+        # Preview Construction, to the right of the controls
+        self.preview_lbl = QtWidgets.QLabel(self.centralwidget)
+        self.preview_lbl.setGeometry(QtCore.QRect(390, 20, 640, 480))
+        self.preview_lbl.setObjectName("preview_lbl")
+        self.preview_lbl.setAlignment(QtCore.Qt.AlignCenter)
+        self.preview_lbl.setStyleSheet("background-color: black; color: gray")
+
+        self.preview_score_lbl = QtWidgets.QLabel(self.centralwidget)
+        self.preview_score_lbl.setGeometry(QtCore.QRect(390, 510, 640, 21))
+        self.preview_score_lbl.setObjectName("preview_score_lbl")
+
+        self.previewShown = 0 # number of the last frame painted, to skip repaints between frames
+        self.previewPeak = None # (sharpness, rail position) of the sharpest frame since the preview started
+        self.preview_timer = QtCore.QTimer(MainWindow)
+        self.preview_timer.setInterval(30)
+        self.preview_timer.timeout.connect(self.preview_update)
+
         # Test Shot Button Construction
         self.test_shot_btn = QtWidgets.QPushButton(self.centralwidget)
         self.test_shot_btn.setGeometry(QtCore.QRect(260, 300, 111, 41))
@@ -735,14 +1324,94 @@ class Ui_MainWindow(object):
         self.direction_combo.addItem("")
         self.direction_combo.addItem("")
 
+        # Routine Mode Combo Box Construction
+        self.routine_mode_lbl = QtWidgets.QLabel(self.centralwidget)
+        self.routine_mode_lbl.setGeometry(QtCore.QRect(20, 780, 141, 21))
+        self.routine_mode_lbl.setObjectName("routine_mode_lbl")
+
+        self.routine_mode_combo = QtWidgets.QComboBox(self.centralwidget)
+        self.routine_mode_combo.setGeometry(QtCore.QRect(170, 780, 201, 22))
+        self.routine_mode_combo.setObjectName("routine_mode_combo")
+        self.routine_mode_combo.addItem("")
+        self.routine_mode_combo.addItem("")
+        self.routine_mode_combo.currentTextChanged.connect(self.routineModeCombo_selected)
+
+        # Settle Mode Combo Box Construction
+        self.settle_mode_lbl = QtWidgets.QLabel(self.centralwidget)
+        self.settle_mode_lbl.setGeometry(QtCore.QRect(20, 820, 141, 21))
+        self.settle_mode_lbl.setObjectName("settle_mode_lbl")
+
+        self.settle_mode_combo = QtWidgets.QComboBox(self.centralwidget)
+        self.settle_mode_combo.setGeometry(QtCore.QRect(170, 820, 201, 22))
+        self.settle_mode_combo.setObjectName("settle_mode_combo")
+        self.settle_mode_combo.addItem("")
+        self.settle_mode_combo.addItem("")
+        self.settle_mode_combo.currentTextChanged.connect(self.settleModeCombo_selected)
+
+        # Step Mode Combo Box Construction
+        self.step_mode_lbl = QtWidgets.QLabel(self.centralwidget)
+        self.step_mode_lbl.setGeometry(QtCore.QRect(20, 860, 141, 21))
+        self.step_mode_lbl.setObjectName("step_mode_lbl")
+
+        self.step_mode_combo = QtWidgets.QComboBox(self.centralwidget)
+        self.step_mode_combo.setGeometry(QtCore.QRect(170, 860, 201, 22))
+        self.step_mode_combo.setObjectName("step_mode_combo")
+        self.step_mode_combo.addItem("")
+        self.step_mode_combo.addItem("")
+        self.step_mode_combo.currentTextChanged.connect(self.stepModeCombo_selected)
+
+        # Bracketing Combo Box Construction
+        self.bracket_lbl = QtWidgets.QLabel(self.centralwidget)
+        self.bracket_lbl.setGeometry(QtCore.QRect(20, 892, 141, 21))
+        self.bracket_lbl.setObjectName("bracket_lbl")
+
+        self.bracket_combo = QtWidgets.QComboBox(self.centralwidget)
+        self.bracket_combo.setGeometry(QtCore.QRect(170, 892, 201, 22))
+        self.bracket_combo.setObjectName("bracket_combo")
+        self.bracket_combo.addItem("")
+        self.bracket_combo.addItem("")
+        self.bracket_combo.addItem("")
+        self.bracket_combo.addItem("")
+        self.bracket_combo.currentTextChanged.connect(self.bracketCombo_selected)
+
+        # Burst Stack Check Box Construction
+        self.burst_mode_check = QtWidgets.QCheckBox(self.centralwidget)
+        self.burst_mode_check.setGeometry(QtCore.QRect(20, 924, 171, 21))
+        self.burst_mode_check.setObjectName("burst_mode_check")
+        self.burst_mode_check.toggled.connect(self.burstModeCheck_toggled)
+
+        # Fuse Stacks Check Box Construction
+        self.fusion_mode_check = QtWidgets.QCheckBox(self.centralwidget)
+        self.fusion_mode_check.setGeometry(QtCore.QRect(20, 946, 171, 21))
+        self.fusion_mode_check.setObjectName("fusion_mode_check")
+        self.fusion_mode_check.toggled.connect(self.fusionModeCheck_toggled)
+
+        # Pause and Cancel Button Construction
+        self.pause_btn = QtWidgets.QPushButton(self.centralwidget)
+        self.pause_btn.setGeometry(QtCore.QRect(200, 927, 81, 31))
+        self.pause_btn.setObjectName("pause_btn")
+        self.pause_btn.setEnabled(False)
+
+        self.cancel_btn = QtWidgets.QPushButton(self.centralwidget)
+        self.cancel_btn.setGeometry(QtCore.QRect(290, 927, 81, 31))
+        self.cancel_btn.setObjectName("cancel_btn")
+        self.cancel_btn.setEnabled(False)
+
+        # Routine progress is polled rather than pushed, so the routine thread never waits on a repaint
+        self.routineWorker = None
+        self.routineTrace = None # the ChromeTrace of the running routine when Trace Routines is checked
+        self.progress_timer = QtCore.QTimer(MainWindow)
+        self.progress_timer.setInterval(100)
+        self.progress_timer.timeout.connect(self.progress_update)
+
         # Export Settings Button Construction
         self.export_settings_btn = QtWidgets.QPushButton(self.centralwidget)
-        self.export_settings_btn.setGeometry(QtCore.QRect(20, 780, 171, 41))
+        self.export_settings_btn.setGeometry(QtCore.QRect(20, 972, 171, 41))
         self.export_settings_btn.setObjectName("export_settings_btn")
 
         # Run Full Routine Button Construction
         self.run_full_routine_btn = QtWidgets.QPushButton(self.centralwidget)
-        self.run_full_routine_btn.setGeometry(QtCore.QRect(200, 780, 171, 41))
+        self.run_full_routine_btn.setGeometry(QtCore.QRect(200, 972, 171, 41))
         self.run_full_routine_btn.setObjectName("run_full_routine_btn")
 
         self.retranslateUi(MainWindow)
@@ -759,6 +1428,8 @@ class Ui_MainWindow(object):
         # Stop Preview Button Connection
         self.stop_preview_btn.setText(_translate("MainWindow", "Stop Preview"))
         self.stop_preview_btn.clicked.connect(self.stopPreview_btnClicked)
+        self.preview_lbl.setText(_translate("MainWindow", "Preview stopped"))
+        self.preview_score_lbl.setStatusTip(_translate("MainWindow", "Red marks edges in focus; step the rail to where the sharpness peaks to set the stack start and end"))
 
         # Test Shot Button Connection
         self.test_shot_btn.setText(_translate("MainWindow", "Test Shot"))
@@ -796,6 +1467,14 @@ class Ui_MainWindow(object):
         self.run_full_routine_btn.setText(_translate("MainWindow", "Run Full Routine"))
         self.run_full_routine_btn.clicked.connect(self.runFullRoutine_btnClicked)
 
+        # Pause Button Connection
+        self.pause_btn.setText(_translate("MainWindow", "Pause"))
+        self.pause_btn.clicked.connect(self.pause_btnClicked)
+
+        # Cancel Button Connection
+        self.cancel_btn.setText(_translate("MainWindow", "Cancel"))
+        self.cancel_btn.clicked.connect(self.cancel_btnClicked)
+
         # Labels
         self.brightness_lbl.setText(_translate("MainWindow", "Brightness"))
         #self.brightness_lbl.setStatusTip(_translate("MainWindow", "Manually adjust brightness")) # Example of tooltip
@@ -858,6 +1537,31 @@ class Ui_MainWindow(object):
         self.direction_combo.setItemText(0, _translate("MainWindow", "Clockwise"))
         self.direction_combo.setItemText(1, _translate("MainWindow", "Counter-Clockwise"))
 
+        self.routine_mode_lbl.setText(_translate("MainWindow", "Routine Mode"))
+        self.routine_mode_lbl.setStatusTip(_translate("MainWindow", "Serpentine shoots every second stack back-to-front instead of returning home"))
+        self.routine_mode_combo.setItemText(0, _translate("MainWindow", "Return Home"))
+        self.routine_mode_combo.setItemText(1, _translate("MainWindow", "Serpentine"))
+
+        self.settle_mode_lbl.setText(_translate("MainWindow", "Settle Mode"))
+        self.settle_mode_lbl.setStatusTip(_translate("MainWindow", "Adaptive shoots as soon as the preview stops moving, up to the shot pause"))
+        self.settle_mode_combo.setItemText(0, _translate("MainWindow", "Fixed"))
+        self.settle_mode_combo.setItemText(1, _translate("MainWindow", "Adaptive"))
+        self.step_mode_lbl.setText(_translate("MainWindow", "Step Mode"))
+        self.step_mode_lbl.setStatusTip(_translate("MainWindow", "Adaptive lengthens or shortens each rail step so neighbouring frames just overlap in focus"))
+        self.step_mode_combo.setItemText(0, _translate("MainWindow", "Fixed"))
+        self.step_mode_combo.setItemText(1, _translate("MainWindow", "Adaptive"))
+        self.bracket_lbl.setText(_translate("MainWindow", "Bracketing"))
+        self.bracket_lbl.setStatusTip(_translate("MainWindow", "Shoot several exposures at every rail position, merged when the stack is post-processed"))
+        self.bracket_combo.setItemText(0, _translate("MainWindow", "Off"))
+        self.bracket_combo.setItemText(1, _translate("MainWindow", "3 x 1 EV"))
+        self.bracket_combo.setItemText(2, _translate("MainWindow", "3 x 2 EV"))
+        self.bracket_combo.setItemText(3, _translate("MainWindow", "5 x 1 EV"))
+
+        self.burst_mode_check.setText(_translate("MainWindow", "Burst Stack"))
+        self.burst_mode_check.setStatusTip(_translate("MainWindow", "Keep the video port streaming through a stack instead of a still capture per shot"))
+        self.fusion_mode_check.setText(_translate("MainWindow", "Fuse Stacks"))
+        self.fusion_mode_check.setStatusTip(_translate("MainWindow", "Focus stack each stack on the Pi as it is shot, saved next to the stack folder"))
+
     # Brightness Adjustment Methods
     def brightnessSlider_changed(self):
         global brightness
@@ -944,10 +1648,36 @@ class Ui_MainWindow(object):
     # Start Preview Button
     def startPreview_btnClicked(self):
         camPreviewWindowed()
+        self.previewShown = 0
+        self.previewPeak = None
+        self.preview_timer.start()
 
     # Stop Preview Button
     def stopPreview_btnClicked(self):
+        self.preview_timer.stop()
         camStopPreview()
+        self.preview_lbl.clear()
+        self.preview_lbl.setText("Preview stopped")
+
+    def preview_update(self): # Paint the newest preview frame, if there is one since the last poll
+        if previewStream is None:
+            return
+        error = previewStream.error
+        if error is not None:
+            self.stopPreview_btnClicked()
+            self.preview_score_lbl.setText("Preview failed: " + str(error))
+            return
+        frame, score, count = previewStream.latest()
+        if frame is None or count == self.previewShown:
+            return
+        self.previewShown = count
+        height, width = frame.shape[:2]
+        image = QtGui.QImage(frame.data, width, height, 3 * width, QtGui.QImage.Format_RGB888)
+        self.preview_lbl.setPixmap(QtGui.QPixmap.fromImage(image)) # copies, so the frame can be dropped
+        if self.previewPeak is None or score > self.previewPeak[0]:
+            self.previewPeak = (score, sliderPosition)
+        self.preview_score_lbl.setText("Sharpness " + str(round(score, 1)) + "   peak " + str(round(self.previewPeak[0], 1))
+                                       + " at rail " + str(self.previewPeak[1]) + "   " + str(round(previewStream.fps, 1)) + " fps")
 
     # Test Shot Button
     def testShot_btnClicked(self):
@@ -1006,7 +1736,7 @@ class Ui_MainWindow(object):
 
     # Shoot Stack Button
     def shootStack_btnClicked(self):
-        runStackRoutine()
+        self.startRoutine(runStackRoutine)
 
     # Dolly Movement Adjustment Methods
     def dollyMovementSlider_changed(self):
@@ -1047,13 +1777,181 @@ class Ui_MainWindow(object):
         global direction
         direction = self.direction_combo.currentText()
 
+    # Routine Mode ComboBox
+    def routineModeCombo_selected(self):
+        global routineMode
+        routineMode = self.routine_mode_combo.currentText()
+
+    # Settle Mode ComboBox
+    def settleModeCombo_selected(self):
+        global settleMode
+        settleMode = self.settle_mode_combo.currentText()
+
+    # Step Mode ComboBox
+    def stepModeCombo_selected(self):
+        global stepMode
+        stepMode = self.step_mode_combo.currentText()
+
+    # Bracketing ComboBox
+    def bracketCombo_selected(self):
+        global bracketCount
+        global bracketSpacing
+        text = self.bracket_combo.currentText()
+        if text == "Off":
+            bracketCount = 1
+        else:
+            count, spacing = text.replace(" EV", "").split(" x ")
+            bracketCount = int(count)
+            bracketSpacing = float(spacing)
+            self.post_process_action.setChecked(True) # brackets are merged by post-processing
+
+    # Burst Stack CheckBox
+    def burstModeCheck_toggled(self):
+        global burstMode
+        burstMode = self.burst_mode_check.isChecked()
+
+    # Fuse Stacks CheckBox
+    def fusionModeCheck_toggled(self):
+        global fusionMode
+        fusionMode = self.fusion_mode_check.isChecked()
+
     # Export Settings Button()
     def exportSettings_btnClicked(self):
         exportSettings()
         #loadDefaultSettings()
 
     def runFullRoutine_btnClicked(self):
-        runFullRoutine()
+        self.startRoutine(runFullRoutine)
+
+    # Background Routine Methods
+    def startRoutine(self, routine):
+        if self.routineWorker is not None:
+            return
+        self.setRoutineRunning(True)
+        self.routineTrace = None
+        if self.trace_action.isChecked() and spans.collector is None:
+            self.routineTrace = ChromeTrace()
+            spans.collect(self.routineTrace)
+        self.routineWorker = runInBackground(routine, self.routine_done)
+        self.progress_timer.start()
+
+    def setRoutineRunning(self, running):
+        # Lock out anything else that moves the rig while a routine runs, and every setting:
+        # the routine thread reads the settings as it goes, so a change mid-run would change
+        # the spacing, numbering and journal of the stacks already under way
+        self.resume_action.setEnabled(not running)
+        self.auto_range_action.setEnabled(not running)
+        self.estimate_action.setEnabled(not running) # the estimate borrows the rig's globals while it runs
+        self.post_process_action.setEnabled(not running)
+        self.lock_exposure_action.setEnabled(not running)
+        for widget in (self.run_full_routine_btn, self.shoot_stack_btn, self.single_shot_btn, self.test_shot_btn,
+                       self.camera_forward_btn, self.camera_reverse_btn, self.go_home_btn, self.set_home_btn):
+            widget.setEnabled(not running)
+        for widget in (self.brightness_slider, self.brightness_input, self.contrast_slider, self.contrast_input,
+                       self.awb_mode_combo, self.awb_gains_slider, self.awb_gains_input, self.iso_slider,
+                       self.iso_input, self.framerate_combo, self.shutter_speed_combo, self.project_name_input,
+                       self.camera_movement_slider, self.camera_movement_input, self.num_shots_slider,
+                       self.num_shots_input, self.dolly_movement_slider, self.dolly_movement_input,
+                       self.arc_length_slider, self.arc_length_input, self.direction_combo, self.routine_mode_combo,
+                       self.settle_mode_combo, self.step_mode_combo, self.bracket_combo, self.burst_mode_check,
+                       self.fusion_mode_check):
+            widget.setEnabled(not running)
+        self.pause_btn.setEnabled(running)
+        self.cancel_btn.setEnabled(running)
+        self.pause_btn.setText("Pause")
+
+    def progress_update(self):
+        self.location_value_lbl.setText(str(routineControl.position))
+        message = routineControl.describe()
+        if postProcessor is not None: # the backlog shows whether processing keeps up with capture
+            message += " | " + postProcessor.describe()
+        self.statusbar.showMessage(message)
+
+    def routine_done(self, message):
+        self.progress_timer.stop()
+        self.routineWorker.wait()
+        self.routineWorker = None
+        self.setRoutineRunning(False)
+        self.location_value_lbl.setText(str(sliderPosition))
+        self.num_shots_input.setText(str(numberShots)) # auto range changes the shot count
+        if self.routineTrace is not None:
+            imageWriter.flush() # so the last file writes make it into the trace
+            spans.collect(None)
+            traceFile = projectName + "_trace_" + datetime.datetime.now().strftime('%b%d_%H%M%S') + ".json"
+            self.routineTrace.save(traceFile)
+            self.routineTrace = None
+            message = (message or "Routine finished") + ", trace saved to " + traceFile
+        self.statusbar.showMessage(message or "Routine finished")
+
+    # Resume Menu Item
+    def resume_actionTriggered(self):
+        journalFile, _ = QtWidgets.QFileDialog.getOpenFileName(None, "Resume Routine", os.getcwd(), "Routine Journal (*_journal.jsonl)")
+        if journalFile:
+            self.startRoutine(lambda: resumeFullRoutine(journalFile))
+
+    # Process Stacks Menu Item
+    def postProcess_actionToggled(self, checked):
+        global postProcessMode
+        postProcessMode = checked
+
+    # Lock Exposure Menu Item
+    def lockExposure_actionToggled(self, checked):
+        global lockExposureMode
+        lockExposureMode = checked
+
+    # Auto Range Menu Item
+    def autoRange_actionTriggered(self):
+        self.startRoutine(autoRange)
+
+    # Estimate Menu Item
+    def estimate_actionTriggered(self):
+        # The dry run takes seconds to minutes, so it runs on a worker like a routine, with the
+        # window locked. The progress readout is not polled: the positions it goes through are simulated.
+        import sys
+        from dryrun import dryRun
+        if self.routineWorker is not None:
+            return
+        result = {}
+        def estimate():
+            try:
+                result["estimate"] = dryRun(sys.modules[__name__])
+            except RuntimeError as e: # refused, the rig is busy
+                result["message"] = str(e)
+        self.setRoutineRunning(True)
+        self.start_preview_btn.setEnabled(False) # the preview would run on the dry run's virtual clock
+        self.pause_btn.setEnabled(False)
+        self.cancel_btn.setEnabled(False)
+        self.statusbar.showMessage("Estimating the routine...")
+        self.routineWorker = RoutineWorker(estimate)
+        self.routineWorker.done.connect(lambda message: self.estimate_done(result, message))
+        self.routineWorker.start()
+
+    def estimate_done(self, result, message):
+        from dryrun import formatEstimate
+        self.routineWorker.wait()
+        self.routineWorker = None
+        self.setRoutineRunning(False)
+        self.start_preview_btn.setEnabled(True)
+        self.statusbar.clearMessage()
+        if "estimate" in result:
+            QtWidgets.QMessageBox.information(None, "Routine Estimate", formatEstimate(result["estimate"]))
+        else:
+            QtWidgets.QMessageBox.warning(None, "Routine Estimate", result.get("message", message))
+
+    # Pause Button
+    def pause_btnClicked(self):
+        if routineControl.paused():
+            routineControl.resume()
+            self.pause_btn.setText("Pause")
+        else:
+            routineControl.pause()
+            self.pause_btn.setText("Resume")
+        self.progress_update()
+
+    # Cancel Button
+    def cancel_btnClicked(self):
+        routineControl.cancel()
+        self.statusbar.showMessage("Cancelling after the current shot...")
     
 
 
@@ -1061,6 +1959,22 @@ class Ui_MainWindow(object):
 
 if __name__ == "__main__":
     import sys
+    if "--trace" in sys.argv[:-1]: # python app.py --trace run.json records every routine this session, saved on exit
+        import atexit
+        index = sys.argv.index("--trace")
+        sessionTrace = ChromeTrace()
+        spans.collect(sessionTrace)
+        atexit.register(sessionTrace.save, sys.argv[index + 1])
+        del sys.argv[index:index + 2]
+    if len(sys.argv) > 2 and sys.argv[1] == "--resume": # python app.py --resume shot_journal.jsonl, without the window
+        resumeFullRoutine(sys.argv[2])
+        imageWriter.close()
+        if stackFusion is not None:
+            stackFusion.close()
+        if postProcessor is not None:
+            postProcessor.close()
+            print(postProcessor.describe())
+        sys.exit(0)
     app = QtWidgets.QApplication(sys.argv)
     MainWindow = QtWidgets.QMainWindow()
     ui = Ui_MainWindow()
@@ -0,0 +1,42 @@
+import threading
+from hardware import clock
+
+# Coordinated moves for mechanically independent axes (focus rail, turntable dolly)
+
+def runConcurrently(*moves):
+    # Runs each move (a function taking no arguments) at the same time and returns once all are done.
+    # The first move runs on the calling thread, so it is the one allowed to touch the Qt UI.
+    # An exception in any move is raised again here after every move has finished.
+    if clock.virtual:
+        return runVirtual(moves)
+    errors = []
+
+    def runMove(move):
+        try:
+            move()
+        except Exception as e:
+            errors.append(e)
+
+    workers = []
+    for move in moves[1:]:
+        worker = threading.Thread(target=runMove, args=(move,))
+        worker.daemon = True
+        worker.start()
+        workers.append(worker)
+    if moves:
+        runMove(moves[0])
+    for worker in workers:
+        worker.join()
+    if errors:
+        raise errors[0]
+
+def runVirtual(moves):
+    # Under the virtual clock, threads would add their sleeps together. Run the moves one
+    # after another from the same start time instead and finish at the latest end time.
+    start = clock.monotonic()
+    end = start
+    for move in moves:
+        clock.now = start
+        move()
+        end = max(end, clock.monotonic())
+    clock.now = end
@@ -0,0 +1,174 @@
+import os
+os.environ.setdefault("SCANNER_BACKEND", "sim") # must be set before app.py loads its hardware
+
+import argparse
+import contextlib
+import datetime
+import json
+import platform
+import statistics
+import tempfile
+import time
+
+import app
+from hardware import clock
+
+# Routine throughput benchmarks, run against the simulated hardware
+#   python benchmark.py --output bench.json
+# Step timing and shoot() latency run on the real clock, so they measure the
+# Python overhead and sleep jitter of this machine. Stack and full routine
+# timings run on the virtual clock, so a 72 stack routine takes seconds.
+
+RAIL_PINS = (app.in1_2, app.in2_2, app.in3_2, app.in4_2)
+
+ROUTINES = [
+    {"name": "72x20 return home", "numberStacks": 72, "numberShots": 20, "routineMode": "Return Home"},
+    {"name": "72x20 serpentine", "numberStacks": 72, "numberShots": 20, "routineMode": "Serpentine"},
+    {"name": "36x40 return home", "numberStacks": 36, "numberShots": 40, "routineMode": "Return Home"},
+]
+
+def summarize(values): # Count, mean, spread and tail of a list of timings (sec)
+    values = sorted(values)
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "mean": statistics.mean(values),
+        "stdev": statistics.pstdev(values),
+        "min": values[0],
+        "p50": values[len(values) // 2],
+        "p99": values[min(len(values) - 1, int(len(values) * 0.99))],
+        "max": values[-1],
+    }
+
+def quiet(): # app.py narrates every step and shot
+    return contextlib.redirect_stdout(open(os.devnull, 'w'))
+
+def benchSteps(cycles):
+    # Times every phase written to the rail during one forward() and one reverse() move
+    clock.virtual = False
+    cameraMovement = app.cameraMovement
+    app.cameraMovement = cycles
+    results = {}
+    for name, move in (("forward", app.forward), ("reverse", app.reverse)):
+        app.GPIO.transitions = []
+        app.railMotor.timer.jitter.reset()
+        start = time.perf_counter()
+        with quiet():
+            move()
+        elapsed = time.perf_counter() - start
+        stamps = sorted(set(t for t, pin, value in app.GPIO.transitions if pin in RAIL_PINS))
+        intervals = [b - a for a, b in zip(stamps, stamps[1:])]
+        result = summarize(intervals)
+        result["steps"] = cycles * 4
+        result["seconds"] = elapsed
+        result["stepsPerSecond"] = cycles * 4 / elapsed
+        result["lateness"] = app.railMotor.timer.jitter.summary()
+        results[name] = result
+    app.cameraMovement = cameraMovement
+    return results
+
+def benchShoot(shots):
+    clock.virtual = False
+    app.path = "."
+    latencies = []
+    with quiet():
+        for x in range(shots):
+            start = time.perf_counter()
+            app.shoot()
+            latencies.append(time.perf_counter() - start)
+        app.imageWriter.flush()
+    app.resetShotNumber()
+    return summarize(latencies)
+
+def benchStack(numberShots):
+    clock.virtual = True
+    app.numberShots = numberShots
+    app.stackNumber = 1
+    app.setHome()
+    start = clock.monotonic()
+    with quiet():
+        app.runStackRoutine()
+    elapsed = clock.monotonic() - start
+    return {"shots": numberShots, "seconds": elapsed, "secondsPerShot": elapsed / numberShots}
+
+def benchRoutine(config):
+    clock.virtual = True
+    app.numberStacks = config["numberStacks"]
+    app.numberShots = config["numberShots"]
+    app.routineMode = config["routineMode"]
+    app.projectName = "bench"
+    app.stackNumber = 1
+    app.camera.captures = []
+    app.GPIO.record = False # a full routine makes far too many transitions to keep
+    cwd = os.getcwd()
+    os.chdir(tempfile.mkdtemp(dir=cwd)) # every routine starts from an empty project folder
+    hostStart = time.perf_counter()
+    start = clock.monotonic()
+    try:
+        with quiet():
+            app.runFullRoutine()
+    finally:
+        app.imageWriter.flush()
+        app.GPIO.record = True
+        os.chdir(cwd)
+    elapsed = clock.monotonic() - start
+    return {
+        "numberStacks": config["numberStacks"],
+        "numberShots": config["numberShots"],
+        "routineMode": config["routineMode"],
+        "seconds": elapsed,
+        "hours": elapsed / 3600.0,
+        "captures": len(app.camera.captures),
+        "hostSeconds": time.perf_counter() - hostStart,
+    }
+
+def runBenchmarks(quick=False):
+    results = {}
+    cameraSize = app.camera.bytesPerPixel
+    with tempfile.TemporaryDirectory() as workDir:
+        cwd = os.getcwd()
+        os.chdir(workDir)
+        try:
+            results["steps"] = benchSteps(50 if quick else 250)
+            results["shoot"] = benchShoot(3 if quick else 10)
+            results["stack"] = benchStack(5 if quick else 20)
+            # Keep the simulated files tiny; the timings come from the virtual clock, not the disk
+            app.camera.bytesPerPixel = 0.0001
+            routines = ROUTINES[:1] if quick else ROUTINES
+            results["routines"] = [benchRoutine(config) for config in routines]
+        finally:
+            app.camera.bytesPerPixel = cameraSize
+            app.imageWriter.flush()
+            os.chdir(cwd)
+    clock.virtual = False
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the scanner routines against simulated hardware")
+    parser.add_argument("--output", default="benchmark.json", help="where to write the results (JSON)")
+    parser.add_argument("--quick", action="store_true", help="smaller moves and a single routine config")
+    args = parser.parse_args()
+
+    report = {
+        "timestamp": datetime.datetime.now().isoformat(),
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "settings": {
+            "sleepTime": app.sleepTime,
+            "stepSpinTime": app.stepSpinTime,
+            "homeSleepTime": app.homeSleepTime,
+            "motionProfile": app.motionProfile,
+            "shotPause": app.shotPause,
+            "settleMode": app.settleMode,
+            "burstMode": app.burstMode,
+            "cameraMovement": app.cameraMovement,
+            "dollyMovement": app.dollyMovement,
+        },
+        "results": runBenchmarks(args.quick),
+    }
+    with open(args.output, 'w') as f:
+        f.write(json.dumps(report, indent=4))
+    for routine in report["results"]["routines"]:
+        print(routine["numberStacks"], "x", routine["numberShots"], routine["routineMode"] + ":", round(routine["hours"], 2), "hours")
+    print("Results written to " + args.output)
@@ -0,0 +1,176 @@
+import os
+import re
+import numpy as np
+from fusion import laplacianEnergy, loadImage, saveImage
+
+# Exposure bracketing
+# With bracketing on, every rail position is shot several times at shutter
+# speeds spaced a few stops apart, without moving. The brackets go to
+# <stack folder>_brackets/ (shot07_1.jpg, shot07_2.jpg, ...) and are merged into
+# the frame the stack folder would have held (shot07.jpg) by exposure fusion:
+# each pixel is a blend of the brackets weighted by local contrast, colour
+# saturation and how close it is to mid grey, blended through Laplacian
+# pyramids so the weights do not show as seams. Nothing is tone mapped, the
+# result is an ordinary 8 bit frame that focus stacking and photogrammetry
+# take as it is. Merging runs in the post-processing workers (postprocess.py).
+#   python bracket.py shot_1 shot_2 ...   merges stacks that are already on disk
+
+KERNEL = np.array([1, 4, 6, 4, 1], np.float32) / 16
+BAND = 64 # output rows the pyramid filters work out at a time
+
+def bracketShutters(base, count, spacing): # Shutter speeds (µs) of count brackets spacing stops apart, centred on base
+    return [int(round(base * 2 ** ((i - (count - 1) / 2.0) * spacing))) for i in range(count)]
+
+def bracketsFolder(folder):
+    return folder.rstrip("/") + "_brackets"
+
+def bracketName(folder, filename, index): # Where bracket index (0 based) of a stack frame is written
+    stem, extension = os.path.splitext(os.path.basename(filename))
+    return os.path.join(folder, stem + "_" + str(index + 1) + extension)
+
+def mergedName(filename): # The stack frame a bracket is merged into; any other file is its own frame
+    folder, name = os.path.split(filename)
+    match = re.match(r'(.*\d)_\d+(\.\w+)$', name)
+    if not folder.endswith("_brackets") or match is None:
+        return filename
+    return os.path.join(folder[:-len("_brackets")], match.group(1) + match.group(2))
+
+def bracketFrames(folder): # {merged filename: [bracket filenames in exposure order]} of a stack
+    groups = {}
+    brackets = bracketsFolder(folder)
+    if not os.path.isdir(brackets):
+        return groups
+    for name in sorted(os.listdir(brackets), key=lambda name: [int(n) for n in re.findall(r'\d+', name)]):
+        filename = os.path.join(brackets, name)
+        merged = mergedName(filename)
+        if merged != filename:
+            groups.setdefault(merged, []).append(filename)
+    return groups
+
+def blurBands(source, rows, columns, height, width, step=1):
+    # Separable 5 tap binomial blur, BAND output rows at a time, as (top, bottom, band). The
+    # image blurred is source[rows][:, columns]: the index arrays run 2 pixels past each edge
+    # (repeating it), and can repeat source pixels to blur an enlarged copy of it without
+    # building one. With step 2 only every second row and column is computed, which is all
+    # a pyramid level keeps.
+    outRows = (height + step - 1) // step
+    outColumns = (width + step - 1) // step
+    for top in range(0, outRows, BAND):
+        bottom = min(top + BAND, outRows)
+        span = (bottom - top - 1) * step + 1
+        patch = np.take(np.take(source, rows[top * step:top * step + span + 4], axis=0), columns, axis=1)
+        patch = patch.astype(np.float32, copy=False)
+        vertical = KERNEL[0] * patch[0:span:step]
+        for i in range(1, 5):
+            vertical += KERNEL[i] * patch[i:i + span:step]
+        span = (outColumns - 1) * step + 1
+        band = KERNEL[0] * vertical[:, 0:span:step]
+        for i in range(1, 5):
+            band += KERNEL[i] * vertical[:, i:i + span:step]
+        yield top, bottom, band
+
+def edgeIndex(size, factor=1): # Source index of every padded position along an axis of size pixels
+    return np.clip(np.arange(-2, size + 2), 0, size - 1) // factor
+
+def shrink(image): # The next pyramid level: blurred, every second row and column, float32
+    height, width = image.shape[:2]
+    result = np.empty(((height + 1) // 2, (width + 1) // 2) + image.shape[2:], np.float32)
+    for top, bottom, band in blurBands(image, edgeIndex(height), edgeIndex(width), height, width, 2):
+        result[top:bottom] = band
+    return result
+
+def expandBands(image, shape): # The image doubled in size to shape (height, width) and blurred, in bands
+    return blurBands(image, edgeIndex(shape[0], 2), edgeIndex(shape[1], 2), shape[0], shape[1])
+
+def gaussianPyramid(image, levels): # The first level is the image itself, whatever its dtype
+    pyramid = [image]
+    for i in range(levels - 1):
+        pyramid.append(shrink(pyramid[-1]))
+    return pyramid
+
+def exposureWeights(image):
+    # Contrast (Laplacian magnitude of the luma), saturation (spread of the channels) and
+    # well-exposedness (closeness of every channel to mid grey), multiplied. Worked out a
+    # band at a time, with a row either side for the Laplacian.
+    height = image.shape[0]
+    weights = np.empty(image.shape[:2], np.float32)
+    for top in range(0, height, 4 * BAND):
+        bottom = min(top + 4 * BAND, height)
+        first, last = max(0, top - 1), min(height, bottom + 1)
+        channels = np.moveaxis(image[first:last], 2, 0).astype(np.float32) # planes: numpy is slow along a 3 long axis
+        channels /= np.float32(255)
+        red, green, blue = channels
+        contrast = np.sqrt(laplacianEnergy(red * np.float32(0.299) + green * np.float32(0.587)
+                                           + blue * np.float32(0.114), 0))
+        mean = (red + green + blue) / np.float32(3)
+        saturation = np.sqrt((np.square(red - mean) + np.square(green - mean) + np.square(blue - mean)) / np.float32(3))
+        channels -= np.float32(0.5)
+        np.square(channels, out=channels)
+        wellExposed = np.exp((red + green + blue) / np.float32(-2 * 0.2 ** 2))
+        weight = contrast * saturation * wellExposed + np.float32(1e-12)
+        weights[top:bottom] = weight[top - first:bottom - first]
+    return weights
+
+def mergeExposures(images, levels=None):
+    # Exposure fusion of RGB uint8 frames of the same view. The weight maps (one float per
+    # pixel and frame) are normalised up front; then one frame at a time, each Laplacian level
+    # is worked out in bands and added, times its weights, straight into the running blend.
+    # No frame's Laplacian pyramid is ever built whole, so the working set is the weight maps,
+    # the blend, one frame's Gaussian pyramids and a few bands.
+    height, width = images[0].shape[:2]
+    if levels is None:
+        levels = max(1, int(np.log2(min(height, width))) - 4)
+    weights = [exposureWeights(image) for image in images]
+    total = weights[0].copy()
+    for weight in weights[1:]:
+        total += weight
+    for weight in weights:
+        weight /= total
+    del total
+    blended = None
+    for image, weight in zip(images, weights):
+        weightPyramid = gaussianPyramid(weight, levels)
+        imagePyramid = gaussianPyramid(image, levels)
+        if blended is None:
+            blended = [np.zeros(level.shape, np.float32) for level in imagePyramid]
+        for level in range(levels - 1): # the Laplacian level is this level less the next one up, enlarged
+            fine, w, result = imagePyramid[level], weightPyramid[level], blended[level]
+            for top, bottom, band in expandBands(imagePyramid[level + 1], fine.shape):
+                np.subtract(fine[top:bottom], band, out=band)
+                band *= w[top:bottom, :, None]
+                result[top:bottom] += band
+        blended[-1] += imagePyramid[-1] * weightPyramid[-1][..., None]
+        del imagePyramid, weightPyramid
+    del weights
+    image = blended[-1]
+    merged = np.empty(images[0].shape, np.uint8)
+    for level in reversed(range(levels - 1)): # collapse, the finest level straight into 8 bit
+        result = blended[level]
+        for top, bottom, band in expandBands(image, result.shape):
+            band += result[top:bottom]
+            if level == 0:
+                band += np.float32(0.5)
+                merged[top:bottom] = np.clip(band, 0, 255)
+            else:
+                result[top:bottom] = band
+        image = result
+    if levels == 1:
+        merged[:] = np.clip(image + np.float32(0.5), 0, 255)
+    return merged
+
+def mergeBrackets(folder): # Merge every bracketed frame of a stack that is not merged yet; returns how many were
+    merged = 0
+    for filename, brackets in sorted(bracketFrames(folder).items()):
+        if os.path.exists(filename):
+            continue
+        saveImage(filename, mergeExposures([loadImage(bracket) for bracket in brackets]))
+        merged += 1
+    return merged
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Merge the exposure brackets of stack folders that are already on disk")
+    parser.add_argument("folders", nargs="+", help="stack folders, e.g. shot_1 (the brackets are in shot_1_brackets)")
+    args = parser.parse_args()
+    for folder in args.folders:
+        print(folder + ": merged " + str(mergeBrackets(folder)) + " frames")
@@ -0,0 +1,26 @@
+import io
+
+# Burst stack capture
+# A still capture switches the camera into still mode and re-runs AE/AWB every
+# time. For a stack we keep the video port streaming and pull each frame from
+# one persistent capture_continuous iterator right after the rail settles.
+
+class BurstCapture(object):
+    def __init__(self, camera, format='jpeg'):
+        self.stream = io.BytesIO()
+        self.frames = camera.capture_continuous(self.stream, format=format, use_video_port=True)
+
+    def grab(self): # Capture the next frame and return its encoded bytes
+        self.stream.seek(0)
+        self.stream.truncate()
+        next(self.frames)
+        return self.stream.getvalue()
+
+    def close(self):
+        self.frames.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,112 @@
+import contextlib
+import os
+import tempfile
+
+import spans
+from hardware import clock
+from settle import CameraFrameSource
+from simulated import SimGPIO, SimCamera, SimWriter
+from spans import PhaseTotals
+from stepper import Stepper
+
+# Dry run of a full routine
+#   python dryrun.py --settings exported_settings.json
+# Runs runFullRoutine() with the current settings against simulated pins,
+# camera and card on the virtual clock, and reports how long the routine will
+# take per phase and how much it will write, without touching the rig.
+# "write" is how long the card is busy writing (bytes over its speed), most
+# of which overlaps the moves after each shot. The phase times add up to more
+# than the total where phases overlap (homing the rail while the turntable
+# turns, writes while the rail moves).
+
+PHASES = ("move", "settle", "capture", "write", "rotate")
+
+def dryRun(rig, cardBytesPerSecond=12000000):
+    # rig is the app module. Its hardware and counters are swapped out for the run
+    # and put back afterwards, so this is safe to call from the window between routines
+    # (it runs on the window's routine worker, see app.py).
+    # The run switches the shared clock to virtual time, which would also speed up any
+    # routine or preview running beside it, so it refuses to start while one is.
+    if rig.routineControl.running:
+        raise RuntimeError("A routine is running; estimate once it has finished")
+    if rig.previewStream is not None:
+        raise RuntimeError("The preview is running; stop it to estimate a routine")
+    simCamera = SimCamera()
+    simCamera.resolution = rig.camera.resolution
+    simGPIO = SimGPIO(record=False)
+    hardware = {
+        "GPIO": simGPIO,
+        "camera": simCamera,
+        "railMotor": Stepper(simGPIO, rig.railMotor.pins, rig.stepSpinTime),
+        "settleSource": CameraFrameSource(simCamera),
+        "imageWriter": SimWriter(cardBytesPerSecond),
+        "fusionMode": False, # fusing runs beside the routine and does not add to its time
+        "stepMode": "Fixed", # adaptive steps depend on the subject, so estimate the configured step
+        "postProcessMode": False,
+        "recordManifest": False,
+    }
+    saved = dict((name, getattr(rig, name)) for name in list(hardware) + ["stackNumber", "shotNumber", "sliderPosition", "path"])
+    virtual = clock.virtual
+    totals = PhaseTotals()
+    previous = spans.collect(totals)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workDir:
+        os.chdir(workDir) # stack folders and the journal land here and are thrown away
+        for name, value in hardware.items():
+            setattr(rig, name, value)
+        clock.virtual = True
+        start = clock.monotonic()
+        try:
+            rig.routineControl.reset()
+            with contextlib.redirect_stdout(open(os.devnull, 'w')):
+                rig.runFullRoutine()
+                rig.imageWriter.flush()
+            seconds = clock.monotonic() - start
+        finally:
+            clock.virtual = virtual
+            spans.collect(previous)
+            for name, value in saved.items():
+                setattr(rig, name, value)
+            rig.routineControl.reset()
+            rig.routineControl.position = rig.sliderPosition # the window's readout shows the real rail again
+            os.chdir(cwd)
+    writer = hardware["imageWriter"]
+    phases = dict((name, totals.seconds.get(name, 0.0)) for name in PHASES)
+    phases["write"] = writer.bytes / writer.bytesPerSecond # the write spans only time waiting for a free slot
+    return {
+        "seconds": seconds,
+        "hours": seconds / 3600.0,
+        "phases": phases,
+        "frames": writer.files,
+        "bytes": writer.bytes,
+        "bytesPerFrame": writer.bytes / writer.files if writer.files else 0,
+    }
+
+def formatEstimate(estimate): # Multi-line summary for the console and the message box
+    lines = ["Estimated time: " + formatDuration(estimate["seconds"])]
+    for name in PHASES:
+        lines.append("  " + name + ": " + formatDuration(estimate["phases"][name]))
+    lines.append(str(estimate["frames"]) + " frames, " + str(round(estimate["bytes"] / 1e9, 2)) + " GB "
+                 + "(" + str(round(estimate["bytesPerFrame"] / 1e6, 1)) + " MB per frame)")
+    return "\n".join(lines)
+
+def formatDuration(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return "%d:%02d:%02d" % (hours, minutes, seconds)
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    from hardware import useBackend
+    useBackend(os.environ.get("SCANNER_BACKEND", "sim")) # app.py loads its hardware on import
+    import app
+
+    parser = argparse.ArgumentParser(description="Estimate the time and disk space of a full routine without running the rig")
+    parser.add_argument("--settings", help="settings exported from the window (JSON), defaults to app.py's defaults")
+    parser.add_argument("--card-speed", type=float, default=12.0, help="sustained card write speed (MB/s)")
+    args = parser.parse_args()
+    if args.settings:
+        with open(args.settings) as f:
+            app.applySettings(json.load(f))
+    print(formatEstimate(dryRun(app, args.card_speed * 1e6)))
@@ -0,0 +1,101 @@
+from hardware import clock
+from manifest import plain
+
+# Locked exposure
+# Left on auto, the camera re-runs exposure and white balance for every
+# capture: each shot waits for them to converge, and the small differences
+# they settle on show up as brightness and colour flicker between frames,
+# which focus stacking and photogrammetry both pick up. ExposureLock meters
+# once, while the scene is still, then fixes the shutter speed, freezes the
+# gains (exposure_mode 'off') and fixes the white balance gains for a whole
+# routine. check() reads the camera back after each shot and reports
+# anything that has moved off the locked values.
+
+FIELDS = ("exposure_speed", "analog_gain", "digital_gain", "awb_gains")
+
+def readExposure(camera): # What the camera is using right now, as plain numbers
+    values = dict((field, plain(getattr(camera, field))) for field in FIELDS)
+    values["awb_gains"] = list(values["awb_gains"])
+    return values
+
+def drift(value, reference): # Relative difference, 0 when both are 0
+    if reference == 0:
+        return 0.0 if value == 0 else float('inf')
+    return abs(value - reference) / float(abs(reference))
+
+def differences(values, reference, tolerance): # The fields of values more than tolerance off reference
+    found = []
+    for field in FIELDS:
+        pairs = zip(values[field], reference[field]) if field == "awb_gains" else [(values[field], reference[field])]
+        if any(drift(value, expected) > tolerance for value, expected in pairs):
+            found.append(field)
+    return found
+
+
+class ExposureLock(object):
+    # lock() meters and fixes the exposure, check() after each shot, release() puts the
+    # camera back the way it was. lock(values) re-applies values from an earlier lock, as
+    # when a routine is resumed: shutter and white balance come back exactly, and the gains
+    # are metered again with the shutter held, which check() reports if they differ.
+    def __init__(self, camera, tolerance=0.05):
+        self.camera = camera
+        self.tolerance = tolerance
+        self.values = None
+        self.saved = None
+        self.reported = set() # fields already warned about, so a drift is reported once
+
+    def meter(self, timeout=5.0, stableReadings=3, interval=0.2):
+        # Wait for auto exposure and white balance to stop changing, up to timeout seconds
+        deadline = clock.monotonic() + timeout
+        previous = readExposure(self.camera)
+        stable = 0
+        while stable < stableReadings and clock.monotonic() < deadline:
+            clock.sleep(interval)
+            current = readExposure(self.camera)
+            stable = stable + 1 if not differences(current, previous, 0.01) else 0
+            previous = current
+        return previous
+
+    def lock(self, values=None):
+        camera = self.camera
+        self.saved = dict((field, getattr(camera, field)) for field in ("shutter_speed", "exposure_mode", "awb_mode", "awb_gains"))
+        if values is None:
+            values = self.meter()
+        else:
+            camera.shutter_speed = int(values["exposure_speed"]) # auto exposure can only move the gains now
+            camera.awb_mode = 'off'
+            camera.awb_gains = tuple(values["awb_gains"])
+            self.meter()
+        self.values = values
+        camera.shutter_speed = int(values["exposure_speed"])
+        camera.exposure_mode = 'off' # holds the analog and digital gains where metering left them
+        camera.awb_mode = 'off'
+        camera.awb_gains = tuple(values["awb_gains"])
+        self.reported = set()
+        return values
+
+    def check(self, shutter=None):
+        # Warnings for locked values the camera has drifted from since the last check. shutter is
+        # what the frame was shot at when it is not the locked shutter, as for exposure brackets.
+        warnings = []
+        current = readExposure(self.camera)
+        expected = dict(self.values)
+        if shutter is not None:
+            expected["exposure_speed"] = shutter
+        for field in differences(current, expected, self.tolerance):
+            if field not in self.reported:
+                self.reported.add(field)
+                warnings.append("Exposure drifted: " + field + " is " + str(current[field])
+                                + ", locked at " + str(expected[field]))
+        return warnings
+
+    def release(self):
+        if self.saved is None:
+            return
+        camera = self.camera
+        camera.exposure_mode = self.saved["exposure_mode"]
+        camera.shutter_speed = self.saved["shutter_speed"]
+        camera.awb_mode = self.saved["awb_mode"]
+        if self.saved["awb_mode"] == 'off':
+            camera.awb_gains = self.saved["awb_gains"]
+        self.saved = None
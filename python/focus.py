@@ -0,0 +1,52 @@
+import numpy as np
+
+# Focus measurement
+# sharpness() scores a small luma frame from the video port; a sweep of the
+# rail gives one score per position, and focusRange() picks out the positions
+# where something in the subject is actually in focus. focusMap() and
+# focusOverlap() compare neighbouring frames of a stack to size the next rail step.
+
+def sharpness(frame): # Mean squared 4-neighbour Laplacian; rises steeply as detail comes into focus
+    gray = frame.astype(np.float32)
+    laplacian = gray[:-2, 1:-1] + gray[2:, 1:-1] + gray[1:-1, :-2] + gray[1:-1, 2:] - 4 * gray[1:-1, 1:-1]
+    return float(np.mean(np.square(laplacian)))
+
+def focusRange(scores, fraction=0.25, margin=1):
+    # (first, last) positions whose score climbs at least fraction of the way from
+    # the background level to the peak, widened by margin positions on each side.
+    # A flat sweep (nothing ever comes into focus) keeps the whole range.
+    scores = np.asarray(scores, dtype=np.float64)
+    floor = np.percentile(scores, 10)
+    peak = scores.max()
+    if peak <= floor * 1.05:
+        return 0, len(scores) - 1
+    sharp = np.nonzero(scores >= floor + fraction * (peak - floor))[0]
+    return max(0, int(sharp[0]) - margin), min(len(scores) - 1, int(sharp[-1]) + margin)
+
+def focusMap(frame, tiles=(8, 6)): # Mean squared Laplacian over a grid of tiles (columns, rows), as a rows x columns array
+    gray = frame.astype(np.float32)
+    laplacian = gray[:-2, 1:-1] + gray[2:, 1:-1] + gray[1:-1, :-2] + gray[1:-1, 2:] - 4 * gray[1:-1, 1:-1]
+    columns, rows = tiles
+    height = laplacian.shape[0] // rows * rows
+    width = laplacian.shape[1] // columns * columns
+    blocks = np.square(laplacian[:height, :width]).reshape(rows, height // rows, columns, width // columns)
+    return blocks.mean(axis=(1, 3))
+
+def focusOverlap(previous, current):
+    # How much two frames share the same focus, 0-1: the weighted Jaccard of their focus maps.
+    # Sharp tiles dominate, so two frames with the same band in focus score near 1 and
+    # frames whose in-focus bands do not meet score near 0.
+    union = np.maximum(previous, current).sum()
+    if union <= 0:
+        return 1.0
+    return float(np.minimum(previous, current).sum() / union)
+
+def nextStep(step, overlap, target=0.5, minStep=1, maxStep=None):
+    # Rail step for the next frame: longer while neighbouring frames overlap more than
+    # target, shorter when they overlap less. The correction is damped (square root)
+    # and limited to a factor of two per frame, so the step does not oscillate.
+    scale = min(2.0, max(0.5, (max(overlap, 0.0) / target) ** 0.5))
+    step = int(round(step * scale))
+    if maxStep is not None:
+        step = min(step, maxStep)
+    return max(minStep, step)
@@ -0,0 +1,213 @@
+import io
+import os
+import queue
+import re
+import threading
+import numpy as np
+from align import Aligner, warpFrame, loadTransforms, transformsFile
+from spans import span
+
+# Streaming focus stacking
+# Every frame of a stack is folded into a running composite as soon as it is
+# captured: each pixel keeps the frame where local contrast (box filtered
+# Laplacian energy) was highest so far, and an index map records which shot
+# that was. Memory is one composite, one energy map and one index map no
+# matter how many shots are in the stack, so the fused image is ready moments
+# after the last frame is captured. Frames are aligned first (see align.py),
+# and the transforms are cached next to the stack for any later fuse.
+#   python fusion.py shot_1 shot_2 ...   fuses stacks that are already on disk
+# Decoding and saving JPEGs needs Pillow (python3-pil on Raspberry Pi OS).
+
+def luma(image): # float32 luma (0-255) of an RGB or greyscale frame
+    if image.ndim == 2:
+        return image.astype(np.float32)
+    return image[..., 0] * np.float32(0.299) + image[..., 1] * np.float32(0.587) + image[..., 2] * np.float32(0.114)
+
+def boxSum(image, radius): # Sum over a (2 * radius + 1) square around every pixel, edges repeated
+    padded = np.pad(image, radius, mode='edge')
+    size = 2 * radius + 1
+    height, width = image.shape
+    rows = padded[0:height, :].copy()
+    for i in range(1, size):
+        rows += padded[i:i + height, :]
+    total = rows[:, 0:width].copy()
+    for i in range(1, size):
+        total += rows[:, i:i + width]
+    return total
+
+def laplacianEnergy(gray, radius=2): # Local sharpness: squared 4-neighbour Laplacian summed over a small window
+    laplacian = np.zeros_like(gray)
+    laplacian[1:-1, 1:-1] = (gray[:-2, 1:-1] + gray[2:, 1:-1] + gray[1:-1, :-2] + gray[1:-1, 2:]
+                             - 4 * gray[1:-1, 1:-1])
+    np.square(laplacian, out=laplacian)
+    return boxSum(laplacian, radius)
+
+def decodeJpeg(data): # Encoded bytes to an RGB array
+    from PIL import Image
+    return np.asarray(Image.open(io.BytesIO(data)).convert('RGB'))
+
+def loadImage(filename):
+    from PIL import Image
+    return np.asarray(Image.open(filename).convert('RGB'))
+
+def saveImage(filename, image, quality=95):
+    from PIL import Image
+    Image.fromarray(image).save(filename, quality=quality)
+
+def stackFrames(folder):
+    # (shot, filename) of the frames in a stack folder, in shot order. shoot() names them
+    # <project><NN>.jpg in <project>_<stack>; anything else in the folder is skipped.
+    stack = re.match(r'(.*)_\d+$', os.path.basename(os.path.normpath(folder)))
+    prefix = re.escape(stack.group(1)) if stack else r'\D*' # a folder named some other way: frames <name><NN>.jpg
+    pattern = re.compile(prefix + r'(\d+)\.(jpe?g|png)$', re.IGNORECASE)
+    frames = []
+    for name in os.listdir(folder):
+        match = pattern.match(name)
+        if match:
+            frames.append((int(match.group(1)), os.path.join(folder, name)))
+    return sorted(frames)
+
+
+class StackFuser(object):
+    # Running best-pixel composite of one stack. add() the frames in any order,
+    # each with the shot number that goes into the index map.
+    def __init__(self, radius=2):
+        self.radius = radius
+        self.reset()
+
+    def reset(self):
+        self.composite = None
+        self.energy = None
+        self.index = None
+        self.frames = 0
+
+    def add(self, image, shot):
+        energy = laplacianEnergy(luma(image), self.radius)
+        if self.composite is None:
+            self.composite = image.copy()
+            self.energy = energy
+            self.index = np.full(energy.shape, shot, np.uint16)
+        else:
+            sharper = energy > self.energy
+            np.copyto(self.energy, energy, where=sharper)
+            np.copyto(self.composite, image, where=sharper[..., None] if image.ndim == 3 else sharper)
+            self.index[sharper] = shot
+        self.frames += 1
+
+    def save(self, prefix): # prefix_fused.jpg and prefix_index.png (16 bit, the shot each pixel came from)
+        from PIL import Image
+        saveImage(prefix + "_fused.jpg", self.composite)
+        Image.fromarray(self.index).save(prefix + "_index.png")
+
+
+class FusionStage(object):
+    # Fuses the frames of a stack on a background thread while the rig moves on.
+    # begin(prefix), then submit() every frame, then finish(); the fused image is
+    # saved as prefix_fused.jpg once the last frame is folded in. The queue is
+    # bounded like WriterPool's, so a slow fuse blocks capture instead of piling
+    # full resolution frames up in RAM. Fusing is a side product of the scan, so a
+    # stack that fails (a truncated frame, no Pillow) never stops the routine: it is
+    # printed and kept in self.failures, the rest of its frames are skipped and no
+    # fused image is saved for it, and the next stack starts afresh.
+    def __init__(self, maxPending=3, align=True):
+        self.queue = queue.Queue(maxPending)
+        self.fuser = StackFuser()
+        self.aligner = Aligner() if align else None
+        self.prefix = None
+        self.failed = None # the error that failed the current stack
+        self.failures = [] # (prefix, error) of every stack that could not be fused
+        self.thread = threading.Thread(target=self.run, name="stack-fuser")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    return
+                self.handle(*job)
+            except Exception as e:
+                print("Stack " + str(self.prefix) + " not fused: " + str(e))
+                self.failures.append((self.prefix, e))
+                self.failed = e
+                self.fuser.reset()
+                if self.aligner is not None:
+                    self.aligner.reset()
+            finally:
+                self.queue.task_done()
+
+    def handle(self, action, *args):
+        if action == "begin":
+            self.fuser.reset()
+            if self.aligner is not None:
+                self.aligner.reset()
+            self.prefix = args[0]
+            self.failed = None
+        elif self.failed is not None: # the rest of a failed stack is skipped
+            return
+        elif action == "frame":
+            shot, data = args
+            self.addFrame(decodeJpeg(data), shot)
+        elif action == "folder": # a stack that was partly shot before a resume is fused from disk
+            for shot, filename in stackFrames(args[0]):
+                self.addFrame(loadImage(filename), shot)
+        elif action == "finish":
+            if self.fuser.frames:
+                with span("fuse save"):
+                    self.fuser.save(self.prefix)
+                    if self.aligner is not None:
+                        self.aligner.save(transformsFile(self.prefix))
+            self.fuser.reset()
+
+    def addFrame(self, image, shot):
+        if self.aligner is not None:
+            with span("align", shot=shot):
+                image = warpFrame(image, self.aligner.add(shot, image))
+        with span("fuse", shot=shot):
+            self.fuser.add(image, shot)
+
+    def begin(self, prefix):
+        self.queue.put(("begin", prefix))
+
+    def submit(self, shot, data): # Blocks while maxPending frames are already waiting
+        self.queue.put(("frame", shot, data))
+
+    def submitFolder(self, folder):
+        self.queue.put(("folder", folder))
+
+    def finish(self):
+        self.queue.put(("finish",))
+
+    def flush(self): # Wait until every stack finished so far is saved (or has failed)
+        self.queue.join()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+
+def fuseFolder(folder, align=True): # Fuse a stack that is already on disk, reusing its cached alignment
+    fuser = StackFuser()
+    transforms = loadTransforms(folder) if align else None
+    aligner = Aligner() if align and transforms is None else None
+    for shot, filename in stackFrames(folder):
+        image = loadImage(filename)
+        if aligner is not None:
+            image = warpFrame(image, aligner.add(shot, image))
+        elif transforms is not None and shot in transforms:
+            image = warpFrame(image, transforms[shot])
+        fuser.add(image, shot)
+    fuser.save(folder.rstrip("/"))
+    if aligner is not None:
+        aligner.save(transformsFile(folder))
+    return fuser
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Focus stack stack folders that are already on disk")
+    parser.add_argument("folders", nargs="+", help="stack folders, e.g. shot_1")
+    parser.add_argument("--no-align", action="store_true", help="fuse the frames as they are")
+    args = parser.parse_args()
+    for folder in args.folders:
+        fuser = fuseFolder(folder, not args.no_align)
+        print(folder + ": fused " + str(fuser.frames) + " frames into " + folder.rstrip("/") + "_fused.jpg")
@@ -0,0 +1,73 @@
+import os
+import time
+
+# Hardware backends
+# SCANNER_BACKEND=sim swaps the GPIO pins, PiCamera and gphoto2 DSLR for the
+# simulated versions in simulated.py, so the motion and routine logic can run
+# (and be timed) on an ordinary Linux box. SCANNER_CLOCK=virtual additionally
+# makes every sleep advance a virtual clock instead of waiting, so an hours
+# long routine can be simulated in seconds.
+
+backendName = os.environ.get("SCANNER_BACKEND", "pi")
+
+
+class Clock(object):
+    # All rig timing goes through this, so it can be swapped for virtual time
+    def __init__(self, virtual=False):
+        self.virtual = virtual
+        self.now = 0.0
+        self.epoch = time.time()
+
+    def monotonic(self):
+        if self.virtual:
+            return self.now
+        return time.monotonic()
+
+    def time(self): # Wall clock time, for timestamps in files
+        if self.virtual:
+            return self.epoch + self.now
+        return time.time()
+
+    def sleep(self, seconds):
+        if self.virtual:
+            self.now += max(seconds, 0)
+        else:
+            time.sleep(seconds)
+
+    def sleepUntil(self, deadline, spin=0.0):
+        # Sleeps until the monotonic clock reaches deadline, busy-waiting the last spin seconds
+        if self.virtual:
+            self.now = max(self.now, deadline)
+            return
+        remaining = deadline - time.monotonic()
+        if remaining > spin:
+            time.sleep(remaining - spin)
+        while time.monotonic() < deadline:
+            pass
+
+clock = Clock(os.environ.get("SCANNER_CLOCK") == "virtual")
+
+def useBackend(name): # Select 'pi' or 'sim' before the front end loads its hardware
+    global backendName
+    backendName = name
+
+def loadGPIO():
+    if backendName == "sim":
+        from simulated import SimGPIO
+        return SimGPIO()
+    import RPi.GPIO as GPIO
+    return GPIO
+
+def loadCamera():
+    if backendName == "sim":
+        from simulated import SimCamera
+        return SimCamera()
+    from picamera import PiCamera
+    return PiCamera()
+
+def loadDSLR():
+    if backendName == "sim":
+        from simulated import SimDSLR
+        return SimDSLR()
+    import dslrCapture
+    return dslrCapture
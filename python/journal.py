@@ -0,0 +1,91 @@
+import json
+import os
+from hardware import clock
+
+# Crash-safe routine journal
+# One JSON record per line, appended and fsynced as each shot and stack
+# completes, so a full routine that dies part way can be resumed from the
+# last thing that is known to have finished.
+#   start  - settings, counters and any locked exposure at the beginning of the routine
+#   move   - a rail move finished (the rail has no encoder, so this is how we know where it is)
+#   shot   - a frame (or its brackets) was captured and the rail move after it finished
+#   renumber - a backwards adaptive stack is being renamed into focus order; phase is how far it got
+#   stack  - a stack is done, including the turntable move and rail return
+#   finish - the routine completed
+
+class Journal(object):
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = open(filename, 'a')
+
+    def write(self, event, **fields):
+        record = {"event": event, "time": clock.time()}
+        record.update(fields)
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+def readJournal(filename): # All complete records; a line cut short by a crash is ignored
+    records = []
+    with open(filename) as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                break
+    return records
+
+def shotFiles(record): # The files a shot record says were written; journals before bracketing have one "file"
+    return record["files"] if "files" in record else [record["file"]]
+
+def resumePoint(filename):
+    # Where the last run in the journal stopped, or None if it finished.
+    # "sliderPosition" is where the journal last saw the rail, "startPosition" is where
+    # the rail has to be for the next shot. Frames that were still queued for the card
+    # when the run died are shot again. Resume from the folder the routine ran in.
+    records = readJournal(filename)
+    starts = [i for i, record in enumerate(records) if record["event"] == "start"]
+    if not starts:
+        return None
+    run = records[starts[-1]:]
+    if run[-1]["event"] == "finish":
+        return None
+    start = run[0]
+    point = {
+        "settings": start["settings"],
+        "exposure": start.get("exposure"), # the locked exposure, if the routine locked it
+        "stackNumber": start["stackNumber"],
+        "stack": 0,
+        "shot": 0,
+        "sliderPosition": 0,
+        "startPosition": 0,
+        "shotPosition": None, # where the last shot of the unfinished stack was taken
+        "renumber": None, # the last renumber record of the unfinished stack: it was shot in full
+        "files": [],
+    }
+    shots = [] # shot records of the unfinished stack
+    for record in run[1:]:
+        if record["event"] == "shot":
+            shots.append(record)
+        elif record["event"] == "renumber":
+            point["renumber"] = {"phase": record["phase"], "files": record["files"]}
+        elif record["event"] == "stack":
+            point["stack"] = record["stack"] + 1
+            point["files"] += [file for shot in shots for file in shotFiles(shot)]
+            point["startPosition"] = record["sliderPosition"]
+            point["renumber"] = None
+            shots = []
+        if "sliderPosition" in record:
+            point["sliderPosition"] = record["sliderPosition"]
+    for record in shots:
+        if point["renumber"] is None and not all(os.path.exists(file) for file in shotFiles(record)):
+            break # once renumbering starts the files move, but every one of them was written
+        point["shot"] = record["shot"] + 1
+        point["startPosition"] = record["sliderPosition"]
+        point["shotPosition"] = record.get("shotPosition")
+        point["files"] += shotFiles(record)
+    point["stackNumber"] += point["stack"]
+    return point
@@ -0,0 +1,150 @@
+import csv
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from fractions import Fraction
+
+# Shot manifest
+# One SQLite file per project (<projectName>_manifest.sqlite) with a row for
+# every frame shoot() captures: where it is, which stack and shot it is, the
+# turntable angle and rail position it was shot at, which way its stack ran
+# along the rail, the exposure the camera actually used, and the size and
+# SHA-1 of the bytes written. Tools can query it instead of walking the
+# project folders and parsing file names.
+#   python manifest.py shot_manifest.sqlite --csv shots.csv
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS shots (
+    id INTEGER PRIMARY KEY,
+    file TEXT UNIQUE NOT NULL,
+    project TEXT,
+    stack INTEGER,
+    shot INTEGER,
+    angle REAL,
+    slider_position INTEGER,
+    backwards INTEGER,
+    captured_at REAL,
+    bytes INTEGER,
+    sha1 TEXT,
+    iso INTEGER,
+    shutter_speed INTEGER,
+    exposure_speed INTEGER,
+    analog_gain REAL,
+    digital_gain REAL,
+    awb_red REAL,
+    awb_blue REAL,
+    camera TEXT
+);
+CREATE INDEX IF NOT EXISTS shots_stack_shot ON shots (stack, shot);
+"""
+
+CAMERA_FIELDS = ("iso", "shutter_speed", "exposure_speed", "analog_gain", "digital_gain",
+                 "awb_mode", "awb_gains", "exposure_mode", "brightness", "contrast", "framerate", "resolution")
+
+def plain(value): # PiCamera values (Fractions, tuples of them, resolution objects) as JSON friendly types
+    if isinstance(value, Fraction):
+        return float(value)
+    if isinstance(value, (tuple, list)):
+        return [plain(item) for item in value]
+    if isinstance(value, (int, float, str)) or value is None:
+        return value
+    return str(value)
+
+def cameraSettings(camera): # What the camera reports right now; missing properties are left out
+    settings = {}
+    for field in CAMERA_FIELDS:
+        try:
+            settings[field] = plain(getattr(camera, field))
+        except Exception:
+            pass
+    return settings
+
+
+class Manifest(object):
+    # Writes are serialised with a lock, since single shots come from the window
+    # and routine shots from the routine thread
+    def __init__(self, filename):
+        self.filename = os.path.abspath(filename)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL") # a commit per shot without a full sync of the database each time
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+
+    def add(self, file, data, camera=None, **fields):
+        # One row per frame; shooting the same file again (after a resume) replaces its row
+        row = dict(fields)
+        row["file"] = file
+        row["bytes"] = len(data)
+        row["sha1"] = hashlib.sha1(data).hexdigest()
+        if camera is not None:
+            settings = cameraSettings(camera)
+            gains = settings.get("awb_gains") or [None, None]
+            row.update({
+                "iso": settings.get("iso"),
+                "shutter_speed": settings.get("shutter_speed"),
+                "exposure_speed": settings.get("exposure_speed"),
+                "analog_gain": settings.get("analog_gain"),
+                "digital_gain": settings.get("digital_gain"),
+                "awb_red": gains[0],
+                "awb_blue": gains[1],
+                "camera": json.dumps(settings),
+            })
+        columns = sorted(row)
+        sql = ("INSERT OR REPLACE INTO shots (" + ", ".join(columns) + ") VALUES ("
+               + ", ".join("?" for column in columns) + ")")
+        with self.lock:
+            self.db.execute(sql, [row[column] for column in columns])
+            self.db.commit()
+
+    def updateDigest(self, file, data): # New size and SHA-1 for a file rewritten in place; the rest of its row stays
+        with self.lock:
+            self.db.execute("UPDATE shots SET bytes = ?, sha1 = ? WHERE file = ?",
+                            (len(data), hashlib.sha1(data).hexdigest(), file))
+            self.db.commit()
+
+    def renumber(self, moves):
+        # Give rows (id, file, shot) new files and shot numbers, in one transaction. Rows
+        # can swap files, so every file is parked under a name no other row has first.
+        with self.lock:
+            for row, file, shot in moves:
+                self.db.execute("UPDATE shots SET file = ?, shot = ? WHERE id = ?", (file + ".renumber", shot, row))
+            for row, file, shot in moves:
+                self.db.execute("UPDATE shots SET file = ? WHERE id = ?", (file, row))
+            self.db.commit()
+
+    def query(self, where="1", *args): # Rows as dicts, e.g. query("stack = ? ORDER BY shot", 3)
+        with self.lock:
+            cursor = self.db.execute("SELECT * FROM shots WHERE " + where, args)
+            names = [description[0] for description in cursor.description]
+            return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+    def exportCSV(self, filename):
+        rows = self.query("1 ORDER BY stack, shot")
+        with open(filename, 'w', newline='') as f:
+            writer = csv.writer(f)
+            if rows:
+                writer.writerow(list(rows[0]))
+                for row in rows:
+                    writer.writerow(list(row.values()))
+        return len(rows)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Summarise or export a project's shot manifest")
+    parser.add_argument("manifest", help="<projectName>_manifest.sqlite")
+    parser.add_argument("--csv", help="write every row to this CSV file")
+    args = parser.parse_args()
+    manifest = Manifest(args.manifest)
+    if args.csv:
+        print(str(manifest.exportCSV(args.csv)) + " shots written to " + args.csv)
+    else:
+        for stack, shots, size in manifest.db.execute("SELECT stack, COUNT(*), SUM(bytes) FROM shots GROUP BY stack ORDER BY stack"):
+            print("Stack " + str(stack) + ": " + str(shots) + " shots, " + str(round(size / 1e6, 1)) + " MB")
+    manifest.close()
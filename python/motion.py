@@ -0,0 +1,46 @@
+import math
+
+# Motion planning for the stepper axes
+# A plan is a list with one delay (seconds) per phase written to the motor, so
+# the stepper engine can ramp up to a cruise rate and back down instead of
+# running the whole move at one safe, slow rate.
+
+PROFILES = ('constant', 'trapezoid', 's-curve')
+
+def rampLength(startDelay, cruiseDelay, acceleration): # Number of phases needed to get from the start rate to the cruise rate
+    startRate = 1.0 / startDelay
+    cruiseRate = 1.0 / cruiseDelay
+    if cruiseRate <= startRate or acceleration <= 0:
+        return 0
+    return int(math.ceil((cruiseRate ** 2 - startRate ** 2) / (2.0 * acceleration)))
+
+def planMove(phases, startDelay, cruiseDelay, acceleration, profile='trapezoid'):
+    # phases: number of coil phases in the move (4 per cycle on the rail motor)
+    # startDelay: delay of the first and last phase, slow enough to never miss a step from rest
+    # cruiseDelay: shortest delay reached in the middle of the move
+    # acceleration: in phases/sec^2, used for both the ramp up and the ramp down
+    phases = int(phases)
+    if phases <= 0:
+        return []
+    if profile == 'constant' or startDelay <= cruiseDelay:
+        return [cruiseDelay] * phases
+    if profile not in PROFILES:
+        raise ValueError("Unknown motion profile: " + str(profile))
+
+    startRate = 1.0 / startDelay
+    cruiseRate = 1.0 / cruiseDelay
+    ramp = rampLength(startDelay, cruiseDelay, acceleration)
+    plan = []
+    for n in range(phases):
+        # Distance to the nearest end of the move, so short moves get a triangle profile
+        d = min(n, phases - 1 - n)
+        if d >= ramp:
+            plan.append(cruiseDelay)
+            continue
+        if profile == 'trapezoid':
+            rate = math.sqrt(startRate ** 2 + 2.0 * acceleration * d)
+        else:
+            f = float(d) / ramp
+            rate = startRate + (cruiseRate - startRate) * f * f * (3.0 - 2.0 * f)
+        plan.append(1.0 / min(rate, cruiseRate))
+    return plan
@@ -0,0 +1,171 @@
+import json
+import math
+import os
+import numpy as np
+from manifest import Manifest
+from bracket import mergedName
+from align import loadReference
+
+# Camera pose export for photogrammetry
+# The rig knows where every frame was shot from: the turntable angle and rail
+# position are in the project's shot manifest (manifest.py). Seen from the
+# subject, turning the turntable is the camera orbiting it, and moving the rail
+# is the camera sliding along its line of sight. This writes those poses, with
+# the lens intrinsics, as a COLMAP sparse model (cameras.txt, images.txt and an
+# empty points3D.txt) and as plain JSON, so reconstruction can start from known
+# poses instead of estimating them.
+#   python poses.py shot_manifest.sqlite --fused --distance 250 --focal-length 16
+#
+# World frame: origin on the turntable axis at lens height, Y down the axis,
+# Z from the camera at angle 0 towards the axis (the OpenCV/COLMAP camera
+# convention with no tilt). Lengths are in millimetres.
+
+SENSOR_PIXEL = 0.00155 # mm, Raspberry Pi HQ camera (IMX477)
+
+def orbitRotation(angle): # World to camera rotation for a camera turned angle degrees about the turntable axis
+    theta = math.radians(angle)
+    c, s = math.cos(theta), math.sin(theta)
+    toWorld = np.array([[c, 0, s], [0, 1, 0], [-s, 0, c]]) # camera axes in world coordinates
+    return toWorld.T
+
+def quaternion(rotation): # (w, x, y, z) of a rotation matrix, w >= 0
+    m = rotation
+    trace = m[0, 0] + m[1, 1] + m[2, 2]
+    if trace > 0:
+        s = 2 * math.sqrt(trace + 1)
+        q = [s / 4, (m[2, 1] - m[1, 2]) / s, (m[0, 2] - m[2, 0]) / s, (m[1, 0] - m[0, 1]) / s]
+    elif m[0, 0] > m[1, 1] and m[0, 0] > m[2, 2]:
+        s = 2 * math.sqrt(1 + m[0, 0] - m[1, 1] - m[2, 2])
+        q = [(m[2, 1] - m[1, 2]) / s, s / 4, (m[0, 1] + m[1, 0]) / s, (m[0, 2] + m[2, 0]) / s]
+    elif m[1, 1] > m[2, 2]:
+        s = 2 * math.sqrt(1 + m[1, 1] - m[0, 0] - m[2, 2])
+        q = [(m[0, 2] - m[2, 0]) / s, (m[0, 1] + m[1, 0]) / s, s / 4, (m[1, 2] + m[2, 1]) / s]
+    else:
+        s = 2 * math.sqrt(1 + m[2, 2] - m[0, 0] - m[1, 1])
+        q = [(m[1, 0] - m[0, 1]) / s, (m[0, 2] + m[2, 0]) / s, (m[1, 2] + m[2, 1]) / s, s / 4]
+    return [-v for v in q] if q[0] < 0 else q
+
+
+class RigGeometry(object):
+    # distance: lens to turntable axis at rail position 0. railStep: how far one rail
+    # step moves the lens towards the subject (negative if forward() backs away).
+    # clockwise: a positive manifest angle turns the subject clockwise seen from above.
+    def __init__(self, distance, railStep, focalLength, resolution=(4056, 3040), pixelSize=SENSOR_PIXEL, clockwise=True):
+        self.distance = distance
+        self.railStep = railStep
+        self.focalLength = focalLength
+        self.resolution = tuple(resolution)
+        self.pixelSize = pixelSize
+        self.clockwise = clockwise
+
+    def intrinsics(self): # COLMAP PINHOLE: fx, fy, cx, cy in pixels
+        width, height = self.resolution
+        focal = self.focalLength / self.pixelSize
+        return {"model": "PINHOLE", "width": width, "height": height,
+                "params": [focal, focal, width / 2.0, height / 2.0]}
+
+    def pose(self, angle, sliderPosition):
+        # (rotation, translation, centre): world to camera R and t, and the camera centre in the world.
+        # The subject turning clockwise from above is the camera orbiting it counter-clockwise.
+        orbit = -angle if self.clockwise else angle # about +Y, which points down: positive is clockwise seen from above
+        rotation = orbitRotation(orbit)
+        centre = rotation.T.dot([0.0, 0.0, -(self.distance - sliderPosition * self.railStep)])
+        return rotation, -rotation.dot(centre), centre
+
+def framesToExport(manifest, fused=False):
+    # (name, angle, sliderPosition) per image. Exposure brackets are one image, the frame they
+    # are merged into (see bracket.py). A fused stack takes the pose of the frame its alignment
+    # (align.py) maps everything onto, as saved in <stack folder>_align.json; a stack fused
+    # without alignment takes the pose of its lowest numbered shot, which fuses first.
+    rows = manifest.query("angle IS NOT NULL ORDER BY stack, captured_at")
+    if fused:
+        return fusedFrames(rows)
+    frames = []
+    seen = set()
+    for row in rows:
+        name = mergedName(row["file"])
+        if name in seen:
+            continue
+        seen.add(name)
+        frames.append((os.path.normpath(name), row["angle"], row["slider_position"]))
+    return frames
+
+def fusedFrames(rows): # One frame per stack folder, posed at its alignment reference
+    stacks = {}
+    for row in rows:
+        stacks.setdefault(os.path.dirname(mergedName(row["file"])), []).append(row)
+    frames = []
+    for folder, shots in stacks.items():
+        reference = loadReference(folder)
+        if reference is None:
+            reference = min(row["shot"] for row in shots)
+        row = next((row for row in shots if row["shot"] == reference), shots[0])
+        frames.append((os.path.normpath(folder + "_fused.jpg"), row["angle"], row["slider_position"]))
+    return frames
+
+def writeColmap(folder, geometry, frames):
+    camera = geometry.intrinsics()
+    with open(os.path.join(folder, "cameras.txt"), 'w') as f:
+        f.write("# Camera list with one line of data per camera:\n")
+        f.write("#   CAMERA_ID, MODEL, WIDTH, HEIGHT, PARAMS[]\n")
+        f.write("1 " + camera["model"] + " " + str(camera["width"]) + " " + str(camera["height"]) + " "
+                + " ".join(repr(float(p)) for p in camera["params"]) + "\n")
+    with open(os.path.join(folder, "images.txt"), 'w') as f:
+        f.write("# Image list with two lines of data per image:\n")
+        f.write("#   IMAGE_ID, QW, QX, QY, QZ, TX, TY, TZ, CAMERA_ID, NAME\n")
+        f.write("#   POINTS2D[] as (X, Y, POINT3D_ID)\n")
+        for imageId, (name, angle, sliderPosition) in enumerate(frames, 1):
+            rotation, translation, centre = geometry.pose(angle, sliderPosition)
+            values = quaternion(rotation) + list(translation)
+            f.write(str(imageId) + " " + " ".join(repr(float(v)) for v in values) + " 1 " + name + "\n\n")
+    with open(os.path.join(folder, "points3D.txt"), 'w') as f:
+        f.write("# 3D point list, empty: only the poses are known\n")
+
+def writeJSON(filename, geometry, frames):
+    # Camera to world 4x4 matrices (OpenCV axes: x right, y down, z forward) next to the raw pose values
+    output = {"camera": geometry.intrinsics(), "units": "mm", "frames": []}
+    for name, angle, sliderPosition in frames:
+        rotation, translation, centre = geometry.pose(angle, sliderPosition)
+        toWorld = np.eye(4)
+        toWorld[:3, :3] = rotation.T
+        toWorld[:3, 3] = centre
+        output["frames"].append({
+            "file": name,
+            "angle": angle,
+            "sliderPosition": sliderPosition,
+            "position": [float(v) for v in centre],
+            "quaternion": quaternion(rotation),
+            "translation": [float(v) for v in translation],
+            "transform_matrix": toWorld.tolist(),
+        })
+    with open(filename, 'w') as f:
+        f.write(json.dumps(output, indent=4))
+
+def exportPoses(manifestFile, folder, geometry, fused=False): # Write both formats for every frame in the manifest
+    manifest = Manifest(manifestFile)
+    try:
+        frames = framesToExport(manifest, fused)
+    finally:
+        manifest.close()
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    writeColmap(folder, geometry, frames)
+    writeJSON(os.path.join(folder, "poses.json"), geometry, frames)
+    return len(frames)
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Export known camera poses from a shot manifest for COLMAP and other tools")
+    parser.add_argument("manifest", help="<projectName>_manifest.sqlite")
+    parser.add_argument("--output", default="poses", help="folder for cameras.txt, images.txt, points3D.txt and poses.json")
+    parser.add_argument("--fused", action="store_true", help="one pose per fused stack instead of one per raw frame")
+    parser.add_argument("--distance", type=float, required=True, help="lens to turntable axis at rail home (mm)")
+    parser.add_argument("--rail-step", type=float, default=0.0, help="rail travel per step towards the subject (mm)")
+    parser.add_argument("--focal-length", type=float, required=True, help="lens focal length (mm)")
+    parser.add_argument("--resolution", type=int, nargs=2, default=(4056, 3040), metavar=("WIDTH", "HEIGHT"))
+    parser.add_argument("--counter-clockwise-positive", action="store_true", help="positive angles turned the subject counter-clockwise seen from above")
+    args = parser.parse_args()
+    geometry = RigGeometry(args.distance, args.rail_step, args.focal_length, args.resolution,
+                           clockwise=not args.counter_clockwise_positive)
+    count = exportPoses(args.manifest, args.output, geometry, args.fused)
+    print(str(count) + " poses written to " + args.output)
@@ -0,0 +1,169 @@
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+import numpy as np
+from focus import sharpness
+from fusion import fuseFolder, stackFrames
+from bracket import mergeBrackets
+
+# Post-capture processing
+# Each finished stack folder (projectName_stackNumber) is handed to a small
+# pool of worker processes that merge its exposure brackets if it was shot
+# bracketed (see bracket.py), fuse it, make thumbnails and check it, while
+# the rig shoots the next stack. The pool is kept to two workers at a lower
+# priority, so the motor stepping, captures and card writes in the main
+# process always get a core. backlog() says how many stacks are still waiting,
+# which is how to tell whether processing keeps up with capture.
+#   <folder>_fused.jpg    focus stack (skipped when the stack was already fused while shooting)
+#   <folder>_thumbs/      small copies of every frame
+#   <folder>_qa.json      per-frame exposure and sharpness, and anything that looks wrong
+# Needs Pillow in the worker processes, like fusion.py.
+
+THUMBNAIL_SIZE = (320, 240)
+
+def openSmall(filename, size):
+    # Decode a JPEG at reduced size: the decoder skips most of the work with draft()
+    from PIL import Image
+    image = Image.open(filename)
+    image.draft('RGB', size)
+    image = image.convert('RGB')
+    image.thumbnail(size)
+    return image
+
+def makeThumbnails(folder, frames):
+    thumbs = folder.rstrip("/") + "_thumbs"
+    if not os.path.exists(thumbs):
+        os.mkdir(thumbs)
+    for shot, filename in frames:
+        openSmall(filename, THUMBNAIL_SIZE).save(os.path.join(thumbs, os.path.basename(filename)), quality=85)
+    return thumbs
+
+def checkStack(folder, frames, expectedShots=None):
+    # Exposure and sharpness of every frame from a small decode, plus warnings for
+    # frames that are missing, unreadable, clipped or exposed unlike the rest
+    report = {"folder": folder, "frames": [], "warnings": []}
+    for shot, filename in frames:
+        try:
+            gray = np.asarray(openSmall(filename, THUMBNAIL_SIZE).convert('L'))
+        except Exception as e:
+            report["warnings"].append(os.path.basename(filename) + " could not be read: " + str(e))
+            continue
+        report["frames"].append({
+            "shot": shot,
+            "file": os.path.basename(filename),
+            "mean": float(gray.mean()),
+            "clipped": float(np.mean(gray >= 250)),
+            "sharpness": sharpness(gray),
+        })
+    if expectedShots is not None and len(frames) < expectedShots:
+        report["warnings"].append(str(expectedShots - len(frames)) + " of " + str(expectedShots) + " frames missing")
+    if report["frames"]:
+        median = float(np.median([frame["mean"] for frame in report["frames"]]))
+        for frame in report["frames"]:
+            if frame["clipped"] > 0.02:
+                report["warnings"].append(frame["file"] + " has " + str(round(frame["clipped"] * 100, 1)) + "% clipped highlights")
+            if median > 0 and abs(frame["mean"] - median) > 0.15 * median:
+                report["warnings"].append(frame["file"] + " exposure is off the stack median (" + str(round(frame["mean"])) + " vs " + str(round(median)) + ")")
+    with open(folder.rstrip("/") + "_qa.json", 'w') as f:
+        f.write(json.dumps(report, indent=4))
+    return report
+
+def processStack(folder, fuse=True, expectedShots=None):
+    # Everything done to one stack folder, in a worker process. Returns a short summary.
+    start = time.time()
+    merged = mergeBrackets(folder)
+    frames = stackFrames(folder)
+    report = checkStack(folder, frames, expectedShots)
+    makeThumbnails(folder, frames)
+    if fuse and frames:
+        fuseFolder(folder)
+    return {"folder": folder, "frames": len(frames), "merged": merged, "warnings": report["warnings"], "seconds": time.time() - start}
+
+
+class PostProcessor(object):
+    # submit() a finished stack folder; it is processed in the background by at most
+    # `workers` processes running at `niceness` below the rig. Each stack runs in a
+    # fresh `python postprocess.py --worker` process: a multiprocessing pool would
+    # either fork the rig's motor, writer and Qt threads or re-import app.py, and
+    # with it the camera, in every worker.
+    def __init__(self, workers=2, niceness=10):
+        self.niceness = niceness
+        self.queue = queue.Queue()
+        self.submitted = 0
+        self.results = []
+        self.lock = threading.Lock() # the routine thread submits while the window polls
+        for i in range(workers):
+            thread = threading.Thread(target=self.run, name="post-process-" + str(i))
+            thread.daemon = True
+            thread.start()
+
+    def run(self):
+        while True:
+            folder, fuse, expectedShots = self.queue.get()
+            command = [sys.executable, os.path.abspath(__file__), "--worker", "--nice", str(self.niceness), folder]
+            if not fuse:
+                command.append("--no-fuse")
+            if expectedShots is not None:
+                command += ["--expected", str(expectedShots)]
+            try:
+                process = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+                if process.returncode == 0:
+                    result = json.loads(process.stdout.strip().splitlines()[-1])
+                else:
+                    error = (process.stderr.strip().splitlines() or ["exit code " + str(process.returncode)])[-1]
+                    result = {"folder": folder, "frames": 0, "warnings": ["processing failed: " + error], "seconds": 0}
+            except Exception as e:
+                result = {"folder": folder, "frames": 0, "warnings": ["processing failed: " + str(e)], "seconds": 0}
+            with self.lock:
+                self.results.append(result)
+            self.queue.task_done()
+
+    def submit(self, folder, fuse=True, expectedShots=None):
+        with self.lock:
+            self.submitted += 1
+        self.queue.put((os.path.abspath(folder), fuse, expectedShots))
+
+    def backlog(self): # Stacks submitted but not processed yet, including the ones being processed
+        with self.lock:
+            return self.submitted - len(self.results)
+
+    def describe(self): # One line for the status bar
+        backlog = self.backlog()
+        with self.lock:
+            text = str(len(self.results)) + " stacks processed"
+            warnings = sum(len(result["warnings"]) for result in self.results)
+        if backlog:
+            text += ", " + str(backlog) + " waiting"
+        if warnings:
+            text += ", " + str(warnings) + " warnings"
+        return text
+
+    def close(self): # Wait for every submitted stack
+        self.queue.join()
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Fuse, thumbnail and check stack folders that are already on disk")
+    parser.add_argument("folders", nargs="+", help="stack folders, e.g. shot_1 shot_2")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--no-fuse", action="store_true", help="thumbnails and QA only")
+    parser.add_argument("--expected", type=int, help="shots each stack should have")
+    parser.add_argument("--nice", type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS) # one stack, summary printed as JSON
+    args = parser.parse_args()
+    if args.worker:
+        os.nice(args.nice)
+        print(json.dumps(processStack(args.folders[0], not args.no_fuse, args.expected)))
+        sys.exit(0)
+    processor = PostProcessor(args.workers)
+    for folder in args.folders:
+        processor.submit(folder, not args.no_fuse, args.expected)
+    processor.close()
+    for result in processor.results:
+        print(result["folder"] + ": " + str(result["frames"]) + " frames in " + str(round(result["seconds"], 1)) + " s")
+        for warning in result["warnings"]:
+            print("  " + warning)
@@ -0,0 +1,111 @@
+import io
+import threading
+import numpy as np
+from hardware import clock
+
+# In-window preview with focus peaking
+# Small YUV frames stream from the camera's video port on a background thread.
+# Each one is converted to RGB, the pixels on sharp edges are painted over
+# (focus peaking) and the frame gets a sharpness score on the same scale as
+# focus.sharpness(), all with whole-array NumPy operations: a 640x480 frame
+# takes around 10 ms on a desktop and stays well inside the 66 ms a 15 fps
+# preview allows on a Pi 4. The window polls latest() and paints it into a Qt
+# label, so unlike the GPU overlay the preview sits in the window, can be
+# annotated, and costs the GUI thread one image copy per frame.
+
+PEAK_COLOUR = (255, 0, 0)
+
+def paddedSize(width, height): # The camera pads YUV captures to a multiple of 32 columns and 16 rows
+    return (width + 31) // 32 * 32, (height + 15) // 16 * 16
+
+def yuvPlanes(data, width, height): # Y, U and V of a padded YUV420 capture, cropped to the frame
+    paddedWidth, paddedHeight = paddedSize(width, height)
+    planes = np.frombuffer(data, np.uint8, paddedWidth * paddedHeight * 3 // 2)
+    luma = planes[:paddedWidth * paddedHeight].reshape(paddedHeight, paddedWidth)[:height, :width]
+    chroma = planes[paddedWidth * paddedHeight:].reshape(2, paddedHeight // 2, paddedWidth // 2)[:, :height // 2, :width // 2]
+    return luma, chroma[0], chroma[1]
+
+def yuvToRGB(y, u, v):
+    # JFIF (full range BT.601) conversion. The chroma terms are worked out once per 2x2 block
+    # and broadcast over its four luma pixels instead of upsampling the chroma planes first.
+    height, width = y.shape
+    u = u.astype(np.float32) - 128
+    v = v.astype(np.float32) - 128
+    offsets = (1.402 * v, -0.344136 * u - 0.714136 * v, 1.772 * u)
+    blocks = y.astype(np.int16).reshape(height // 2, 2, width // 2, 2)
+    rgb = np.empty((height, width, 3), np.uint8)
+    for channel, offset in enumerate(offsets):
+        value = blocks + offset.astype(np.int16)[:, None, :, None]
+        rgb[..., channel] = np.clip(value, 0, 255).reshape(height, width)
+    return rgb
+
+def focusPeaking(luma, threshold=24):
+    # (mask, score): where the 4-neighbour Laplacian of the luma is above threshold, and
+    # its mean square (focus.sharpness of the frame), from one pass over the frame
+    gray = luma.astype(np.float32)
+    laplacian = gray[:-2, 1:-1] + gray[2:, 1:-1] + gray[1:-1, :-2] + gray[1:-1, 2:] - 4 * gray[1:-1, 1:-1]
+    mask = np.zeros(luma.shape, bool)
+    mask[1:-1, 1:-1] = np.abs(laplacian) > threshold
+    return mask, float(np.mean(np.square(laplacian)))
+
+def previewFrame(data, width, height, threshold=24): # (RGB frame with peaking painted in, sharpness) of one YUV capture
+    y, u, v = yuvPlanes(data, width, height)
+    rgb = yuvToRGB(y, u, v)
+    mask, score = focusPeaking(y, threshold)
+    for channel, value in enumerate(PEAK_COLOUR): # a channel at a time: much faster than rgb[mask] = colour
+        np.copyto(rgb[..., channel], value, where=mask)
+    return rgb, score
+
+
+class PreviewStream(object):
+    # Streams size frames from the video port on its own splitter port (the settle and focus
+    # sources use 1, burst captures 0) until stop(). latest() returns the newest processed
+    # frame, its sharpness and its number, so the window can skip repaints when nothing changed.
+    def __init__(self, camera, size=(640, 480), splitterPort=2, threshold=24):
+        self.camera = camera
+        self.width, self.height = size
+        self.splitterPort = splitterPort
+        self.threshold = threshold
+        self.lock = threading.Lock()
+        self.frame = None
+        self.score = 0.0
+        self.count = 0
+        self.fps = 0.0
+        self.error = None
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, name="preview")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        stream = io.BytesIO()
+        frames = self.camera.capture_continuous(stream, 'yuv', use_video_port=True,
+                                                resize=(self.width, self.height), splitter_port=self.splitterPort)
+        last = clock.monotonic()
+        try:
+            for _ in frames:
+                if self.stopped:
+                    break
+                rgb, score = previewFrame(stream.getvalue(), self.width, self.height, self.threshold)
+                now = clock.monotonic()
+                with self.lock:
+                    self.frame = rgb
+                    self.score = score
+                    self.count += 1
+                    rate = 1.0 / max(now - last, 1e-6)
+                    self.fps = rate if self.count == 1 else 0.9 * self.fps + 0.1 * rate # smoothed over about ten frames
+                last = now
+                stream.seek(0)
+                stream.truncate()
+        except Exception as e:
+            self.error = e
+        finally:
+            frames.close()
+
+    def latest(self): # (frame, score, count); frame is None until the first one arrives
+        with self.lock:
+            return self.frame, self.score, self.count
+
+    def stop(self):
+        self.stopped = True
+        self.thread.join()
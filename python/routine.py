@@ -0,0 +1,53 @@
+import threading
+
+# Routine control shared between the routine thread and the UI
+# The routine calls checkpoint() between shots and stacks, which is where
+# pause and cancel take effect. Progress is plain attributes that the routine
+# writes and the UI polls on a timer, so the motion loop never waits on a repaint.
+
+class RoutineCancelled(Exception):
+    pass
+
+
+class RoutineControl(object):
+    def __init__(self):
+        self.resumed = threading.Event()
+        self.reset()
+
+    def reset(self): # Call before starting a routine
+        self.resumed.set()
+        self.cancelled = False
+        self.running = False
+        self.stack = 0
+        self.stacks = 0
+        self.shot = 0
+        self.shots = 0
+        self.position = 0
+
+    def pause(self):
+        self.resumed.clear()
+
+    def resume(self):
+        self.resumed.set()
+
+    def paused(self):
+        return not self.resumed.is_set()
+
+    def cancel(self):
+        self.cancelled = True
+        self.resumed.set() # wake a paused routine so it can stop
+
+    def checkpoint(self): # Blocks while paused, raises RoutineCancelled once cancel() was called
+        self.resumed.wait()
+        if self.cancelled:
+            raise RoutineCancelled()
+
+    def describe(self): # One line summary for the status bar
+        if not self.running:
+            return ""
+        text = "Shot " + str(self.shot) + "/" + str(self.shots)
+        if self.stacks: # a full routine, not a single stack
+            text = "Stack " + str(self.stack) + "/" + str(self.stacks) + ", " + text.lower()
+        if self.paused():
+            text += " (paused)"
+        return text
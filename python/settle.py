@@ -0,0 +1,74 @@
+import math
+import numpy as np
+from hardware import clock
+
+# Adaptive settle: instead of sleeping a fixed shotPause after every move, watch
+# low resolution frames from the camera and release the shot as soon as the
+# rig has stopped moving. shotPause is kept as the timeout.
+
+def motionScore(previous, current): # Mean absolute luma difference between two frames (0-255 scale)
+    return float(np.mean(np.abs(current.astype(np.float32) - previous.astype(np.float32))))
+
+def waitForSettle(source, threshold, timeout, stableFrames=2):
+    # Reads frames from source until stableFrames consecutive frame differences are below threshold.
+    # Returns True if the rig settled, False if timeout (sec) ran out first.
+    deadline = clock.monotonic() + timeout
+    previous = source.read()
+    stable = 0
+    while clock.monotonic() < deadline:
+        current = source.read()
+        if motionScore(previous, current) < threshold:
+            stable += 1
+            if stable >= stableFrames:
+                return True
+        else:
+            stable = 0
+        previous = current
+    return False
+
+
+class CameraFrameSource(object):
+    # Grabs the Y (luma) plane of small YUV frames from the PiCamera video port,
+    # which skips the still port mode switch and full resolution encode.
+    # It uses its own splitter port so it can run alongside a burst capture.
+    def __init__(self, camera, size=(160, 120), splitterPort=1):
+        self.camera = camera
+        self.splitterPort = splitterPort
+        self.width, self.height = size
+        # The camera pads YUV captures to a multiple of 32 columns and 16 rows
+        self.paddedWidth = (self.width + 31) // 32 * 32
+        self.paddedHeight = (self.height + 15) // 16 * 16
+        self.buffer = np.empty(self.paddedWidth * self.paddedHeight * 3 // 2, dtype=np.uint8)
+
+    def read(self):
+        self.camera.capture(self.buffer, 'yuv', use_video_port=True, resize=(self.width, self.height), splitter_port=self.splitterPort)
+        luma = self.buffer[:self.paddedWidth * self.paddedHeight]
+        return luma.reshape(self.paddedHeight, self.paddedWidth)[:self.height, :self.width]
+
+
+class SyntheticFrameSource(object):
+    # Stand-in for the camera off the Pi: a fixed random scene shaken by a vibration
+    # that decays with every frame read, plus a little sensor noise. Each read takes
+    # one frame interval on the rig clock, like a video port capture.
+    def __init__(self, size=(160, 120), amplitude=6.0, decay=0.6, noise=0.5, seed=0, framerate=30):
+        self.width, self.height = size
+        self.framerate = framerate
+        self.amplitude = amplitude
+        self.decay = decay
+        self.noise = noise
+        self.pad = int(math.ceil(amplitude)) + 1
+        self.random = np.random.default_rng(seed)
+        self.scene = self.random.uniform(0, 255, (self.height + 2 * self.pad, self.width + 2 * self.pad)).astype(np.float32)
+        self.frames = 0
+
+    def read(self):
+        clock.sleep(1.0 / self.framerate)
+        shake = self.amplitude * self.decay ** self.frames
+        dx = int(round(shake * math.sin(self.frames * 1.7)))
+        dy = int(round(shake * math.cos(self.frames * 2.3)))
+        self.frames += 1
+        top = self.pad + dy
+        left = self.pad + dx
+        frame = self.scene[top:top + self.height, left:left + self.width]
+        frame = frame + self.random.normal(0, self.noise, frame.shape).astype(np.float32)
+        return np.clip(frame, 0, 255).astype(np.uint8)
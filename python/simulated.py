@@ -0,0 +1,207 @@
+from hardware import clock
+
+# Simulated hardware for running the rig logic off the Pi
+# Every backend records what it was asked to do, stamped with clock.monotonic(),
+# so step timing and routine throughput can be measured without the rig.
+
+# A minimal byte stream that starts and ends like a JPEG, padded to a realistic size
+def fakeJpeg(size):
+    size = max(int(size), 4)
+    return b'\xff\xd8' + b'\x00' * (size - 4) + b'\xff\xd9'
+
+
+class SimGPIO(object):
+    # Stands in for the RPi.GPIO module. Pin changes are recorded in
+    # self.transitions as (time, pin, value); writing the level a pin already has is not a transition.
+    BCM = 11
+    BOARD = 10
+    OUT = 0
+    IN = 1
+    LOW = 0
+    HIGH = 1
+
+    def __init__(self, record=True):
+        self.record = record
+        self.levels = {}
+        self.transitions = []
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, channels, direction, initial=None):
+        if not isinstance(channels, (list, tuple)):
+            channels = [channels]
+        for channel in channels:
+            self.levels.setdefault(channel, self.LOW)
+            if initial is not None:
+                self.output(channel, initial)
+
+    def output(self, channels, values):
+        if not isinstance(channels, (list, tuple)):
+            channels = [channels]
+        if not isinstance(values, (list, tuple)):
+            values = [values] * len(channels)
+        now = clock.monotonic()
+        for channel, value in zip(channels, values):
+            value = 1 if value else 0
+            if self.levels.get(channel) != value:
+                self.levels[channel] = value
+                if self.record:
+                    self.transitions.append((now, channel, value))
+
+    def input(self, channel):
+        return self.levels.get(channel, self.LOW)
+
+    def PWM(self, channel, frequency):
+        return SimPWM(self, channel, frequency)
+
+    def cleanup(self, channels=None):
+        self.levels = {}
+
+    def pinHistory(self, pin): # (time, value) transitions for a single pin
+        return [(t, v) for t, p, v in self.transitions if p == pin]
+
+
+class SimPWM(object):
+    def __init__(self, gpio, channel, frequency):
+        self.gpio = gpio
+        self.channel = channel
+        self.frequency = frequency
+
+    def start(self, dutyCycle):
+        self.gpio.output(self.channel, self.gpio.HIGH if dutyCycle > 0 else self.gpio.LOW)
+
+    def ChangeDutyCycle(self, dutyCycle):
+        self.start(dutyCycle)
+
+    def ChangeFrequency(self, frequency):
+        self.frequency = frequency
+
+    def stop(self):
+        self.gpio.output(self.channel, self.gpio.LOW)
+
+
+class SimCamera(object):
+    # Stands in for PiCamera. Captures take a modelled amount of time and every
+    # capture is recorded in self.captures with its port, start time, duration and size.
+    def __init__(self, stillLatency=0.9, framerate=10, bytesPerPixel=0.4):
+        self.resolution = (4056, 3040)
+        self.framerate = framerate
+        self.stillLatency = stillLatency # mode switch, AE/AWB and full resolution encode
+        self.bytesPerPixel = bytesPerPixel # typical JPEG size relative to the pixel count
+        self.captures = []
+        self.previewing = False
+        self.shutter_speed = 0 # 0 is auto, as on PiCamera
+        self.autoExposure = 20000 # what auto exposure settled on
+        self.exposure_mode = 'auto'
+        self.analog_gain = 1.0
+        self.digital_gain = 1.0
+        self.awb_mode = 'auto'
+        self.awb_gains = (1.5, 1.2)
+
+    @property
+    def exposure_speed(self): # A set shutter speed is what the sensor uses, up to one frame, as PiCamera reports it
+        if not self.shutter_speed:
+            return self.autoExposure
+        return min(self.shutter_speed, int(1000000 / float(self.framerate)))
+
+    def jpegSize(self, resize=None):
+        width, height = resize or self.resolution
+        return int(width * height * self.bytesPerPixel)
+
+    def capture(self, output, format='jpeg', use_video_port=False, resize=None, **options):
+        start = clock.monotonic()
+        if use_video_port:
+            clock.sleep(1.0 / float(self.framerate))
+        else:
+            clock.sleep(self.stillLatency + self.shutter_speed / 1e6) # a set shutter speed adds to the capture
+        if format == 'jpeg':
+            data = fakeJpeg(self.jpegSize(resize))
+        else: # YUV, padded to 32 columns and 16 rows like the real camera
+            width, height = resize or self.resolution
+            data = b'\x80' * (((width + 31) // 32 * 32) * ((height + 15) // 16 * 16) * 3 // 2)
+        if isinstance(output, str):
+            with open(output, 'wb') as f:
+                f.write(data)
+        elif hasattr(output, 'write'):
+            output.write(data)
+        else: # A writable buffer such as a numpy array
+            view = memoryview(output).cast('B')
+            view[:len(data)] = data[:len(view)]
+        self.captures.append({
+            "port": "video" if use_video_port else "still",
+            "start": start,
+            "seconds": clock.monotonic() - start,
+            "bytes": len(data),
+        })
+
+    def capture_continuous(self, output, format='jpeg', use_video_port=False, **options):
+        while True:
+            self.capture(output, format, use_video_port, **options)
+            yield output
+
+    def start_preview(self, **options):
+        self.previewing = True
+
+    def stop_preview(self):
+        self.previewing = False
+
+    def close(self):
+        pass
+
+
+class SimDSLR(object):
+    # Stands in for the gphoto2 dslrCapture module: take_picture(filename)
+    def __init__(self, latency=3.0, imageBytes=8000000):
+        self.latency = latency # trigger, exposure and USB transfer
+        self.imageBytes = imageBytes
+        self.captures = []
+
+    def take_picture(self, filename):
+        start = clock.monotonic()
+        clock.sleep(self.latency)
+        with open(filename, 'wb') as f:
+            f.write(fakeJpeg(self.imageBytes))
+        self.captures.append({
+            "file": filename,
+            "start": start,
+            "seconds": clock.monotonic() - start,
+            "bytes": self.imageBytes,
+        })
+
+
+class SimWriter(object):
+    # Stands in for writer.WriterPool. Nothing reaches the disk: the card is modelled
+    # as one queue draining at bytesPerSecond on the shared clock, with the same
+    # maxPending backpressure, and the bytes and files that would be written are counted.
+    def __init__(self, bytesPerSecond=12000000, maxPending=6):
+        self.bytesPerSecond = float(bytesPerSecond)
+        self.maxPending = maxPending
+        self.finishTimes = []
+        self.busyUntil = 0.0
+        self.bytes = 0
+        self.files = 0
+
+    def submit(self, filename, data):
+        now = clock.monotonic()
+        self.finishTimes = [t for t in self.finishTimes if t > now]
+        if len(self.finishTimes) >= self.maxPending:
+            clock.sleepUntil(self.finishTimes.pop(0))
+        start = max(self.busyUntil, clock.monotonic())
+        self.busyUntil = start + len(data) / self.bytesPerSecond
+        self.finishTimes.append(self.busyUntil)
+        self.bytes += len(data)
+        self.files += 1
+
+    def pending(self):
+        now = clock.monotonic()
+        return len([t for t in self.finishTimes if t > now])
+
+    def flush(self):
+        clock.sleepUntil(self.busyUntil)
+
+    def close(self):
+        self.flush()
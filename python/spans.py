@@ -0,0 +1,94 @@
+import json
+import os
+import threading
+from hardware import clock
+
+# Routine phase spans
+# app.py wraps each phase of a routine (move, settle, capture, write, rotate)
+# in `with span("move"):`. Nothing is recorded unless a collector is attached,
+# in which case every finished span is handed to collector.add().
+# With no collector span() returns one shared do-nothing object, so the
+# instrumentation can stay in the motion and capture paths permanently.
+
+collector = None
+
+class NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_SPAN = NullSpan()
+
+
+class Span(object):
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = clock.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        if collector is not None:
+            collector.add(self.name, self.start, clock.monotonic(), self.args)
+        return False
+
+def span(name, **args): # Context manager timing one phase; a shared no-op when nothing is collecting
+    if collector is None:
+        return NULL_SPAN
+    return Span(name, args)
+
+def collect(newCollector): # Attach a collector (or None to stop), returns the previous one
+    global collector
+    previous = collector
+    collector = newCollector
+    return previous
+
+
+class PhaseTotals(object):
+    # Collector that adds up the time and count of each phase
+    def __init__(self):
+        self.seconds = {}
+        self.counts = {}
+
+    def add(self, name, start, end, args):
+        self.seconds[name] = self.seconds.get(name, 0.0) + (end - start)
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+
+class ChromeTrace(object):
+    # Collector that keeps every span, per thread, and saves them in the Chrome trace
+    # event format. Open the file in https://ui.perfetto.dev or chrome://tracing.
+    def __init__(self):
+        self.origin = clock.monotonic()
+        self.spans = []
+        self.threadNames = {}
+
+    def add(self, name, start, end, args):
+        thread = threading.current_thread()
+        self.threadNames[thread.ident] = thread.name
+        self.spans.append((name, start, end, thread.ident, args)) # list.append is atomic, writer threads add too
+
+    def events(self):
+        pid = os.getpid()
+        events = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+                  for tid, name in self.threadNames.items()]
+        for name, start, end, tid, args in self.spans:
+            events.append({
+                "name": name,
+                "cat": "routine",
+                "ph": "X",
+                "ts": (start - self.origin) * 1e6,
+                "dur": (end - start) * 1e6,
+                "pid": pid,
+                "tid": tid,
+                "args": args,
+            })
+        return events
+
+    def save(self, filename):
+        with open(filename, 'w') as f:
+            json.dump({"traceEvents": self.events(), "displayTimeUnit": "ms"}, f)
@@ -0,0 +1,115 @@
+from itertools import repeat
+from hardware import clock
+
+# Coil patterns for the 28BYJ-style focus rail stepper, one row per phase
+# Columns line up with the pin tuple handed to Stepper (in1_2, in2_2, in3_2, in4_2)
+FORWARD_PHASES = ((1, 0, 0, 0),
+                  (0, 1, 0, 0),
+                  (0, 0, 1, 0),
+                  (0, 0, 0, 1))
+REVERSE_PHASES = tuple(reversed(FORWARD_PHASES))
+COILS_OFF = (0, 0, 0, 0)
+
+def compileMove(cycles, phases=FORWARD_PHASES): # Flattens a move into the list of coil states to write, in order
+    return list(phases) * int(max(cycles, 0))
+
+
+class JitterHistogram(object):
+    # Counts how late each step was written relative to its deadline, in binWidth (sec) buckets
+    def __init__(self, binWidth=0.00005):
+        self.binWidth = binWidth
+        self.reset()
+
+    def reset(self):
+        self.counts = {}
+        self.steps = 0
+        self.worst = 0.0
+
+    def add(self, late):
+        late = max(late, 0.0)
+        bucket = int(late / self.binWidth)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.steps += 1
+        if late > self.worst:
+            self.worst = late
+
+    def percentile(self, p): # Upper edge (sec) of the bucket holding the p-th percentile step
+        if not self.steps:
+            return 0.0
+        target = self.steps * p / 100.0
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= target:
+                return (bucket + 1) * self.binWidth
+        return self.worst
+
+    def summary(self):
+        return {
+            "steps": self.steps,
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+            "worst": self.worst,
+            "bins": dict((str(int(round(bucket * self.binWidth * 1e6))) + "us", self.counts[bucket]) for bucket in sorted(self.counts)),
+        }
+
+
+class StepTimer(object):
+    # Paces a step loop against absolute deadlines on the monotonic clock, so
+    # oversleeping on one step is taken back on the next instead of adding up.
+    # The last `spin` seconds before each deadline are busy-waited for accuracy.
+    def __init__(self, spin=0.0002):
+        self.spin = spin
+        self.jitter = JitterHistogram()
+        self.recordJitter = True
+
+    def ticks(self, delays):
+        # Yields once per delay, at the moment the next phase should be written
+        deadline = clock.monotonic()
+        jitter = self.jitter
+        for delay in delays:
+            now = clock.monotonic()
+            late = now - deadline
+            if self.recordJitter:
+                jitter.add(late)
+            yield now
+            if late >= delay: # A whole step was lost; restart the schedule rather than rush to catch up
+                deadline = now
+            deadline += delay
+            clock.sleepUntil(deadline, self.spin)
+
+
+class Stepper(object):
+    # Drives a 4-coil stepper from a precompiled phase table. Each phase is one
+    # GPIO.output call on all four pins instead of four separate calls.
+    def __init__(self, gpio, pins, spin=0.0002):
+        self.gpio = gpio
+        self.pins = list(pins)
+        self.timer = StepTimer(spin)
+        for pin in self.pins:
+            gpio.setup(pin, gpio.OUT)
+
+    def run(self, table, sleepTime):
+        # sleepTime is either one delay for every phase or a per-phase plan from motion.planMove
+        if isinstance(sleepTime, (int, float)):
+            sleepTime = repeat(sleepTime, len(table))
+        output = self.gpio.output
+        pins = self.pins
+        # ticks comes first so the last phase is still held for its delay before zip stops
+        for tick, phase in zip(self.timer.ticks(sleepTime), table):
+            output(pins, phase)
+
+    def forward(self, cycles, sleepTime):
+        self.run(compileMove(cycles, FORWARD_PHASES), sleepTime)
+
+    def reverse(self, cycles, sleepTime):
+        self.run(compileMove(cycles, REVERSE_PHASES), sleepTime)
+
+    def release(self): # De-energise all coils
+        self.gpio.output(self.pins, COILS_OFF)
+
+
+def pulseSteps(gpio, stepPin, count, halfPeriod, timer): # Step/dir driver (Nema 17): count pulses, high and low for halfPeriod each
+    levels = (gpio.HIGH, gpio.LOW) * int(max(count, 0))
+    for tick, level in zip(timer.ticks(repeat(halfPeriod, len(levels))), levels):
+        gpio.output(stepPin, level)
@@ -0,0 +1,33 @@
+import os
+import sys
+
+import pytest
+
+# Tests run against the simulated hardware on the virtual clock
+#   cd python && python -m pytest tests
+
+os.environ.setdefault("SCANNER_BACKEND", "sim")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hardware import clock
+
+
+@pytest.fixture
+def virtualClock(): # The shared rig clock in virtual time for one test
+    saved = clock.virtual
+    clock.virtual = True
+    yield clock
+    clock.virtual = saved
+
+@pytest.fixture
+def rig(virtualClock, tmp_path, monkeypatch): # app.py on the simulated rig, shooting small routines into tmp_path
+    import app
+    monkeypatch.chdir(tmp_path)
+    for name, value in {"path": str(tmp_path), "projectName": "shot", "numberShots": 3, "numberStacks": 2,
+                        "cameraMovement": 10, "shotPause": 0.01, "stackNumber": 1, "shotNumber": 1,
+                        "sliderPosition": 0, "routineMode": "Return Home", "stepMode": "Fixed",
+                        "settleMode": "Fixed", "bracketCount": 1, "manifest": None}.items():
+        monkeypatch.setattr(app, name, value)
+    yield app
+    if app.manifest is not None:
+        app.manifest.close()
@@ -0,0 +1,14 @@
+import numpy as np
+
+from align import resample, warpFrame
+
+
+def test_warp_matches_float_resample():
+    rng = np.random.default_rng(3)
+    frame = rng.integers(0, 256, (300, 401, 3), dtype=np.uint8)
+    transform = {"scale": 1.013, "dx": 4.6, "dy": -3.2}
+    warped = warpFrame(frame, transform)
+    expected = np.rint(resample(frame, 1.013, 4.6, -3.2))
+    assert warped.dtype == np.uint8 and warped.shape == frame.shape
+    assert np.abs(warped - expected).max() <= 2 # rows and columns are each rounded in fixed point
+    assert np.array_equal(warpFrame(frame[..., 1], transform), warped[..., 1])
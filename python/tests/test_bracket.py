@@ -0,0 +1,25 @@
+import numpy as np
+
+from bracket import KERNEL, expandBands, mergeExposures, shrink
+
+
+def naiveBlur(image, step=1): # Whole-image 5 tap blur with repeated edges
+    padded = np.pad(image.astype(np.float64), [(2, 2), (2, 2)] + [(0, 0)] * (image.ndim - 2), mode='edge')
+    height, width = image.shape[:2]
+    rows = sum(KERNEL[i] * padded[i:i + height] for i in range(5))
+    return sum(KERNEL[i] * rows[:, i:i + width] for i in range(5))[::step, ::step]
+
+def test_banded_filters_match_whole_image_blur():
+    image = np.random.default_rng(4).integers(0, 256, (203, 131, 3), dtype=np.uint8) # not a multiple of the band
+    assert np.allclose(shrink(image), naiveBlur(image, 2), atol=1e-3)
+    coarse = shrink(image)
+    expanded = np.empty(image.shape, np.float32)
+    for top, bottom, band in expandBands(coarse, image.shape[:2]):
+        expanded[top:bottom] = band
+    enlarged = coarse.repeat(2, axis=0).repeat(2, axis=1)[:image.shape[0], :image.shape[1]]
+    assert np.allclose(expanded, naiveBlur(enlarged), atol=1e-3)
+
+def test_merging_identical_brackets_gives_the_frame_back():
+    frame = np.random.default_rng(5).integers(20, 235, (160, 240, 3), dtype=np.uint8)
+    merged = mergeExposures([frame, frame.copy(), frame.copy()])
+    assert np.abs(merged.astype(int) - frame).max() <= 1
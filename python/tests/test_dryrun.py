@@ -0,0 +1,18 @@
+import pytest
+
+from dryrun import dryRun
+
+
+def test_refuses_while_a_routine_or_preview_runs(rig, monkeypatch):
+    monkeypatch.setattr(rig.routineControl, "running", True)
+    with pytest.raises(RuntimeError):
+        dryRun(rig)
+    monkeypatch.setattr(rig.routineControl, "running", False)
+    monkeypatch.setattr(rig, "previewStream", object())
+    with pytest.raises(RuntimeError):
+        dryRun(rig)
+
+def test_estimates_between_routines(rig):
+    estimate = dryRun(rig)
+    assert estimate["frames"] == rig.numberShots * rig.numberStacks and estimate["seconds"] > 0
+    assert estimate["phases"]["write"] == pytest.approx(estimate["bytes"] / 12000000.0) and estimate["phases"]["write"] > 0
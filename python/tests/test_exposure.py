@@ -0,0 +1,58 @@
+import os
+
+
+def test_single_stack_locks_and_releases_exposure(rig, monkeypatch):
+    monkeypatch.setattr(rig, "lockExposureMode", True)
+    locks = []
+    shoot = rig.shoot
+    def recording(*args):
+        locks.append((rig.exposureLock is not None, rig.camera.exposure_mode, rig.camera.awb_mode))
+        return shoot(*args)
+    monkeypatch.setattr(rig, "shoot", recording)
+    rig.runStackRoutine()
+    assert locks == [(True, 'off', 'off')] * rig.numberShots
+    assert rig.exposureLock is None
+    assert (rig.camera.exposure_mode, rig.camera.awb_mode, rig.camera.shutter_speed) == ('auto', 'auto', 0)
+
+def test_brackets_are_checked_against_the_lock(rig, monkeypatch, capsys):
+    monkeypatch.setattr(rig, "lockExposureMode", True)
+    monkeypatch.setattr(rig, "bracketCount", 3)
+    rig.runStackRoutine()
+    assert "drifted" not in capsys.readouterr().out
+
+    monkeypatch.setattr(rig.camera, "analog_gain", 2.0) # the gains were not held
+    rig.lockExposure({"exposure_speed": 20000, "analog_gain": 1.0, "digital_gain": 1.0, "awb_gains": [1.5, 1.2]})
+    try:
+        rig.shootBrackets("shot_1/shot01.jpg")
+    finally:
+        rig.releaseExposure()
+    assert capsys.readouterr().out.count("Exposure drifted: analog_gain") == 1
+
+def test_routine_releases_exposure_when_it_fails(rig, monkeypatch):
+    monkeypatch.setattr(rig, "lockExposureMode", True)
+    def failing():
+        raise IOError("simulated crash")
+    monkeypatch.setattr(rig, "rotateDolly", failing)
+    monkeypatch.setattr(rig, "routineMode", "Serpentine")
+    try:
+        rig.runFullRoutine()
+    except IOError:
+        pass
+    assert rig.exposureLock is None and rig.camera.exposure_mode == 'auto'
+
+def test_brackets_lower_the_framerate_for_long_shutters(rig, monkeypatch, capsys):
+    monkeypatch.setattr(rig, "bracketCount", 3)
+    monkeypatch.setattr(rig.camera, "framerate", 30)
+    monkeypatch.setattr(rig.camera, "shutter_speed", 20000) # the long bracket is 80000 µs, over 1/30 s
+    exposures = []
+    capture = rig.camera.capture
+    def recording(*args, **kwargs):
+        capture(*args, **kwargs)
+        exposures.append(rig.camera.exposure_speed)
+    monkeypatch.setattr(rig.camera, "capture", recording)
+    os.mkdir("shot_1")
+    rig.path = "shot_1"
+    rig.shootBrackets("shot_1/shot01.jpg")
+    assert exposures == [5000, 20000, 80000]
+    assert rig.camera.framerate == 30 and rig.camera.shutter_speed == 20000
+    assert "instead of" not in capsys.readouterr().out
@@ -0,0 +1,51 @@
+import os
+
+import numpy as np
+
+import fusion
+from fusion import FusionStage, stackFrames
+
+
+def test_stack_frames_only_takes_the_project_frames(tmp_path):
+    folder = tmp_path / "shot_3"
+    folder.mkdir()
+    for name in ("shot01.jpg", "shot02.JPG", "shot10.png", "shot_3_index.png", "notes 2.jpg",
+                 "thumb03.jpg", "shot04.jpg.xmp-tmp", "shot05_1.jpg"):
+        (folder / name).write_bytes(b"")
+    assert [(shot, name[len(str(folder)) + 1:]) for shot, name in stackFrames(str(folder))] == \
+        [(1, "shot01.jpg"), (2, "shot02.JPG"), (10, "shot10.png")]
+
+def test_stage_does_not_save_a_stack_with_a_failed_frame(monkeypatch):
+    def decode(data):
+        if data == b"bad":
+            raise ValueError("corrupt frame")
+        return np.full((8, 8, 3), data[0], np.uint8)
+    saved = []
+    monkeypatch.setattr(fusion, "decodeJpeg", decode)
+    monkeypatch.setattr(fusion.StackFuser, "save", lambda self, prefix: saved.append((prefix, self.frames)))
+    stage = FusionStage(align=False)
+    stage.begin("shot_1")
+    stage.queue.put(("frame", 1, b"\x10"))
+    stage.queue.put(("frame", 2, b"bad"))
+    stage.queue.put(("frame", 3, b"\x20"))
+    stage.finish()
+    stage.flush() # the failure stays on the fusion thread
+    assert saved == [] and [prefix for prefix, error in stage.failures] == ["shot_1"]
+
+    stage.begin("shot_2") # the next stack is fused as usual
+    stage.submit(1, b"\x10")
+    stage.submit(2, b"\x20")
+    stage.finish()
+    stage.close()
+    assert saved == [("shot_2", 2)]
+
+def test_failed_fuse_does_not_stop_the_routine(rig, monkeypatch):
+    def decode(data):
+        raise ValueError("corrupt frame")
+    monkeypatch.setattr(fusion, "decodeJpeg", decode)
+    monkeypatch.setattr(rig, "fusionMode", True)
+    monkeypatch.setattr(rig, "stackFusion", None)
+    rig.runFullRoutine()
+    rig.stackFusion.close()
+    assert [prefix for prefix, error in rig.stackFusion.failures] == ["shot_1", "shot_2"]
+    assert sorted(os.listdir("shot_2")) == ["shot01.jpg", "shot02.jpg", "shot03.jpg"]
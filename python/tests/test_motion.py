@@ -0,0 +1,31 @@
+from motion import planMove, rampLength
+
+START, CRUISE, ACCELERATION = 0.004, 0.001, 200000 # phases/sec^2, a ramp of a few phases
+
+
+def segments(plan): # (accelerating, cruising, decelerating) phase counts of a plan
+    cruising = plan.count(CRUISE)
+    first = plan.index(CRUISE) if cruising else len(plan)
+    return first, cruising, len(plan) - first - cruising
+
+def test_long_move_ramps_up_cruises_and_ramps_down():
+    ramp = rampLength(START, CRUISE, ACCELERATION)
+    assert ramp > 1
+    for profile in ("trapezoid", "s-curve"):
+        plan = planMove(100, START, CRUISE, ACCELERATION, profile)
+        assert segments(plan) == (ramp, 100 - 2 * ramp, ramp)
+        assert plan[0] == plan[-1] == START
+        assert plan[:ramp] == sorted(plan[:ramp], reverse=True) and plan == plan[::-1]
+
+def test_short_move_never_reaches_cruise():
+    ramp = rampLength(START, CRUISE, ACCELERATION)
+    for phases in (1, 2, ramp, 2 * ramp - 1):
+        plan = planMove(phases, START, CRUISE, ACCELERATION)
+        assert len(plan) == phases and CRUISE not in plan
+        assert min(plan) > CRUISE and plan[0] == START and plan == plan[::-1]
+    assert CRUISE not in planMove(2 * ramp, START, CRUISE, ACCELERATION)
+    assert segments(planMove(2 * ramp + 1, START, CRUISE, ACCELERATION)) == (ramp, 1, ramp)
+
+def test_constant_profile_and_empty_moves():
+    assert planMove(5, START, CRUISE, ACCELERATION, "constant") == [CRUISE] * 5
+    assert planMove(0, START, CRUISE, ACCELERATION) == []
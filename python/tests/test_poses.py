@@ -0,0 +1,25 @@
+import numpy as np
+
+from align import Aligner, loadReference, loadTransforms, transformsFile
+from manifest import Manifest
+from poses import framesToExport
+
+
+def test_fused_stack_takes_pose_of_alignment_reference(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    manifest = Manifest("shot_manifest.sqlite")
+    for stack in (1, 2):
+        for shot, position in ((3, 0), (2, 10), (1, 20)): # a backwards stack: shot 3 is taken first
+            manifest.add("shot_" + str(stack) + "/shot0" + str(shot) + ".jpg", b"", stack=stack, shot=shot,
+                         angle=5.0 * (stack - 1), slider_position=position, captured_at=100.0 * stack - shot)
+    aligner = Aligner()
+    frame = np.random.default_rng(0).integers(0, 256, (256, 384), dtype=np.uint8)
+    for shot in (3, 2, 1):
+        aligner.add(shot, frame)
+    aligner.save(transformsFile("shot_1"))
+    assert loadReference("shot_1") == 3 and sorted(loadTransforms("shot_1")) == [1, 2, 3]
+
+    frames = framesToExport(manifest, fused=True)
+    manifest.close()
+    assert frames == [("shot_1_fused.jpg", 0.0, 0), # aligned to the first frame shot
+                      ("shot_2_fused.jpg", 5.0, 20)] # no alignment cached: the lowest shot
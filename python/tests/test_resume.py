@@ -0,0 +1,121 @@
+import hashlib
+import os
+
+from journal import resumePoint
+from xmp import readXMP
+
+
+def crashOnCapture(rig, monkeypatch, count): # The camera fails on its count'th capture, like a power cut
+    capture = rig.camera.capture
+    calls = []
+    def failing(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == count:
+            raise IOError("simulated crash")
+        return capture(*args, **kwargs)
+    monkeypatch.setattr(rig.camera, "capture", failing)
+    return lambda: monkeypatch.setattr(rig.camera, "capture", capture)
+
+def test_resume_stack_with_folder_but_no_shots(rig, monkeypatch):
+    restore = crashOnCapture(rig, monkeypatch, rig.numberShots + 1) # first frame of the second stack
+    try:
+        rig.runFullRoutine()
+    except IOError:
+        pass
+    restore()
+    rig.imageWriter.flush()
+    assert os.path.isdir("shot_2") and not os.listdir("shot_2")
+    assert resumePoint("shot_journal.jsonl")["stack"] == 1
+
+    rig.resumeFullRoutine("shot_journal.jsonl")
+    assert resumePoint("shot_journal.jsonl") is None
+    assert sorted(os.listdir("shot_2")) == ["shot01.jpg", "shot02.jpg", "shot03.jpg"]
+
+def test_resume_keeps_bracketed_shots(rig, monkeypatch):
+    monkeypatch.setattr(rig, "bracketCount", 3)
+    restore = crashOnCapture(rig, monkeypatch, 2 * 3 + 1) # first bracket of the third shot
+    try:
+        rig.runFullRoutine()
+    except IOError:
+        pass
+    restore()
+    rig.imageWriter.flush()
+    point = resumePoint("shot_journal.jsonl")
+    assert (point["stack"], point["shot"]) == (0, 2)
+    assert len(point["files"]) == 6 and all(os.path.exists(file) for file in point["files"])
+
+    rig.resumeFullRoutine("shot_journal.jsonl")
+    assert resumePoint("shot_journal.jsonl") is None
+    assert len(os.listdir("shot_1_brackets")) == 9
+    assert not os.listdir("shot_1") # the frames themselves are merged in post-processing
+
+def focusOrdered(rig, stack): # Shot numbers, files and tags of a stack run from 01 nearest home
+    rows = rig.manifest.query("stack = ? ORDER BY shot", stack)
+    assert [row["shot"] for row in rows] == list(range(1, len(rows) + 1))
+    assert [row["file"] for row in rows] == [rig.frameName("shot_" + str(stack), row["shot"]) for row in rows]
+    positions = [row["slider_position"] for row in rows]
+    assert positions[0] == 0 and positions == sorted(positions)
+    for row in rows:
+        with open(row["file"], 'rb') as f:
+            data = f.read()
+        assert ('scanner:Shot="' + str(row["shot"]) + '"').encode() in readXMP(data)
+        assert hashlib.sha1(data).hexdigest() == row["sha1"]
+    return rows
+
+def test_adaptive_serpentine_numbers_shots_in_focus_order(rig, monkeypatch):
+    monkeypatch.setattr(rig, "stepMode", "Adaptive")
+    monkeypatch.setattr(rig, "routineMode", "Serpentine")
+    rig.runFullRoutine()
+    rig.imageWriter.flush()
+    rows = focusOrdered(rig, 2)
+    assert all(row["backwards"] == 1 for row in rows)
+    assert rows[-1]["slider_position"] == (rig.numberShots - 1) * rig.cameraMovement
+    assert sorted(os.listdir("shot_2")) == sorted(os.path.basename(row["file"]) for row in rows)
+    assert not any(row["backwards"] for row in rig.manifest.query("stack = 1"))
+    assert rig.routineControl.shots == len(rows)
+
+def test_adaptive_resume_finishes_renumbering(rig, monkeypatch):
+    monkeypatch.setattr(rig, "stepMode", "Adaptive")
+    monkeypatch.setattr(rig, "routineMode", "Serpentine")
+    replace = os.replace
+    calls = []
+    def failing(source, target):
+        if source.endswith(".renumber"):
+            calls.append(1)
+            if len(calls) == 2: # a power cut half way through putting the frames back
+                raise IOError("simulated crash")
+        return replace(source, target)
+    monkeypatch.setattr(os, "replace", failing)
+    try:
+        rig.runFullRoutine()
+    except IOError:
+        pass
+    monkeypatch.setattr(os, "replace", replace)
+    point = resumePoint("shot_journal.jsonl")
+    assert point["stack"] == 1 and point["renumber"]["phase"] == "staged"
+
+    rig.resumeFullRoutine("shot_journal.jsonl")
+    assert resumePoint("shot_journal.jsonl") is None
+    rows = focusOrdered(rig, 2)
+    assert sorted(os.listdir("shot_2")) == sorted(os.path.basename(row["file"]) for row in rows)
+
+def test_adaptive_resume_after_last_shot_takes_no_more(rig, monkeypatch):
+    monkeypatch.setattr(rig, "stepMode", "Adaptive")
+    monkeypatch.setattr(rig, "routineMode", "Serpentine")
+    rotateDolly = rig.rotateDolly
+    def failing():
+        raise IOError("simulated crash")
+    monkeypatch.setattr(rig, "rotateDolly", failing) # the stack is shot but not journaled as done
+    try:
+        rig.runFullRoutine()
+    except IOError:
+        pass
+    monkeypatch.setattr(rig, "rotateDolly", rotateDolly)
+    rig.imageWriter.flush()
+    shot = sorted(os.listdir("shot_1"))
+    point = resumePoint("shot_journal.jsonl")
+    assert (point["stack"], point["shot"]) == (0, len(shot))
+
+    rig.resumeFullRoutine("shot_journal.jsonl")
+    assert sorted(os.listdir("shot_1")) == shot
+    assert len(rig.manifest.query("stack = 1")) == len(shot)
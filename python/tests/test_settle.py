@@ -0,0 +1,20 @@
+from settle import SyntheticFrameSource, waitForSettle
+
+def test_releases_once_vibration_decays(virtualClock):
+    source = SyntheticFrameSource(amplitude=6.0, decay=0.6)
+    start = virtualClock.monotonic()
+    assert waitForSettle(source, threshold=2.0, timeout=2.0)
+    waited = virtualClock.monotonic() - start
+    assert waited < 0.5 # a handful of frames, well before the fixed pause would end
+    assert source.frames < 15
+
+def test_still_scene_releases_after_stable_frames(virtualClock):
+    source = SyntheticFrameSource(amplitude=0.0)
+    assert waitForSettle(source, threshold=2.0, timeout=2.0, stableFrames=2)
+    assert source.frames == 3 # the first frame plus two that match it
+
+def test_times_out_when_rig_never_settles(virtualClock):
+    source = SyntheticFrameSource(amplitude=6.0, decay=1.0) # the vibration never dies down
+    start = virtualClock.monotonic()
+    assert not waitForSettle(source, threshold=2.0, timeout=1.0)
+    assert virtualClock.monotonic() - start >= 1.0
@@ -0,0 +1,28 @@
+import pytest
+
+from motion import planMove
+from simulated import SimGPIO
+from stepper import Stepper, StepTimer, pulseSteps
+
+PINS = (11, 13, 15, 16)
+
+
+def test_step_pulses_are_evenly_spaced(virtualClock):
+    gpio = SimGPIO()
+    gpio.setup(7, gpio.OUT)
+    pulseSteps(gpio, 7, 5, 0.001, StepTimer())
+    history = gpio.pinHistory(7)
+    assert [value for t, value in history] == [1, 0] * 5
+    assert [b[0] - a[0] for a, b in zip(history, history[1:])] == pytest.approx([0.001] * 9)
+
+def test_coils_follow_the_move_plan(virtualClock):
+    gpio = SimGPIO()
+    motor = Stepper(gpio, PINS)
+    plan = planMove(4 * 10, 0.004, 0.001, 200000)
+    motor.forward(10, plan)
+    rises = [t for t, value in gpio.pinHistory(PINS[0]) if value]
+    assert len(rises) == 10 # the first coil is energised once per cycle
+    cycles = [sum(plan[i:i + 4]) for i in range(0, len(plan) - 4, 4)]
+    assert [b - a for a, b in zip(rises, rises[1:])] == pytest.approx(cycles)
+    starts = [gpio.pinHistory(pin)[0][0] for pin in PINS]
+    assert starts == sorted(starts) # forward energises the coils in pin order
@@ -0,0 +1,29 @@
+import os
+
+import pytest
+
+from writer import WriterPool
+
+
+def test_frames_appear_only_once_complete(tmp_path, monkeypatch):
+    seen = []
+    replace = os.replace
+    def recording(source, target): # what is on disk just before the frame gets its real name
+        seen.append((os.path.exists(target), os.path.getsize(source)))
+        replace(source, target)
+    monkeypatch.setattr(os, "replace", recording)
+    pool = WriterPool()
+    pool.submit(str(tmp_path / "shot01.jpg"), b"x" * 1000)
+    pool.close()
+    assert seen == [(False, 1000)]
+    assert os.listdir(str(tmp_path)) == ["shot01.jpg"]
+
+def test_failed_write_leaves_no_frame(tmp_path, monkeypatch):
+    def failing(descriptor):
+        raise OSError("card removed")
+    monkeypatch.setattr(os, "fsync", failing)
+    pool = WriterPool()
+    pool.submit(str(tmp_path / "shot01.jpg"), b"x" * 1000)
+    with pytest.raises(OSError):
+        pool.close()
+    assert not os.path.exists(str(tmp_path / "shot01.jpg"))
@@ -0,0 +1,52 @@
+import hashlib
+import struct
+
+from manifest import Manifest
+from xmp import injectXMP, readXMP, tagProject, xmpPacket
+
+
+class FakeCamera(object):
+    iso = 200
+    shutter_speed = 8000
+    exposure_speed = 7998
+    analog_gain = 1.5
+    digital_gain = 1.0
+    awb_gains = (1.6, 1.3)
+
+def jpeg(): # SOI, JFIF, EXIF, a quantisation table, then scan data
+    segment = lambda marker, payload: b"\xff" + marker + struct.pack(">H", 2 + len(payload)) + payload
+    return (b"\xff\xd8" + segment(b"\xe0", b"JFIF\x00") + segment(b"\xe1", b"Exif\x00\x00abcd")
+            + segment(b"\xdb", b"q" * 64) + b"\xff\xda" + bytes(range(256)) * 40 + b"\xff\xd9")
+
+def test_inject_keeps_scan_data_and_replaces_old_packet():
+    data = jpeg()
+    first = injectXMP(data, xmpPacket({"Shot": 1}))
+    second = injectXMP(first, xmpPacket({"Shot": 2}))
+    assert readXMP(second) == xmpPacket({"Shot": 2})
+    assert second.index(b"Exif") < second.index(b"http://ns.adobe.com/xap/1.0/") < second.index(b"qqqq")
+    assert second.endswith(data[data.index(b"\xff\xda"):])
+    assert len(second) == len(injectXMP(data, xmpPacket({"Shot": 2})))
+
+def test_tag_project_only_updates_digest(tmp_path):
+    frame = tmp_path / "shot01.jpg"
+    frame.write_bytes(jpeg())
+    manifestFile = str(tmp_path / "shot_manifest.sqlite")
+    manifest = Manifest(manifestFile)
+    manifest.add(str(frame), frame.read_bytes(), FakeCamera(), project="shot", stack=1, shot=1,
+                 angle=5.0, slider_position=30, captured_at=1700000000.0)
+    before = manifest.query()[0]
+    manifest.close()
+
+    assert tagProject(manifestFile) == (1, 0)
+
+    manifest = Manifest(manifestFile)
+    after = manifest.query()[0]
+    manifest.close()
+    data = frame.read_bytes()
+    assert readXMP(data) is not None
+    assert after["bytes"] == len(data)
+    assert after["sha1"] == hashlib.sha1(data).hexdigest()
+    for column in before:
+        if column not in ("bytes", "sha1"):
+            assert after[column] == before[column], column
+    assert after["iso"] == 200 and after["analog_gain"] == 1.5 and after["awb_red"] == 1.6
@@ -0,0 +1,68 @@
+import os
+import queue
+import threading
+from spans import span
+
+# Background image writer
+# Captures land in memory and are handed to a small pool of threads that write
+# them to the SD card, so the next rail move and settle overlap with disk I/O.
+# The queue is bounded: when the card falls behind, submit() blocks until a
+# slot frees up instead of letting captures pile up in RAM. Each file is
+# written under a temporary name, synced and then renamed into place, so a
+# frame that exists is complete: a resume (journal.py) never keeps a frame
+# the power cut off half way.
+
+class WriterPool(object):
+    def __init__(self, workers=2, maxPending=6):
+        self.queue = queue.Queue(maxPending)
+        self.error = None
+        self.threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self.run, name="image-writer-" + str(i))
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None:
+                    return
+                filename, data = job
+                with span("file write", bytes=len(data)):
+                    temporary = filename + ".tmp"
+                    with open(temporary, 'wb') as f:
+                        f.write(data)
+                        f.flush()
+                        os.fsync(f.fileno())
+                    os.replace(temporary, filename)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def checkError(self): # Re-raise a failed write on the capture thread
+        if self.error is not None:
+            error = self.error
+            self.error = None
+            raise error
+
+    def submit(self, filename, data): # Blocks while maxPending writes are already queued
+        self.checkError()
+        self.queue.put((filename, data))
+
+    def pending(self): # Number of captures not yet written
+        return self.queue.unfinished_tasks
+
+    def flush(self): # Wait until everything submitted so far is on disk
+        self.queue.join()
+        self.checkError()
+
+    def close(self):
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        self.checkError()
@@ -0,0 +1,154 @@
+import datetime
+import json
+import os
+import re
+import struct
+from xml.sax.saxutils import quoteattr
+
+# Rig metadata in the JPEGs
+# Every frame gets an XMP packet with its project, stack, shot, turntable
+# angle, rail position and the routine settings. The packet is spliced into
+# the JPEG byte stream as an APP1 segment after the camera's own JFIF/EXIF
+# segments, so the compressed image data is copied untouched: nothing is
+# decoded or re-encoded. Works on the bytes from shoot() before they are
+# written, and in bulk on project folders that are already on disk:
+#   python xmp.py shot_manifest.sqlite     tags every frame in the manifest
+
+XMP_ID = b"http://ns.adobe.com/xap/1.0/\x00"
+NAMESPACE = "http://ns.scanner-companion.org/1.0/"
+MAX_PACKET = 65535 - 2 - len(XMP_ID) # an APP segment length field is 16 bits and counts itself
+
+def xmpPacket(fields): # XMP packet with one scanner:<Name> attribute per field; dicts and lists are stored as JSON
+    attributes = []
+    for name in sorted(fields):
+        value = fields[name]
+        if value is None:
+            continue
+        if isinstance(value, (dict, list, tuple)):
+            value = json.dumps(value, sort_keys=True)
+        attributes.append("scanner:" + name + "=" + quoteattr(str(value)))
+    return ('<?xpacket begin="\ufeff" id="W5M0MpCehiHzreSzNTczkc9d"?>\n'
+            '<x:xmpmeta xmlns:x="adobe:ns:meta/">\n'
+            ' <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">\n'
+            '  <rdf:Description rdf:about="" xmlns:scanner="' + NAMESPACE + '"\n   '
+            + "\n   ".join(attributes) + "/>\n"
+            ' </rdf:RDF>\n'
+            '</x:xmpmeta>\n'
+            '<?xpacket end="w"?>').encode('utf-8')
+
+def segments(data):
+    # (marker, start, end) of each header segment of a JPEG, up to the start of scan
+    if data[:2] != b"\xff\xd8":
+        raise ValueError("not a JPEG")
+    position = 2
+    while position + 4 <= len(data):
+        if data[position] != 0xFF: # not a marker: treat it as the end of the header
+            return
+        marker = data[position + 1]
+        if marker == 0xFF: # fill byte
+            position += 1
+            continue
+        if marker == 0xDA: # start of scan: image data follows
+            return
+        length = struct.unpack(">H", data[position + 2:position + 4])[0]
+        yield marker, position, position + 2 + length
+        position += 2 + length
+
+def isXMP(data, start): # Is the APP1 segment at start an XMP packet (not EXIF)
+    return data[start + 1] == 0xE1 and data[start + 4:start + 4 + len(XMP_ID)] == XMP_ID
+
+def injectXMP(data, packet):
+    # The JPEG bytes with packet in an APP1 segment after the leading JFIF/EXIF segments,
+    # replacing any XMP segment already there. Only the header is parsed; the rest is copied.
+    if len(packet) > MAX_PACKET:
+        raise ValueError("XMP packet too large for one segment (" + str(len(packet)) + " bytes)")
+    view = memoryview(data) # slices of a memoryview are not copies, so the image data is copied once, by join()
+    leading = []
+    rest = []
+    headerEnd = 2
+    for marker, start, end in segments(data):
+        headerEnd = end
+        if isXMP(data, start):
+            continue
+        if not rest and marker in (0xE0, 0xE1): # stay after JFIF and EXIF, which readers expect first
+            leading.append(view[start:end])
+        else:
+            rest.append(view[start:end])
+    segment = b"\xff\xe1" + struct.pack(">H", 2 + len(XMP_ID) + len(packet)) + XMP_ID + packet
+    return b"".join([view[:2]] + leading + [segment] + rest + [view[headerEnd:]])
+
+def readXMP(data): # The XMP packet of a JPEG, or None
+    for marker, start, end in segments(data):
+        if isXMP(data, start):
+            return data[start + 4 + len(XMP_ID):end]
+    return None
+
+def shotFields(row, settings=None): # Packet fields for a shot manifest row (see manifest.py)
+    fields = {
+        "Project": row.get("project"),
+        "Stack": row.get("stack"),
+        "Shot": row.get("shot"),
+        "Angle": row.get("angle"),
+        "SliderPosition": row.get("slider_position"),
+        "Backwards": row.get("backwards"),
+    }
+    if row.get("captured_at") is not None:
+        fields["CapturedAt"] = datetime.datetime.fromtimestamp(row["captured_at"]).isoformat()
+    if settings is not None:
+        fields["Settings"] = settings
+    return fields
+
+def rewrite(filename, data): # Replace a file on disk via a temporary file, so a crash cannot truncate it
+    temporary = filename + ".xmp-tmp"
+    with open(temporary, 'wb') as f:
+        f.write(data)
+    os.replace(temporary, filename)
+    return data
+
+def tagFile(filename, fields): # Rewrite one JPEG on disk with the packet; returns the new bytes
+    with open(filename, 'rb') as f:
+        return rewrite(filename, injectXMP(f.read(), xmpPacket(fields)))
+
+def retagField(filename, name, value):
+    # Change one field of a tagged JPEG on disk and leave the rest of its packet as it is.
+    # Returns the new bytes, or None if the file has no packet or no such field.
+    with open(filename, 'rb') as f:
+        data = f.read()
+    packet = readXMP(data)
+    if packet is None:
+        return None
+    attribute = ("scanner:" + name + "=").encode('utf-8')
+    packet, found = re.subn(re.escape(attribute) + rb'"[^"]*"', lambda match: attribute + quoteattr(str(value)).encode('utf-8'), packet)
+    if not found:
+        return None
+    return rewrite(filename, injectXMP(data, packet))
+
+def tagProject(manifestFile, settings=None):
+    # Tag every frame listed in a shot manifest, and update the size and SHA-1 the
+    # manifest has for it. Returns (tagged, missing).
+    from manifest import Manifest
+    manifest = Manifest(manifestFile)
+    tagged = missing = 0
+    try:
+        for row in manifest.query("1 ORDER BY stack, shot"):
+            if not os.path.exists(row["file"]):
+                missing += 1
+                continue
+            manifest.updateDigest(row["file"], tagFile(row["file"], shotFields(row, settings)))
+            tagged += 1
+    finally:
+        manifest.close()
+    return tagged, missing
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Add rig metadata (XMP) to the frames of a project without re-encoding them")
+    parser.add_argument("manifest", help="<projectName>_manifest.sqlite, run from the project folder")
+    parser.add_argument("--settings", help="exported settings (JSON) to include in every frame")
+    args = parser.parse_args()
+    settings = None
+    if args.settings:
+        with open(args.settings) as f:
+            settings = json.load(f)
+    tagged, missing = tagProject(args.manifest, settings)
+    print(str(tagged) + " frames tagged" + (", " + str(missing) + " missing" if missing else ""))